@@ -1,364 +1,4166 @@
 import streamlit as st
 import requests
 import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
 import openai
+import numpy as np
 import re
+import os
+import random
+import logging
+import math
+import functools
+import itertools
+from dataclasses import dataclass, asdict, field, is_dataclass, replace
+import io
+import gzip
+import zlib
+import queue
+import json
+import hashlib
+import sqlite3
+import socket
 from urllib.parse import urljoin, urlparse
+import urllib.robotparser
 import time
-from datetime import datetime
+import threading
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
 
-# Configurazione della pagina
-st.set_page_config(
-    page_title="SEO E-E-A-T Content Optimizer",
-    page_icon="🚀",
-    layout="wide"
+try:
+    import tiktoken
+except ImportError:  # conteggio dei token stimato
+    tiktoken = None
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # versioni di Streamlit senza runtime pubblico
+    add_script_run_ctx = get_script_run_ctx = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    'SEO_OPTIMIZER_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+)
+
+def api_key_digest(api_key):
+    """Impronta della API key usata come chiave di cache al posto della chiave in chiaro"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+@st.cache_resource(max_entries=32)
+def get_openai_client(key_digest, _api_key):
+    """Client OpenAI per API key, riutilizzato tra i rerun con il suo pool di connessioni keep-alive.
+
+    I tentativi sono gestiti da call_llm (backoff e RateLimiter condiviso),
+    quindi quelli automatici dell'SDK sono disattivati.
+    """
+    return openai.OpenAI(api_key=_api_key, max_retries=0, timeout=120, http_client=openai.DefaultHttpxClient())
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def validate_openai_key(key_digest, _api_key):
+    """Verifica la API key al massimo una volta all'ora; restituisce il messaggio d'errore o None se valida.
+
+    Solo il rifiuto della chiave viene memorizzato: gli errori di rete
+    vengono sollevati e quindi ritentati al rerun successivo. L'elenco dei
+    modelli non dipende da quali modelli il progetto può usare, a differenza
+    di models.retrieve su un modello specifico.
+    """
+    try:
+        get_openai_client(key_digest, _api_key).models.list()
+    except (openai.AuthenticationError, openai.PermissionDeniedError) as e:
+        return str(e)
+    return None
+
+def init_openai_client(api_key):
+    """Restituisce il client OpenAI della sessione, o None se la chiave non è valida"""
+    key_digest = api_key_digest(api_key)
+    try:
+        error = validate_openai_key(key_digest, api_key)
+    except Exception as e:
+        error = str(e)
+    if error:
+        st.error(f"Errore nella configurazione OpenAI: {error}")
+        return None
+    return get_openai_client(key_digest, api_key)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+def _open_sitemap_stream(source, session):
+    """Apre la sitemap (URL, passando dalla cache HTTP, o XML diretto) come stream binario"""
+    if source.startswith('http'):
+        return io.BufferedReader(open_url(source, session=session, timeout=30))
+    return io.BufferedReader(io.BytesIO(source.encode('utf-8')))
+
+def _decompress_if_gzip(stream):
+    """File .xml.gz serviti come application/x-gzip: riconosciuti dal magic number e decompressi al volo"""
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+SITEMAP_NAMESPACES = ('', 'http://www.sitemaps.org/schemas/sitemap/0.9', 'http://www.google.com/schemas/sitemap/0.84')
+# Tag qualificati del protocollo sitemap -> nome locale (un solo lookup per elemento)
+SITEMAP_TAGS = {
+    (f"{{{namespace}}}{name}" if namespace else name): name
+    for namespace in SITEMAP_NAMESPACES for name in ('url', 'sitemap', 'loc', 'lastmod')
+}
+
+def _parse_sitemap_document(stream, on_url, on_child_sitemap):
+    """Scorre la sitemap con iterparse senza costruire il DOM completo.
+
+    Per ogni <url> chiama on_url(loc, lastmod), per ogni <sitemap> di una
+    sitemap index chiama on_child_sitemap(loc); gli elementi già letti
+    vengono liberati subito così la memoria resta costante. Contano solo
+    <loc> e <lastmod> del namespace delle sitemap figli diretti di
+    <url>/<sitemap>: quelli delle estensioni (image:loc, news, xhtml) sono ignorati.
+    """
+    root = None
+    fields = {}
+    open_tags = []
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            open_tags.append(elem.tag)
+            continue
+        open_tags.pop()
+        tag = SITEMAP_TAGS.get(elem.tag)
+        if tag in ('loc', 'lastmod'):
+            if open_tags and SITEMAP_TAGS.get(open_tags[-1]) in ('url', 'sitemap'):
+                fields[tag] = (elem.text or '').strip()
+        elif tag in ('url', 'sitemap'):
+            loc = fields.get('loc')
+            if loc:
+                if tag == 'url':
+                    on_url(loc, fields.get('lastmod'))
+                else:
+                    on_child_sitemap(loc)
+            fields = {}
+            root.clear()
+
+def iter_sitemap_entries(sitemap_content, max_workers=4, max_depth=3, errors=None):
+    """Genera in streaming le voci {'loc', 'lastmod'} della sitemap, senza duplicati.
+
+    Le sitemap index vengono seguite ricorsivamente (fino a max_depth livelli)
+    scaricando le sitemap figlie in parallelo. Una coda limitata tra parser e
+    consumatore mantiene la memoria costante anche su sitemap molto grandi.
+    Gli errori sulle singole sitemap vengono aggiunti alla lista `errors`.
+    """
+    session = get_http_session()
+    entries = queue.Queue(maxsize=1000)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    seen_sitemaps = set()
+    outstanding = [0]
+    lock = threading.Lock()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                entries.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def submit(source, depth):
+        with lock:
+            if source in seen_sitemaps or depth > max_depth:
+                return
+            seen_sitemaps.add(source)
+            outstanding[0] += 1
+        executor.submit(parse, source, depth)
+
+    def parse(source, depth):
+        try:
+            with closing(_open_sitemap_stream(source, session)) as stream:
+                _parse_sitemap_document(
+                    _decompress_if_gzip(stream),
+                    on_url=lambda loc, lastmod: put(('url', {'loc': loc, 'lastmod': lastmod})),
+                    on_child_sitemap=lambda loc: submit(loc, depth + 1)
+                )
+        except Exception as e:
+            label = source if source.startswith('http') else 'XML diretto'
+            put(('error', f"{label}: {str(e)}"))
+        finally:
+            put(('done', None))
+
+    submit(sitemap_content.strip(), 0)
+    seen_urls = set()
+    try:
+        while True:
+            with lock:
+                if outstanding[0] == 0:
+                    break
+            kind, payload = entries.get()
+            if kind == 'done':
+                with lock:
+                    outstanding[0] -= 1
+            elif kind == 'error':
+                if errors is not None:
+                    errors.append(payload)
+            elif payload['loc'] not in seen_urls:
+                seen_urls.add(payload['loc'])
+                yield payload
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def extract_sitemap_entries(sitemap_content):
+    """Estrae le voci della sitemap XML (URL e lastmod), seguendo le sitemap index"""
+    errors = []
+    entries = list(iter_sitemap_entries(sitemap_content, errors=errors))
+    for error in errors:
+        st.error(f"Errore nell'estrazione della sitemap: {error}")
+    return entries
+
+def extract_sitemap_urls(sitemap_content):
+    """Estrae gli URL dalla sitemap XML"""
+    return [entry['loc'] for entry in extract_sitemap_entries(sitemap_content)]
+
+STOPWORDS = frozenset("""
+il lo la i gli le un uno una di da in con su per tra fra del dello della dei degli delle al allo alla ai agli alle
+dal dallo dalla dai dagli dalle nel nello nella nei negli nelle sul sullo sulla sui sugli sulle che chi cui non
+come dove quando anche piu più sono essere hai abbiamo questo questa questi queste quello quella loro nostro
+nostra vostro vostra the and for with from www http https com html htm php index page pagina
+""".split())
+
+def tokenize(text):
+    """Divide il testo (o lo slug di un URL) in termini normalizzati, senza stopword"""
+    return [t for t in re.findall(r'[a-zà-ÿ0-9]+', text.lower()) if len(t) > 2 and t not in STOPWORDS]
+
+class InternalLinkIndex:
+    """Indice BM25 sugli slug degli URL della sitemap (e opzionalmente sui titoli delle pagine).
+
+    Le posting list sono array NumPy, così il punteggio di una query è una
+    somma vettorizzata per termine anche su sitemap da decine di migliaia di URL.
+    """
+
+    def __init__(self, urls, titles=None, k1=1.2, b=0.75):
+        self.urls = list(urls)
+        self.k1 = k1
+        self.b = b
+        titles = titles or {}
+        postings = {}
+        doc_lengths = np.zeros(len(self.urls), dtype=np.float32)
+        for doc_id, url in enumerate(self.urls):
+            parsed = urlparse(url)
+            terms = tokenize(f"{parsed.path} {titles.get(url, '')}")
+            doc_lengths[doc_id] = len(terms)
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(tf)
+
+        n_docs = max(1, len(self.urls))
+        self.avg_length = float(doc_lengths.mean()) if len(self.urls) else 0.0
+        self.length_norm = 1 - b + b * doc_lengths / (self.avg_length or 1.0)
+        self.postings = {}
+        for term, (doc_ids, tfs) in postings.items():
+            df = len(doc_ids)
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            self.postings[term] = (np.array(doc_ids, dtype=np.int32), np.array(tfs, dtype=np.float32), idf)
+
+    def top_k(self, text, k=20, max_query_terms=200):
+        """Restituisce i k URL più pertinenti al testo, completando con quelli in ordine di sitemap"""
+        if not self.urls:
+            return []
+        query_counts = {}
+        for term in tokenize(text):
+            if term in self.postings:
+                query_counts[term] = query_counts.get(term, 0) + 1
+        query_terms = sorted(query_counts, key=query_counts.get, reverse=True)[:max_query_terms]
+
+        scores = np.zeros(len(self.urls), dtype=np.float32)
+        for term in query_terms:
+            doc_ids, tfs, idf = self.postings[term]
+            # Peso logaritmico della frequenza del termine nel contenuto da ottimizzare
+            weight = idf * (1 + np.log(query_counts[term]))
+            scores[doc_ids] += weight * tfs * (self.k1 + 1) / (tfs + self.k1 * self.length_norm[doc_ids])
+
+        k = min(k, len(self.urls))
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ranked = [int(i) for i in candidates[np.argsort(-scores[candidates], kind='stable')] if scores[i] > 0]
+        if len(ranked) < k:
+            chosen = set(ranked)
+            ranked += [i for i in range(len(self.urls)) if i not in chosen][:k - len(ranked)]
+        return [self.urls[i] for i in ranked]
+
+@st.cache_resource(max_entries=8)
+def get_link_index(urls_digest, _urls, _titles=None):
+    """Costruisce (una sola volta per sitemap) l'indice dei link interni; `_titles` può essere una funzione"""
+    return InternalLinkIndex(_urls, _titles() if callable(_titles) else _titles)
+
+def select_internal_links(sitemap_urls, content, k=20, titles=None):
+    """Seleziona dalla sitemap i k URL interni più pertinenti al contenuto.
+
+    Senza `titles` l'indice usa i metadati delle pagine già scansionate
+    (crawl_site) e viene ricostruito solo quando l'archivio cambia.
+    """
+    if not sitemap_urls:
+        return []
+    digest = hashlib.sha1('\n'.join(sitemap_urls).encode('utf-8'))
+    if titles:
+        digest.update(json.dumps(titles, sort_keys=True).encode('utf-8'))
+    else:
+        store = get_page_store()
+        digest.update(repr(store.revision()).encode('utf-8'))
+        titles = functools.partial(store.titles, sitemap_urls)
+    return get_link_index(digest.hexdigest(), sitemap_urls, titles).top_k(content, k)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+@st.cache_resource
+def get_http_session(pool_size=32):
+    """Restituisce una sessione HTTP condivisa con pool di connessioni keep-alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+class HTTPCache:
+    """Cache HTTP persistente su SQLite con corpi compressi (zlib) e rivalidazione condizionale.
+
+    Rispetta Cache-Control (no-store, no-cache, max-age) ed Expires; in loro
+    assenza una risposta con Last-Modified resta fresca per il 10% della sua
+    età (massimo un giorno), come da euristica RFC 9111. Le risposte scadute
+    vengono rivalidate con If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, path, max_bytes=500 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS http_cache ('
+                'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, expires_at REAL NOT NULL, '
+                'body BLOB NOT NULL, size INTEGER NOT NULL, stored_size INTEGER NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS http_cache_last_access ON http_cache (last_access)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def freshness_lifetime(headers):
+        """Durata di validità della risposta in secondi, None se non va salvata"""
+        directives = {}
+        for part in headers.get('Cache-Control', '').lower().split(','):
+            name, _, value = part.strip().partition('=')
+            if name:
+                directives[name] = value.strip('"')
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return 0
+        if 'max-age' in directives:
+            try:
+                return max(0, int(directives['max-age']))
+            except ValueError:
+                return 0
+        try:
+            date = parsedate_to_datetime(headers['Date']) if headers.get('Date') else datetime.now(timezone.utc)
+            if headers.get('Expires'):
+                return max(0, (parsedate_to_datetime(headers['Expires']) - date).total_seconds())
+            if headers.get('Last-Modified'):
+                age = (date - parsedate_to_datetime(headers['Last-Modified'])).total_seconds()
+                return min(max(0, age * 0.1), 24 * 3600)
+        except (TypeError, ValueError):
+            pass
+        return 0
+
+    def lookup(self, url):
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT etag, last_modified, expires_at, body, size FROM http_cache WHERE url = ?', (url,)
+            ).fetchone()
+            if row is not None:
+                conn.execute('UPDATE http_cache SET last_access = ? WHERE url = ?', (time.time(), url))
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'expires_at': row[2], 'body': row[3], 'size': row[4]}
+
+    def store(self, url, headers, compressed_body, size):
+        lifetime = self.freshness_lifetime(headers)
+        if lifetime is None:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO http_cache '
+                '(url, etag, last_modified, expires_at, body, size, stored_size, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, headers.get('ETag'), headers.get('Last-Modified'), now + lifetime,
+                 compressed_body, size, len(compressed_body), now)
+            )
+            total = conn.execute('SELECT COALESCE(SUM(stored_size), 0) FROM http_cache').fetchone()[0]
+            if total > self.max_bytes:
+                freed = 0
+                for old_url, old_size in conn.execute(
+                        'SELECT url, stored_size FROM http_cache ORDER BY last_access').fetchall():
+                    if total - freed <= self.max_bytes:
+                        break
+                    conn.execute('DELETE FROM http_cache WHERE url = ?', (old_url,))
+                    freed += old_size
+
+    def refresh(self, url, headers):
+        """Aggiorna validità e validatori dopo una risposta 304 Not Modified"""
+        lifetime = self.freshness_lifetime(headers)
+        with self._connect() as conn:
+            if lifetime is None:
+                conn.execute('DELETE FROM http_cache WHERE url = ?', (url,))
+                return
+            conn.execute(
+                'UPDATE http_cache SET expires_at = ?, etag = COALESCE(?, etag), '
+                'last_modified = COALESCE(?, last_modified) WHERE url = ?',
+                (time.time() + lifetime, headers.get('ETag'), headers.get('Last-Modified'), url)
+            )
+
+    def record(self, outcome, bytes_saved=0):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.bytes_saved += bytes_saved
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM http_cache')
+
+    def stats(self):
+        requests_count = self.hits + self.revalidated + self.misses
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.revalidated) / requests_count if requests_count else 0.0,
+            'bytes_saved': self.bytes_saved,
+        }
+
+@st.cache_resource
+def get_http_cache():
+    """Restituisce la cache HTTP condivisa tra le sessioni"""
+    return HTTPCache(os.path.join(CACHE_DIR, 'http_cache.sqlite'))
+
+class _ZlibReader(io.RawIOBase):
+    """Stream in lettura che decomprime un corpo zlib a blocchi, senza materializzarlo in memoria"""
+
+    def __init__(self, compressed):
+        self._source = io.BytesIO(compressed)
+        self._decompressor = zlib.decompressobj()
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = self._source.read(64 * 1024)
+            if not chunk:
+                self._pending = self._decompressor.flush()
+                break
+            self._pending = self._decompressor.decompress(chunk)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+class _CachingReader(io.RawIOBase):
+    """Legge il corpo della risposta comprimendolo al volo e lo salva in cache quando arriva in fondo"""
+
+    def __init__(self, response, on_complete):
+        self._response = response
+        self._compressor = zlib.compressobj(6)
+        self._chunks = []
+        self._size = 0
+        self._on_complete = on_complete
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._response.raw.read(len(buffer))
+        if data:
+            buffer[:len(data)] = data
+            self._chunks.append(self._compressor.compress(data))
+            self._size += len(data)
+            return len(data)
+        if self._on_complete is not None:
+            self._chunks.append(self._compressor.flush())
+            self._on_complete(b''.join(self._chunks), self._size)
+            self._on_complete = None
+            self._chunks = []
+        return 0
+
+    def close(self):
+        self._response.close()
+        super().close()
+
+def open_url(url, session=None, timeout=15, use_cache=True, headers=None):
+    """Apre un URL come stream binario passando dalla cache HTTP locale con richieste condizionali.
+
+    `headers` si aggiungono a quelli della sessione (es. lo User-Agent del crawler).
+    """
+    session = session or get_http_session()
+    cache = get_http_cache() if use_cache else None
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and entry['expires_at'] > time.time():
+        cache.record('hits', entry['size'])
+        return _ZlibReader(entry['body'])
+
+    headers = dict(headers or {})
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    response = session.get(url, headers=headers, timeout=timeout, stream=True)
+    if response.status_code == 304 and entry is not None:
+        response.close()
+        cache.refresh(url, response.headers)
+        cache.record('revalidated', entry['size'])
+        return _ZlibReader(entry['body'])
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    response.raw.decode_content = True  # gestisce Content-Encoding: gzip
+    if cache is None:
+        return _CachingReader(response, None)
+    cache.record('misses')
+    return _CachingReader(response, lambda body, size: cache.store(url, response.headers, body, size))
+
+class HostThrottle:
+    """Limita richieste concorrenti e intervallo minimo tra richieste per singolo host"""
+
+    def __init__(self, max_concurrent=2, min_interval=1.0):
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_slot = {}
+
+    @contextmanager
+    def slot(self, url, deadline=None, min_interval=None):
+        """`min_interval` alza l'intervallo per questa richiesta (es. Crawl-delay di robots.txt)"""
+        host = urlparse(url).netloc.lower()
+        interval = max(self.min_interval, min_interval or 0)
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.Semaphore(self.max_concurrent))
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not semaphore.acquire(timeout=timeout):
+            raise TimeoutError(f"tempo massimo superato in attesa di {host}")
+        try:
+            # Prenota il prossimo slot libero per l'host (politeness)
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_slot.get(host, now))
+                self._next_slot[host] = start + interval
+            if deadline is not None and start > deadline:
+                raise TimeoutError(f"tempo massimo superato in attesa di {host}")
+            if start > now:
+                time.sleep(start - now)
+            yield
+        finally:
+            semaphore.release()
+
+BOILERPLATE_TAGS = ['script', 'style', 'noscript', 'template', 'svg', 'iframe', 'form', 'nav', 'header', 'footer', 'aside']
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+BLOCK_XPATH = './/*[self::h1 or self::h2 or self::h3 or self::h4 or self::h5 or self::h6 or self::p or self::li]'
+MIN_BLOCK_TEXT_RATIO = 0.5  # sotto questa quota del testo del contenitore si usa tutto il suo testo
+
+def _clean_text(element):
+    return re.sub(r'\s+', ' ', element.text_content()).strip()
+
+def _find_main_content(body):
+    """Individua il contenitore del contenuto principale in base alla densità di testo.
+
+    Se la pagina ha un <article> o <main> sostanzioso viene usato quello;
+    altrimenti ogni paragrafo assegna un punteggio al genitore (e metà al
+    nonno) e vince il contenitore con punteggio più alto, penalizzato dalla
+    densità di link (menu, griglie prodotto, elenchi di tag).
+    """
+    for tag in ('article', 'main'):
+        for node in body.iter(tag):
+            if len(_clean_text(node)) >= 500:
+                return node
+            break
+
+    scores = {}
+    for paragraph in body.iter('p'):
+        text = _clean_text(paragraph)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(',') + min(len(text) // 100, 3)
+        parent = paragraph.getparent()
+        for node, weight in ((parent, 1.0), (parent.getparent() if parent is not None else None, 0.5)):
+            if node is not None:
+                scores[node] = scores.get(node, 0.0) + score * weight
+
+    best, best_score = body, 0.0
+    for node, score in scores.items():
+        text_length = len(_clean_text(node))
+        link_length = sum(len(_clean_text(a)) for a in node.iter('a'))
+        score *= 1 - (link_length / text_length if text_length else 1.0)
+        if score > best_score:
+            best, best_score = node, score
+    return best
+
+def extract_page_content(html):
+    """Estrae dal codice HTML titolo, meta description, titoli, paragrafi e conteggio parole del contenuto principale"""
+    document = lxml.html.document_fromstring(html)
+    title = document.find('.//title')
+    meta = document.xpath('//meta[translate(@name, "DESCRIPTION", "description")="description"]/@content')
+    body = document.find('body')
+    if body is None:
+        body = document
+
+    # Rimozione del boilerplate direttamente sull'albero C di lxml (molto più veloce di BeautifulSoup)
+    lxml.etree.strip_elements(body, *BOILERPLATE_TAGS, with_tail=False)
+    lxml.etree.strip_elements(body, lxml.etree.Comment, with_tail=False)
+
+    main_node = _find_main_content(body)
+    headings = []
+    paragraphs = []
+    blocks = []
+    for element in main_node.xpath(BLOCK_XPATH):
+        text = _clean_text(element)
+        if not text:
+            continue
+        if element.tag in HEADING_TAGS:
+            headings.append({'level': int(element.tag[1]), 'text': text})
+            blocks.append(f"{'#' * int(element.tag[1])} {text}")
+        elif element.tag == 'p' or (len(text) >= 40 and element.find('.//p') is None):
+            paragraphs.append(text)
+            blocks.append(text)
+
+    h1 = next((h['text'] for h in headings if h['level'] == 1), None)
+    if h1 is None:
+        # L'H1 può trovarsi fuori dal contenitore principale (es. intestazione della scheda prodotto)
+        h1_element = body.find('.//h1')
+        h1 = _clean_text(h1_element) if h1_element is not None else ''
+    text = '\n'.join(blocks)
+    # Contenuto in <div>, <td>, <span> o testo libero: i blocchi non lo coprono e si ripiega sul testo del contenitore
+    node_text = _clean_text(main_node)
+    if len(text) < len(node_text) * MIN_BLOCK_TEXT_RATIO:
+        text = node_text
+        paragraphs = paragraphs or [node_text]
+    return {
+        'title': _clean_text(title) if title is not None else '',
+        'meta_description': meta[0].strip() if meta else '',
+        'h1': h1,
+        'headings': headings,
+        'paragraphs': paragraphs,
+        'word_count': len(text.split()),
+        'text': text,
+    }
+
+def scrape_website_content(url, session=None, timeout=15, structured=False):
+    """Scrappa il contenuto principale di una pagina web.
+
+    Restituisce il testo (titolo, sottotitoli e paragrafi) limitato a 5000
+    caratteri oppure, con structured=True, il dizionario di extract_page_content
+    (in questo caso gli errori vengono sollevati invece che restituiti come testo).
+    """
+    try:
+        with closing(open_url(url, session=session, timeout=timeout)) as stream:
+            html = stream.read()
+
+        page = extract_page_content(html)
+        if structured:
+            return page
+
+        text = page['text']
+        if page['title']:
+            text = f"{page['title']}\n{text}"
+        return text[:5000]  # Limita a 5000 caratteri
+
+    except Exception as e:
+        if structured:
+            raise
+        return f"Errore nel caricamento del contenuto: {str(e)}"
+
+def scrape_competitors(urls, max_workers=8, per_host_limit=2, host_interval=1.0, total_timeout=60):
+    """Scrappa in parallelo le pagine dei competitor restituendo i testi nell'ordine degli URL"""
+    results = [None] * len(urls)
+    if not urls:
+        return results
+
+    session = get_http_session()
+    throttle = HostThrottle(per_host_limit, host_interval)
+    deadline = time.monotonic() + total_timeout
+
+    def fetch(url):
+        try:
+            with throttle.slot(url, deadline):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("tempo massimo superato")
+                return scrape_website_content(url, session=session, timeout=min(15, remaining))
+        except TimeoutError as e:
+            return f"Errore nel caricamento del contenuto: {str(e)}"
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    futures = {executor.submit(fetch, url): i for i, url in enumerate(urls)}
+    done, pending = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    for future in done:
+        results[futures[future]] = future.result()
+    for future in pending:
+        future.cancel()
+        results[futures[future]] = "Errore nel caricamento del contenuto: tempo massimo superato"
+    # Non attende i download ancora in corso oltre la scadenza
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+CRAWLER_USER_AGENT = 'SEOContentOptimizer'
+MAX_CRAWL_PAGE_BYTES = 2 * 1024 * 1024
+
+class RobotsPolicy:
+    """Regole di robots.txt per host, scaricate una sola volta per scansione.
+
+    Come da RFC 9309 un robots.txt assente (4xx) consente tutto, mentre un
+    errore del server o di rete blocca l'host per tutta la scansione.
+    """
+
+    def __init__(self, session, user_agent=CRAWLER_USER_AGENT, timeout=10):
+        self.session = session
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._parsers = {}
+
+    def _parser(self, url):
+        parsed = urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            if origin in self._parsers:
+                return self._parsers[origin]
+            parser = urllib.robotparser.RobotFileParser(f"{origin}/robots.txt")
+            try:
+                response = self.session.get(parser.url, headers={'User-Agent': self.user_agent}, timeout=self.timeout)
+                if response.status_code in (401, 403) or response.status_code >= 500:
+                    parser.disallow_all = True
+                elif response.status_code >= 400:
+                    parser.allow_all = True
+                else:
+                    parser.parse(response.text.splitlines())
+            except requests.RequestException:
+                parser.disallow_all = True
+            parser.modified()
+            self._parsers[origin] = parser
+            return parser
+
+    def allowed(self, url):
+        return self._parser(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url):
+        return self._parser(url).crawl_delay(self.user_agent)
+
+class PageStore:
+    """Archivio SQLite dei metadati delle pagine del sito (titolo, H1, meta description, parole).
+
+    Conserva solo i metadati, non il testo: migliaia di pagine occupano
+    pochi MB. Il `lastmod` della sitemap decide quali pagine riscaricare.
+    """
+
+    def __init__(self, path, max_age=7 * 24 * 3600, error_retry=24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.error_retry = error_retry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'url TEXT PRIMARY KEY, lastmod TEXT, title TEXT, h1 TEXT, meta_description TEXT, '
+                'word_count INTEGER, error TEXT, fetched_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def needs_refresh(self, entries):
+        """Filtra le voci della sitemap da (ri)scaricare: nuove, con lastmod cambiato o scadute"""
+        now = time.time()
+        known = {}
+        urls = [entry['loc'] for entry in entries]
+        with self._connect() as conn:
+            for start in range(0, len(urls), 500):
+                batch = urls[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT url, lastmod, error, fetched_at FROM pages WHERE url IN ({','.join('?' * len(batch))})", batch
+                )
+                known.update((url, (lastmod, error, fetched_at)) for url, lastmod, error, fetched_at in rows)
+        stale = []
+        for entry in entries:
+            if entry['loc'] not in known:
+                stale.append(entry)
+                continue
+            lastmod, error, fetched_at = known[entry['loc']]
+            if error:
+                refresh = now - fetched_at > self.error_retry
+            elif entry['lastmod'] and lastmod:
+                refresh = entry['lastmod'] != lastmod
+            else:
+                refresh = now - fetched_at > self.max_age
+            if refresh:
+                stale.append(entry)
+        return stale
+
+    def save_many(self, records):
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO pages (url, lastmod, title, h1, meta_description, word_count, error, fetched_at) '
+                'VALUES (:url, :lastmod, :title, :h1, :meta_description, :word_count, :error, :fetched_at)',
+                records
+            )
+
+    def lookup(self, urls):
+        """Metadati delle pagine scaricate senza errori, per URL"""
+        pages = {}
+        with self._connect() as conn:
+            for start in range(0, len(urls), 500):
+                batch = list(urls[start:start + 500])
+                rows = conn.execute(
+                    'SELECT url, title, h1, meta_description, word_count FROM pages '
+                    f"WHERE error IS NULL AND url IN ({','.join('?' * len(batch))})", batch
+                )
+                for url, title, h1, meta_description, word_count in rows:
+                    pages[url] = {'title': title, 'h1': h1, 'meta_description': meta_description, 'word_count': word_count}
+        return pages
+
+    def titles(self, urls):
+        """Testo descrittivo di ogni pagina (titolo, H1, meta description) per l'indice dei link interni"""
+        return {
+            url: ' '.join(filter(None, (page['title'], page['h1'], page['meta_description'])))
+            for url, page in self.lookup(urls).items()
+        }
+
+    def revision(self):
+        """Cambia a ogni scansione che modifica l'archivio (invalida l'indice dei link)"""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*), COALESCE(MAX(fetched_at), 0) FROM pages').fetchone()
+
+    def stats(self):
+        with self._connect() as conn:
+            pages, errors, words = conn.execute(
+                'SELECT COUNT(*), COUNT(error), COALESCE(SUM(word_count), 0) FROM pages'
+            ).fetchone()
+        return {'pages': pages - errors, 'errors': errors, 'words': words, 'bytes': os.path.getsize(self.path)}
+
+@st.cache_resource
+def get_page_store():
+    """Restituisce l'archivio dei metadati delle pagine del sito condiviso tra le sessioni"""
+    return PageStore(os.path.join(CACHE_DIR, 'pages.sqlite'))
+
+def fetch_page_metadata(url, session, timeout=15, user_agent=CRAWLER_USER_AGENT):
+    """Scarica una pagina (al massimo MAX_CRAWL_PAGE_BYTES) ed estrae i metadati da archiviare"""
+    # Le pagine del sito non passano dalla cache HTTP: l'archivio ne conserva già i metadati.
+    # Lo User-Agent è quello verificato su robots.txt, non quello da browser della sessione
+    headers = {'User-Agent': user_agent}
+    with closing(open_url(url, session=session, timeout=timeout, use_cache=False, headers=headers)) as stream:
+        html = stream.read(MAX_CRAWL_PAGE_BYTES)
+    page = extract_page_content(html)
+    return {
+        'title': page['title'][:300],
+        'h1': page['h1'][:300],
+        'meta_description': page['meta_description'][:500],
+        'word_count': page['word_count'],
+    }
+
+def crawl_site(sitemap_content, store=None, max_workers=8, per_host_limit=2, host_interval=0.5, limit=None,
+               on_progress=None, cancel_event=None):
+    """Scansiona le pagine della sitemap e ne salva i metadati nel PageStore.
+
+    Le voci della sitemap arrivano in streaming e vengono confrontate a
+    blocchi con l'archivio (needs_refresh): si scaricano solo le pagine nuove
+    o modificate. I download in corso sono al massimo 2 × max_workers e i
+    risultati vengono scritti a lotti, quindi la memoria resta costante anche
+    su migliaia di pagine. Ogni host rispetta robots.txt (anche Crawl-delay)
+    e i limiti di HostThrottle. `on_progress(stats)` viene chiamato dal
+    thread chiamante dopo ogni lotto.
+    """
+    store = store or get_page_store()
+    session = get_http_session()
+    robots = RobotsPolicy(session)
+    throttle = HostThrottle(per_host_limit, host_interval)
+    stats = {'seen': 0, 'fetched': 0, 'unchanged': 0, 'blocked': 0, 'errors': 0, 'sitemap_errors': []}
+    started = time.monotonic()
+
+    def fetch(entry):
+        url = entry['loc']
+        record = {'url': url, 'lastmod': entry['lastmod'], 'title': None, 'h1': None, 'meta_description': None,
+                  'word_count': None, 'error': None}
+        try:
+            if not robots.allowed(url):
+                record['error'] = 'bloccata da robots.txt'
+            else:
+                with throttle.slot(url, min_interval=robots.crawl_delay(url)):
+                    record.update(fetch_page_metadata(url, session))
+        except Exception as e:
+            record['error'] = str(e)[:300]
+        record['fetched_at'] = time.time()
+        return record
+
+    buffer = []
+
+    def collect(done):
+        for future in done:
+            record = future.result()
+            if record['error'] == 'bloccata da robots.txt':
+                stats['blocked'] += 1
+            elif record['error']:
+                stats['errors'] += 1
+            else:
+                stats['fetched'] += 1
+            buffer.append(record)
+        if len(buffer) >= 100:
+            store.save_many(buffer)
+            buffer.clear()
+
+    entries = iter_sitemap_entries(sitemap_content, errors=stats['sitemap_errors'])
+    in_flight = set()
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while limit is None or submitted < limit:
+                batch = list(itertools.islice(entries, 500))
+                if not batch:
+                    break
+                stats['seen'] += len(batch)
+                stale = store.needs_refresh(batch)
+                stats['unchanged'] += len(batch) - len(stale)
+                for entry in stale:
+                    if (limit is not None and submitted >= limit) or (cancel_event is not None and cancel_event.is_set()):
+                        break
+                    if len(in_flight) >= 2 * max_workers:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    in_flight.add(executor.submit(fetch, entry))
+                    submitted += 1
+                if on_progress:
+                    on_progress(dict(stats, elapsed=time.monotonic() - started))
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+            collect(wait(in_flight)[0])
+        finally:
+            entries.close()
+            if buffer:
+                store.save_many(buffer)
+    stats['elapsed'] = time.monotonic() - started
+    return stats
+
+def format_internal_links(urls):
+    """Elenco degli URL interni per i prompt, con il titolo della pagina quando è in archivio"""
+    if not urls:
+        return "Nessun URL disponibile"
+    pages = get_page_store().lookup(urls)
+    lines = []
+    for url in urls:
+        page = pages.get(url)
+        title = page and (page['title'] or page['h1'])
+        lines.append(f"- {url} — {title}" if title else f"- {url}")
+    return '\n'.join(lines)
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+_minhash_rng = np.random.default_rng(1729)
+# Hash universali multiply-shift: moltiplicatori dispari e offset casuali a 64 bit
+MINHASH_A = _minhash_rng.integers(1, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+MINHASH_B = _minhash_rng.integers(0, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def _shingle_hashes(words, k=3):
+    """Hash a 64 bit degli shingle di k parole consecutive (un paragrafo più corto è un unico shingle)"""
+    ids = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+    k = min(k, len(ids))
+    windows = np.lib.stride_tricks.sliding_window_view(ids, k)
+    hashes = np.zeros(len(windows), dtype=np.uint64)
+    for j in range(k):
+        hashes = hashes * np.uint64(1000003) ^ windows[:, j]
+    return np.unique(hashes)
+
+def minhash_signatures(paragraph_words):
+    """Firme MinHash (n paragrafi x MINHASH_PERMUTATIONS) calcolate in un'unica operazione vettoriale"""
+    shingles = [_shingle_hashes(words) for words in paragraph_words]
+    offsets = np.cumsum([0] + [len(s) for s in shingles[:-1]])
+    values = (np.concatenate(shingles)[:, None] * MINHASH_A + MINHASH_B) >> np.uint64(32)
+    return np.minimum.reduceat(values, offsets, axis=0)
+
+def cluster_near_duplicates(signatures, threshold=0.5, bands=MINHASH_BANDS):
+    """Raggruppa i paragrafi quasi duplicati (LSH a bande sulle firme MinHash + verifica della similarità stimata).
+
+    Restituisce per ogni paragrafo l'indice del rappresentante del suo gruppo.
+    """
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = signatures.shape[1] // bands
+    for band in range(bands):
+        chunk = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        buckets = {}
+        for i, key in enumerate(chunk.view(np.dtype((np.void, rows * chunk.itemsize))).ravel()):
+            buckets.setdefault(key.tobytes(), []).append(i)
+        for members in buckets.values():
+            for other in members[1:]:
+                a, b = find(members[0]), find(other)
+                if a != b and np.mean(signatures[members[0]] == signatures[other]) >= threshold:
+                    parent[b] = a
+    return [find(i) for i in range(len(signatures))]
+
+def build_competitor_digest(sources, threshold=0.5, metrics=None):
+    """Riduce i contenuti dei competitor a un digest: temi comuni una sola volta e passaggi distintivi di ciascuno.
+
+    `sources` è una lista di (etichetta, testo). I paragrafi quasi identici
+    (boilerplate, definizioni ripetute) vengono collassati con MinHash; quelli
+    presenti in più competitor diventano "temi comuni", gli altri restano
+    sotto il competitor che li contiene. In `metrics` vengono registrati
+    caratteri in ingresso e in uscita, rapporto di compressione e tempo.
+    """
+    started = time.perf_counter()
+    paragraphs, unavailable = [], []
+    for index, (label, text) in enumerate(sources):
+        if not text:
+            continue
+        if text.startswith("Errore nel caricamento del contenuto"):
+            unavailable.append(label)
+            continue
+        for line in text.splitlines():
+            line = line.strip()
+            words = re.findall(r'\w+', line.lower())
+            if len(words) >= 3:  # briciole di navigazione e frammenti non portano contenuto
+                paragraphs.append((index, line, words))
+
+    lines = ["ANALISI COMPETITOR:"]
+    duplicates = shared_count = 0
+    if paragraphs:
+        clusters = {}
+        for position, root in enumerate(cluster_near_duplicates(minhash_signatures([p[2] for p in paragraphs]), threshold)):
+            clusters.setdefault(root, []).append(position)
+        duplicates = len(paragraphs) - len(clusters)
+
+        shared, distinctive = [], {}
+        for members in clusters.values():
+            owners = {paragraphs[m][0] for m in members}
+            # Rappresentante: la variante più completa del paragrafo
+            text = max((paragraphs[m][1] for m in members), key=len)
+            if len(owners) > 1:
+                shared.append((len(owners), min(members), text))
+            else:
+                distinctive.setdefault(owners.pop(), []).append((min(members), text))
+        shared_count = len(shared)
+
+        if shared:
+            lines.append("TEMI COMUNI A PIÙ COMPETITOR:")
+            lines += [f"- ({count} competitor) {text}" for count, _, text in sorted(shared, key=lambda s: (-s[0], s[1]))]
+            lines.append("")
+        if distinctive:
+            lines.append("CONTRIBUTI DISTINTIVI DI OGNI COMPETITOR:")
+        for index in sorted(distinctive):
+            lines.append(f"{sources[index][0]}:")
+            lines += [text for _, text in sorted(distinctive[index])]
+            lines.append("")
+    if unavailable:
+        lines.append(f"Contenuto non disponibile: {', '.join(unavailable)}")
+    digest = '\n'.join(lines).strip()
+
+    if metrics is not None:
+        input_chars = sum(len(text or '') for _, text in sources)
+        metrics.update({
+            'input_chars': input_chars,
+            'output_chars': len(digest),
+            'compression_ratio': input_chars / len(digest) if digest else 0.0,
+            'paragraphs': len(paragraphs),
+            'duplicates_removed': duplicates,
+            'shared_themes': shared_count,
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+        })
+    return digest
+
+class LLMCache:
+    """Cache persistente su SQLite per le risposte del modello, con LRU limitata in dimensione e TTL.
+
+    SQLite in modalità WAL permette di condividere il file tra più sessioni e
+    processi Streamlit; ogni operazione apre una propria connessione.
+    """
+
+    def __init__(self, path, max_bytes=200 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens, **extra):
+        payload = json.dumps(
+            dict({'model': model, 'messages': messages, 'temperature': temperature, 'max_tokens': max_tokens}, **extra),
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, created_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                self._count(False)
+                return None
+            conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (now, key))
+        self._count(True)
+        return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, value, size, now, now)
+            )
+            conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl,))
+            # Evizione LRU finché la cache non rientra nel limite di dimensione
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+            if total > self.max_bytes:
+                freed = 0
+                for old_key, old_size in conn.execute('SELECT key, size FROM llm_cache ORDER BY last_access').fetchall():
+                    if total - freed <= self.max_bytes:
+                        break
+                    conn.execute('DELETE FROM llm_cache WHERE key = ?', (old_key,))
+                    freed += old_size
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM llm_cache')
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+@st.cache_resource
+def get_llm_cache():
+    """Restituisce la cache delle risposte del modello condivisa tra le sessioni"""
+    return LLMCache(os.path.join(CACHE_DIR, 'llm_cache.sqlite'))
+
+RETRYABLE_LLM_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
 )
 
-# CSS personalizzato
-st.markdown("""
-<style>
-    .main-header {
-        text-align: center;
-        color: #1f77b4;
-        margin-bottom: 2rem;
-    }
-    .section-header {
-        color: #2e8b57;
-        border-bottom: 2px solid #2e8b57;
-        padding-bottom: 0.5rem;
-        margin: 1.5rem 0 1rem 0;
-    }
-    .info-box {
-        background-color: #262730;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        border-left: 4px solid #1f77b4;
-        margin: 1rem 0;
-    }
-    .warning-box {
-        background-color: #262730;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        border-left: 4px solid #ffc107;
-        margin: 1rem 0;
-    }
-    .success-box {
-        background-color: #262730;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        border-left: 4px solid #28a745;
-        margin: 1rem 0;
-    }
-</style>
-""", unsafe_allow_html=True)
+class UsageTracker:
+    """Accumula in modo thread-safe chiamate, token e errori delle chiamate al modello"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cached_calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.saved_prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.route_changes = 0
+
+    def record_llm(self, model, prompt_tokens=0, completion_tokens=0, duration=0.0, cached=False, retries=0, stage=None,
+                   cached_prompt_tokens=0):
+        with self._lock:
+            self.calls += 1
+            self.cached_calls += int(cached)
+            self.retries += retries
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_prompt_tokens += cached_prompt_tokens
+
+    def record_error(self, model, error, retries=0, stage=None):
+        with self._lock:
+            self.errors += 1
+            self.retries += retries
+
+    def record_compaction(self, stage, original_tokens, compacted_tokens):
+        with self._lock:
+            self.saved_prompt_tokens += original_tokens - compacted_tokens
+
+    def record_route_change(self, stage, from_model, to_model, reason):
+        """Passaggio a un altro modello della rotta: 'cascata' (qualità insufficiente) o 'fallback' (modello limitato)"""
+        with self._lock:
+            self.route_changes += 1
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def prefix_cache_hit_ratio(self):
+        """Quota dei token di input serviti dalla cache dei prefissi di OpenAI"""
+        return self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+# Prezzi in USD per milione di token (input, output), usati per stimare il costo delle chiamate
+# USD per milione di token: input, input già in cache (prefisso del prompt), output
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+}
+
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_prompt_tokens=0):
+    """Stima il costo in USD di una chiamata (0 per i modelli senza prezzo noto)"""
+    input_price, cached_input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0, 0.0))
+    return (
+        (prompt_tokens - cached_prompt_tokens) * input_price
+        + cached_prompt_tokens * cached_input_price
+        + completion_tokens * output_price
+    ) / 1_000_000
+
+class PipelineTracer(UsageTracker):
+    """Traccia tempi delle fasi e singole chiamate al modello (token, tentativi, costo stimato).
+
+    Oltre ai totali di UsageTracker conserva il dettaglio per fase e chiamata,
+    esportabile come JSON o nel formato testuale di Prometheus.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stages = {}
+        self.llm_calls = []
+        self.route_events = []
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'errore'
+            raise
+        finally:
+            self.record_stage(name, run=time.monotonic() - started, status=status)
+
+    def record_stage(self, name, run, wait=0.0, status='ok'):
+        with self._lock:
+            self.stages[name] = {'wait': wait, 'run': run, 'status': status}
+
+    def record_llm(self, model, prompt_tokens=0, completion_tokens=0, duration=0.0, cached=False, retries=0, stage=None,
+                   cached_prompt_tokens=0):
+        super().record_llm(model, prompt_tokens, completion_tokens, duration, cached, retries, stage, cached_prompt_tokens)
+        with self._lock:
+            self.llm_calls.append({
+                'stage': stage or 'sconosciuta',
+                'model': model,
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'cached_prompt_tokens': cached_prompt_tokens,
+                'duration': duration,
+                'retries': retries,
+                'cached': cached,
+                'error': None,
+                'cost': 0.0 if cached else estimate_cost(model, prompt_tokens, completion_tokens, cached_prompt_tokens),
+            })
+
+    def record_error(self, model, error, retries=0, stage=None):
+        super().record_error(model, error, retries, stage)
+        with self._lock:
+            self.llm_calls.append({
+                'stage': stage or 'sconosciuta', 'model': model, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'cached_prompt_tokens': 0, 'duration': 0.0, 'retries': retries, 'cached': False, 'error': str(error), 'cost': 0.0,
+            })
+
+    def record_route_change(self, stage, from_model, to_model, reason):
+        super().record_route_change(stage, from_model, to_model, reason)
+        with self._lock:
+            self.route_events.append({'stage': stage or 'sconosciuta', 'from': from_model, 'to': to_model, 'reason': reason})
+
+    @property
+    def total_cost(self):
+        return sum(call['cost'] for call in self.llm_calls)
+
+    def route_stats(self):
+        """Latenza e costo per rotta (fase, modello), per bilanciare prezzo e tempi di ogni fase"""
+        routes = {}
+        for call in self.llm_calls:
+            route = routes.setdefault((call['stage'], call['model']), {
+                'stage': call['stage'], 'model': call['model'], 'calls': 0, 'cached_calls': 0, 'errors': 0,
+                'durations': [], 'cost_usd': 0.0, 'escalations': 0, 'fallbacks': 0,
+            })
+            route['calls'] += 1
+            route['cached_calls'] += int(call['cached'])
+            route['errors'] += int(call['error'] is not None)
+            route['cost_usd'] += call['cost']
+            if not call['cached'] and call['error'] is None:
+                route['durations'].append(call['duration'])
+        for event in self.route_events:
+            route = routes.get((event['stage'], event['to']))
+            if route is not None:
+                route['escalations' if event['reason'] == 'cascata' else 'fallbacks'] += 1
+
+        stats = []
+        for route in routes.values():
+            durations = sorted(route.pop('durations'))
+            billed = route['calls'] - route['cached_calls']
+            route.update(
+                p50_s=round(durations[len(durations) // 2], 3) if durations else None,
+                max_s=round(durations[-1], 3) if durations else None,
+                cost_usd=round(route['cost_usd'], 6),
+                cost_per_call_usd=round(route['cost_usd'] / billed, 6) if billed else 0.0,
+            )
+            stats.append(route)
+        return stats
+
+    def to_dict(self):
+        return {
+            'stages': self.stages,
+            'llm_calls': self.llm_calls,
+            'totals': {
+                'calls': self.calls,
+                'cached_calls': self.cached_calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'saved_prompt_tokens': self.saved_prompt_tokens,
+                'cached_prompt_tokens': self.cached_prompt_tokens,
+                'prefix_cache_hit_ratio': round(self.prefix_cache_hit_ratio, 4),
+                'route_changes': self.route_changes,
+                'cost_usd': round(self.total_cost, 6),
+            },
+            'routes': self.route_stats(),
+            'route_events': self.route_events,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix='seo_optimizer'):
+        """Esporta le metriche nel formato di esposizione testuale di Prometheus"""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}")
+
+        metric('stage_duration_seconds', 'gauge', "Durata di esecuzione delle fasi della pipeline",
+               [({'stage': name}, round(t['run'], 4)) for name, t in self.stages.items()])
+        metric('stage_wait_seconds', 'gauge', "Attesa tra disponibilità degli input e avvio della fase",
+               [({'stage': name}, round(t['wait'], 4)) for name, t in self.stages.items()])
+
+        per_route = {}
+        for call in self.llm_calls:
+            route = per_route.setdefault((call['stage'], call['model']), {
+                'calls': 0, 'errors': 0, 'retries': 0, 'prompt': 0, 'completion': 0, 'cached_prompt': 0,
+                'duration': 0.0, 'cost': 0.0
+            })
+            route['calls'] += 1
+            route['errors'] += int(call['error'] is not None)
+            route['retries'] += call['retries']
+            route['prompt'] += call['prompt_tokens']
+            route['completion'] += call['completion_tokens']
+            route['cached_prompt'] += call['cached_prompt_tokens']
+            route['duration'] += call['duration']
+            route['cost'] += call['cost']
+
+        def samples(field, extra=None):
+            return [(dict({'stage': stage, 'model': model}, **(extra or {})), round(values[field], 6))
+                    for (stage, model), values in per_route.items()]
+
+        metric('llm_calls_total', 'counter', "Chiamate al modello", samples('calls'))
+        metric('llm_errors_total', 'counter', "Chiamate al modello fallite", samples('errors'))
+        metric('llm_retries_total', 'counter', "Tentativi ripetuti dopo errori transitori", samples('retries'))
+        metric('llm_tokens_total', 'counter', "Token consumati",
+               samples('prompt', {'type': 'prompt'}) + samples('completion', {'type': 'completion'})
+               + samples('cached_prompt', {'type': 'cached_prompt'}))
+        metric('llm_duration_seconds_total', 'counter', "Tempo totale delle chiamate al modello", samples('duration'))
+        metric('llm_cost_usd_total', 'counter', "Costo stimato delle chiamate al modello", samples('cost'))
+        changes = {}
+        for event in self.route_events:
+            key = (event['stage'], event['from'], event['to'], event['reason'])
+            changes[key] = changes.get(key, 0) + 1
+        metric('llm_route_changes_total', 'counter', "Passaggi a un altro modello della rotta (cascata o fallback)", [
+            ({'stage': stage, 'from_model': from_model, 'to_model': to_model, 'reason': reason}, count)
+            for (stage, from_model, to_model, reason), count in changes.items()
+        ])
+        return '\n'.join(lines) + '\n'
+
+def retry_delay(error, attempt, base_delay=1.0, max_delay=60.0):
+    """Calcola l'attesa prima di un nuovo tentativo rispettando l'header Retry-After se presente"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        try:
+            return min(max_delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+    # Backoff esponenziale con jitter completo
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+class LLMError(RuntimeError):
+    """Fase AI non completata: interrompe la pipeline invece di passare un messaggio d'errore al prompt successivo"""
+
+class RateLimiter:
+    """Scheduler condiviso delle chiamate al modello: token bucket su richieste/min e token/min più concorrenza massima.
+
+    I due bucket si ricaricano in modo continuo; ogni chiamata preleva una
+    richiesta e una stima dei token (prompt + max_tokens), poi `settle`
+    corregge il bucket con i token effettivi. Un 429 sospende tutte le
+    chiamate per il tempo indicato dal server (`pause`), non solo quella fallita.
+    """
+
+    def __init__(self, rpm=500, tpm=200000, max_concurrent=8):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _wait_time(self, tokens, now):
+        """Secondi mancanti prima che entrambi i bucket abbiano capienza (0 se la chiamata può partire)"""
+        wait = max(0.0, self._paused_until - now)
+        if self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+        if self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+        return wait
+
+    @contextmanager
+    def slot(self, estimated_tokens, cancel_event=None, poll_interval=0.25):
+        started = time.monotonic()
+        while not self._slots.acquire(timeout=poll_interval):
+            if cancel_event is not None and cancel_event.is_set():
+                raise LLMError("generazione interrotta in attesa del limite di richieste")
+        try:
+            # Una stima oltre la capienza del bucket non passerebbe mai: la si limita alla capienza
+            tokens = min(float(estimated_tokens), self.tpm)
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._wait_time(tokens, now)
+                    if wait <= 0:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        break
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise LLMError("generazione interrotta in attesa del limite di richieste")
+                    self._cond.wait(min(wait, poll_interval))
+                waited = time.monotonic() - started
+                if waited > 0.01:
+                    self.throttled += 1
+                    self.wait_seconds += waited
+            yield
+        finally:
+            self._slots.release()
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Restituisce (o addebita) la differenza tra token stimati e token effettivamente usati"""
+        with self._cond:
+            self._refill(time.monotonic())
+            self._tokens = min(self.tpm, self._tokens + min(float(estimated_tokens), self.tpm) - actual_tokens)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Sospende tutte le chiamate per `seconds` secondi (rate limit segnalato dal server)"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                'rpm': self.rpm,
+                'tpm': self.tpm,
+                'available_requests': int(self._requests),
+                'available_tokens': int(self._tokens),
+                'throttled': self.throttled,
+                'wait_seconds': self.wait_seconds,
+            }
+
+@st.cache_resource
+def get_rate_limiter(rpm=None, tpm=None, max_concurrent=None):
+    """Scheduler condiviso da tutte le sessioni: i limiti OpenAI valgono per API key, non per utente"""
+    return RateLimiter(
+        rpm=rpm or int(os.environ.get('SEO_OPTIMIZER_RPM', 500)),
+        tpm=tpm or int(os.environ.get('SEO_OPTIMIZER_TPM', 200000)),
+        max_concurrent=max_concurrent or int(os.environ.get('SEO_OPTIMIZER_LLM_CONCURRENCY', 8)),
+    )
+
+@dataclass
+class ModelRoute:
+    """Modello e parametri di generazione di una fase della pipeline.
+
+    Con `cascade` risponde prima `model` (economico) e il modello indicato
+    viene chiamato solo se la risposta non supera il controllo di qualità
+    della fase; `fallback` sostituisce `model` quando resta limitato (429,
+    timeout) anche dopo i tentativi.
+    """
+    model: str = "gpt-4o-mini"
+    temperature: float = 0.3
+    max_tokens: int = 2000
+    cascade: str = None
+    fallback: str = None
+
+DEFAULT_MODEL_ROUTES = {
+    'eeat_analysis': ModelRoute(temperature=0.3, max_tokens=2000),
+    'optimization_suggestions': ModelRoute(temperature=0.4, max_tokens=2500),
+    'optimized_content': ModelRoute(temperature=0.5, max_tokens=4000),
+    'section_analysis': ModelRoute(temperature=0.3, max_tokens=400),
+    'section_rewrite': ModelRoute(temperature=0.5, max_tokens=2000),
+    'link_repair': ModelRoute(temperature=0.2, max_tokens=800),
+}
+
+def load_model_routes(path=None):
+    """Rotte per fase: i default aggiornati con il file JSON `path` ({"fase": {"model": ..., ...}})"""
+    routes = dict(DEFAULT_MODEL_ROUTES)
+    if not path:
+        return routes
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    for stage, overrides in config.items():
+        if stage not in routes:
+            raise ValueError(f"Rotta per una fase sconosciuta: '{stage}' (fasi: {', '.join(routes)})")
+        try:
+            routes[stage] = replace(routes[stage], **overrides)
+        except TypeError as e:
+            raise ValueError(f"Rotta '{stage}' non valida: {e}") from e
+    return routes
+
+@st.cache_resource
+def get_model_routes(path=None):
+    """Rotte dei modelli condivise, lette dal file indicato in SEO_OPTIMIZER_MODEL_ROUTES"""
+    return load_model_routes(path or os.environ.get('SEO_OPTIMIZER_MODEL_ROUTES'))
+
+def model_route(stage):
+    return get_model_routes().get(stage) or ModelRoute()
+
+def call_llm(openai_client, prompt, model="gpt-4o-mini", max_tokens=2000, temperature=0.3, use_cache=True,
+             on_token=None, cancel_event=None, metrics=None, tracker=None, max_retries=3, stage=None,
+             response_format=None, rate_limiter=None, system=None, n=1):
+    """Esegue una chat completion riutilizzando le risposte già in cache per prompt identici.
+
+    Se viene passato `on_token` la risposta è richiesta in streaming e il
+    callback riceve il testo accumulato a ogni frammento; `cancel_event`
+    (threading.Event) interrompe la generazione chiudendo la connessione.
+    In `metrics` vengono registrati time-to-first-token e token al secondo,
+    in `tracker` (UsageTracker) token e tentativi. Ogni tentativo passa dal
+    RateLimiter condiviso (`rate_limiter`, default get_rate_limiter()); gli
+    errori transitori (rate limit, timeout) vengono ritentati fino a
+    `max_retries` volte con backoff.
+    `response_format` abilita gli output strutturati (JSON Schema).
+    `system` è il messaggio di sistema: va tenuto identico tra le chiamate
+    (istruzioni fisse e contesto del brand) perché OpenAI ne riusi il prefisso in cache.
+    Con `n` > 1 la stessa richiesta genera n risposte alternative (token di
+    input pagati una volta) e restituisce una lista; lo streaming è disattivato.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    cache = get_llm_cache() if use_cache else None
+    extra = {'response_format': response_format} if response_format else {}
+    if n > 1:
+        extra['n'] = n
+        on_token = None
+    key = LLMCache.make_key(model, messages, temperature, max_tokens, **extra)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            if metrics is not None:
+                metrics.update({'cached': True, 'ttft': 0.0, 'tokens_per_sec': None})
+            if tracker is not None:
+                tracker.record_llm(model, cached=True, stage=stage)
+            return json.loads(cached) if n > 1 else cached
+
+    limiter = rate_limiter or get_rate_limiter()
+    estimated_tokens = count_tokens(system, model) + count_tokens(prompt, model) + max_tokens * n
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            usage = None
+            with limiter.slot(estimated_tokens, cancel_event):
+                try:
+                    if on_token is None:
+                        response = openai_client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            **extra
+                        )
+                        if n > 1:
+                            content = [choice.message.content for choice in response.choices]
+                        else:
+                            content = response.choices[0].message.content
+                        usage = response.usage
+                        cancelled = False
+                    else:
+                        content, usage, cancelled = _stream_completion(
+                            openai_client, model, messages, max_tokens, temperature, on_token, cancel_event, metrics, extra
+                        )
+                finally:
+                    limiter.settle(estimated_tokens, usage.total_tokens if usage else estimated_tokens)
+            break
+        except RETRYABLE_LLM_ERRORS as e:
+            if attempt >= max_retries:
+                if tracker is not None:
+                    tracker.record_error(model, e, retries=attempt, stage=stage)
+                raise
+            delay = retry_delay(e, attempt)
+            if isinstance(e, openai.RateLimitError):
+                # Il limite è per API key: rallentano tutte le chiamate, non solo questa
+                limiter.pause(delay)
+            if cancel_event is not None and cancel_event.wait(delay):
+                raise LLMError("generazione interrotta durante l'attesa del nuovo tentativo") from e
+            elif cancel_event is None:
+                time.sleep(delay)
+            attempt += 1
+        except Exception as e:
+            if tracker is not None:
+                tracker.record_error(model, e, retries=attempt, stage=stage)
+            raise
+
+    if tracker is not None:
+        tracker.record_llm(
+            model,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            duration=time.monotonic() - started,
+            retries=attempt,
+            stage=stage,
+            cached_prompt_tokens=cached_prompt_tokens(usage)
+        )
+    if cancelled:
+        # Una risposta parziale non va mai salvata in cache
+        return content
+    if cache is not None and content:
+        cache.set(key, json.dumps(content, ensure_ascii=False) if n > 1 else content)
+    return content
+
+def cached_prompt_tokens(usage):
+    """Token di input serviti dalla cache dei prefissi (usage.prompt_tokens_details.cached_tokens)"""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return getattr(details, 'cached_tokens', None) or 0
+
+def call_routed(openai_client, prompt, stage, max_tokens=None, quality_check=None, **llm_options):
+    """call_llm con modello, temperatura e max_tokens della rotta configurata per la fase.
+
+    Se il modello principale resta limitato dopo i tentativi la richiesta passa
+    al modello di `fallback`; in modalità cascata, se `quality_check(risposta)`
+    fallisce, la stessa richiesta viene ripetuta con il modello `cascade`.
+    I cambi di modello sono registrati nel tracker (record_route_change).
+    """
+    route = model_route(stage)
+    tracker = llm_options.get('tracker')
+    cancel_event = llm_options.get('cancel_event')
+    options = dict(llm_options, max_tokens=max_tokens or route.max_tokens, temperature=route.temperature, stage=stage)
+    model = route.model
+    try:
+        result = call_llm(openai_client, prompt, model=model, **options)
+    except RETRYABLE_LLM_ERRORS as e:
+        if not route.fallback:
+            raise
+        logger.warning("Fase %s: %s non disponibile (%s), uso %s", stage, model, e, route.fallback)
+        if tracker is not None:
+            tracker.record_route_change(stage, model, route.fallback, 'fallback')
+        model = route.fallback
+        result = call_llm(openai_client, prompt, model=model, **options)
+
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if route.cascade and route.cascade != model and quality_check is not None and not cancelled \
+            and not quality_check(result):
+        logger.info("Fase %s: risposta di %s insufficiente, passo a %s", stage, model, route.cascade)
+        if tracker is not None:
+            tracker.record_route_change(stage, model, route.cascade, 'cascata')
+        result = call_llm(openai_client, prompt, model=route.cascade, **options)
+    return result
+
+STREAM_CALLBACK_INTERVAL = 0.1
+
+def _stream_completion(openai_client, model, messages, max_tokens, temperature, on_token, cancel_event, metrics, extra=None):
+    """Consuma una chat completion in streaming restituendo (testo, usage, interrotta).
+
+    `on_token` riceve il testo accumulato al massimo ogni STREAM_CALLBACK_INTERVAL
+    secondi e una volta alla fine: ricomporlo a ogni frammento costerebbe O(n²).
+    """
+    started = time.monotonic()
+    first_token_at = None
+    last_callback = 0.0
+    pending = False
+    usage = None
+    parts = []
+    cancelled = False
+    stream = openai_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+        **(extra or {})
+    )
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                parts.append(chunk.choices[0].delta.content)
+                pending = True
+                now = time.monotonic()
+                if now - last_callback >= STREAM_CALLBACK_INTERVAL:
+                    last_callback = now
+                    pending = False
+                    on_token(''.join(parts))
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+        if pending and not cancelled:
+            on_token(''.join(parts))
+    finally:
+        # Chiudere la connessione ferma la generazione (e la fatturazione) lato server
+        stream.close()
+
+    if metrics is not None:
+        finished = time.monotonic()
+        completion_tokens = usage.completion_tokens if usage else len(parts)
+        generation_time = finished - (first_token_at or finished)
+        metrics.update({
+            'cached': False,
+            'cancelled': cancelled,
+            'ttft': (first_token_at - started) if first_token_at else None,
+            'completion_tokens': completion_tokens,
+            'tokens_per_sec': completion_tokens / generation_time if generation_time > 0 else None,
+        })
+    return ''.join(parts), usage, cancelled
+
+def make_stream_renderer(placeholder, min_interval=0.1):
+    """Crea un callback che aggiorna il placeholder con il testo in streaming, al massimo ogni min_interval secondi"""
+    last_render = [0.0]
+
+    def render(text):
+        now = time.monotonic()
+        if now - last_render[0] >= min_interval:
+            last_render[0] = now
+            placeholder.markdown(text + " ▌")
+    return render
+
+PROMPT_TOKEN_BUDGETS = {
+    'gpt-4o-mini': 12000,
+    'gpt-4o': 12000,
+    'gpt-4.1-mini': 12000,
+    'gpt-4.1': 12000,
+}
+DEFAULT_PROMPT_TOKEN_BUDGET = 8000
+PROMPT_TEMPLATE_RESERVE = 1500  # token riservati alle istruzioni fisse dei prompt
+MIN_SECTION_TOKENS = 300
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Conta i token del testo con tiktoken se disponibile, altrimenti con una stima (4 caratteri per token)"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model) if tiktoken is not None else None
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+@functools.lru_cache(maxsize=8)
+def _get_encoding(model):
+    """Encoding tiktoken del modello; None se non si può caricare (es. download dei file BPE senza rete)"""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        logger.warning("Encoding tiktoken non disponibile per %s, uso la stima a 4 caratteri per token: %s", model, e)
+        return None
+
+def _normalize_sentence(sentence):
+    return re.sub(r'[\W_]+', ' ', sentence.lower()).strip()
+
+def _split_units(text):
+    """Divide il testo in righe e le righe in frasi, mantenendo titoli e intestazioni come unità a sé"""
+    units = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#') or (line.endswith(':') and len(line) < 200):
+            units.append((line, True))
+        else:
+            units.extend((sentence, False) for sentence in re.split(r'(?<=[.!?])\s+', line) if sentence)
+    return units
+
+def compact_text(text, max_tokens, model="gpt-4o-mini"):
+    """Riduce il testo entro max_tokens: prima elimina le frasi ripetute, poi applica un riassunto estrattivo"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    # 1. Deduplicazione delle frasi ripetute (boilerplate, definizioni comuni)
+    seen = set()
+    units = []
+    for unit, is_heading in _split_units(text):
+        key = _normalize_sentence(unit)
+        if key and key not in seen:
+            seen.add(key)
+            units.append((unit, is_heading))
+    deduplicated = '\n'.join(unit for unit, _ in units)
+    if count_tokens(deduplicated, model) <= max_tokens:
+        return deduplicated
+
+    # 2. Riassunto estrattivo: frasi con i termini più frequenti del testo, nell'ordine originale
+    frequencies = {}
+    for unit, _ in units:
+        for term in tokenize(unit):
+            frequencies[term] = frequencies.get(term, 0) + 1
+    scored = []
+    for position, (unit, is_heading) in enumerate(units):
+        terms = tokenize(unit)
+        score = sum(frequencies[t] for t in terms) / (len(terms) ** 0.5) if terms else 0.0
+        scored.append((float('inf') if is_heading else score, position, unit))
+
+    selected = []
+    used = 0
+    for score, position, unit in sorted(scored, key=lambda item: (-item[0], item[1])):
+        cost = count_tokens(unit, model) + 1
+        if used + cost > max_tokens:
+            continue
+        selected.append((position, unit))
+        used += cost
+    return '\n'.join(unit for _, unit in sorted(selected))
+
+def fit_prompt_sections(stage, model, sections, protected=None, weights=None, tracker=None):
+    """Adatta le sezioni variabili di un prompt al budget di token del modello.
+
+    `protected` contiene le sezioni che non vanno mai ridotte (es. il contenuto
+    da ottimizzare): consumano budget per prime. Il resto viene ripartito tra
+    le sezioni comprimibili in proporzione a `weights`, redistribuendo la quota
+    non usata dalle sezioni più corte; solo quelle che eccedono vengono compattate.
+    """
+    budget = PROMPT_TOKEN_BUDGETS.get(model, DEFAULT_PROMPT_TOKEN_BUDGET) - PROMPT_TEMPLATE_RESERVE
+    budget -= sum(count_tokens(text, model) for text in (protected or {}).values())
+    weights = weights or {}
+    sizes = {name: count_tokens(text, model) for name, text in sections.items()}
+
+    allocations = {}
+    remaining = dict(sizes)
+    available = max(budget, MIN_SECTION_TOKENS * len(sections))
+    while remaining:
+        total_weight = sum(weights.get(name, 1) for name in remaining)
+        shares = {name: available * weights.get(name, 1) / total_weight for name in remaining}
+        fitting = {name: size for name, size in remaining.items() if size <= shares[name]}
+        if not fitting:
+            allocations.update({name: max(MIN_SECTION_TOKENS, int(share)) for name, share in shares.items()})
+            break
+        for name, size in fitting.items():
+            allocations[name] = size
+            available -= size
+            del remaining[name]
+
+    fitted = {}
+    original_total = compacted_total = 0
+    for name, text in sections.items():
+        fitted[name] = text if sizes[name] <= allocations[name] else compact_text(text, allocations[name], model)
+        original_total += sizes[name]
+        compacted_total += count_tokens(fitted[name], model) if fitted[name] is not text else sizes[name]
+
+    saved = original_total - compacted_total
+    if saved > 0:
+        logger.info("Fase %s: risparmiati %d token di input (%d -> %d)", stage, saved, original_total, compacted_total)
+    if tracker is not None:
+        tracker.record_compaction(stage, original_total, compacted_total)
+    return fitted
+
+EEAT_CRITERIA = ('Experience', 'Expertise', 'Authoritativeness', 'Trustworthiness')
+
+# Segnali meccanici contati localmente: (regex, occorrenze ogni 1000 parole per arrivare a ~63% di saturazione)
+EEAT_SIGNALS = {
+    'first_person': (r"\b(?:ho|abbiamo|nostr[aoie]|personalmente|in prima persona|la mia esperienza|abbiamo (?:testato|provato|verificato))\b", 6),
+    'examples': (r"\b(?:ad esempio|per esempio|ad es\.|caso (?:studio|pratico)|case study|esempio concreto|in pratica)\b", 3),
+    'numbers': (r"\b\d+(?:[.,]\d+)?\s?(?:%|percento|euro|€|kg|km|mm|cm|ore|giorni|mesi|anni)?", 15),
+    'statistics': (r"\b\d+(?:[.,]\d+)?\s?(?:%|percento)|\b(?:statistic\w*|dati|media|campione|rilevazione)\b", 4),
+    'technical_terms': (r"\b\w{13,}\b", 25),
+    'headings': (r"(?m)^#{1,6}\s+\S", 4),
+    'citations': (r"\b(?:secondo|fonte|fonti|studio|studi|ricerca|ricerche|report|università|istituto|pubblicat\w+)\b|\[\d+\]", 5),
+    'outbound_links': (r"\]\(https?://|https?://\S+", 3),
+    'quotes': (r"[“\"«][^”\"»]{20,}[”\"»]", 2),
+    'dates': (r"\b(?:19|20)\d{2}\b|\b(?:aggiornat[oa]|pubblicat[oa]) (?:il|a)\b", 2),
+    'author': (r"\b(?:autore|autrice|scritto da|a cura di|redazione|esperto|dott\.?|ing\.?|prof\.?)\b", 1.5),
+    'disclaimers': (r"\b(?:disclaimer|non sostituisce|consulta(?:re)? un|limit[ei]|conflitt\w+ di interess\w+|trasparenza|garanzia|rimborso)\b", 1.5),
+}
+
+# Peso di ciascun segnale per criterio (ogni colonna somma a 1)
+EEAT_SIGNAL_WEIGHTS = np.array([
+    # Exp   Expt  Auth  Trust
+    [0.40, 0.00, 0.00, 0.05],  # first_person
+    [0.35, 0.10, 0.00, 0.00],  # examples
+    [0.15, 0.10, 0.00, 0.10],  # numbers
+    [0.00, 0.20, 0.10, 0.15],  # statistics
+    [0.00, 0.35, 0.00, 0.00],  # technical_terms
+    [0.10, 0.25, 0.00, 0.00],  # headings
+    [0.00, 0.00, 0.40, 0.10],  # citations
+    [0.00, 0.00, 0.30, 0.10],  # outbound_links
+    [0.00, 0.00, 0.20, 0.00],  # quotes
+    [0.00, 0.00, 0.00, 0.15],  # dates
+    [0.00, 0.00, 0.00, 0.15],  # author
+    [0.00, 0.00, 0.00, 0.20],  # disclaimers
+], dtype=np.float64)
+
+_EEAT_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern, _ in EEAT_SIGNALS.values()]
+_EEAT_SATURATION = np.array([saturation for _, saturation in EEAT_SIGNALS.values()], dtype=np.float64)
+
+def extract_eeat_signals(texts):
+    """Conta i segnali E-E-A-T in un batch di testi: matrice (documenti x segnali) e numero di parole"""
+    counts = np.zeros((len(texts), len(_EEAT_PATTERNS)), dtype=np.float64)
+    words = np.zeros(len(texts), dtype=np.float64)
+    for i, text in enumerate(texts):
+        words[i] = len(text.split())
+        for j, pattern in enumerate(_EEAT_PATTERNS):
+            counts[i, j] = sum(1 for _ in pattern.finditer(text))
+    return counts, words
+
+def prescore_eeat(texts):
+    """Punteggi E-E-A-T euristici (1-10) per un batch di testi, calcolati localmente in pochi millisecondi.
+
+    Le occorrenze vengono normalizzate ogni 1000 parole, saturate con
+    1 - exp(-x / soglia) e combinate per criterio con EEAT_SIGNAL_WEIGHTS.
+    Restituisce una matrice (documenti x 4) nell'ordine di EEAT_CRITERIA.
+    """
+    counts, words = extract_eeat_signals(texts)
+    density = counts / np.maximum(words, 100.0)[:, None] * 1000.0
+    saturated = 1.0 - np.exp(-density / _EEAT_SATURATION)
+    return np.round(1.0 + 9.0 * (saturated @ EEAT_SIGNAL_WEIGHTS), 1)
+
+def triage_eeat(content, threshold=7.0):
+    """Pre-valutazione locale: punteggi per criterio, criteri deboli e se la pipeline può essere saltata"""
+    scores = dict(zip(EEAT_CRITERIA, prescore_eeat([content])[0].tolist()))
+    weak = [criterion for criterion, score in scores.items() if score < threshold]
+    return {'scores': scores, 'weak_criteria': weak, 'skip': not weak}
+
+def _string_list_schema():
+    return {"type": "array", "items": {"type": "string"}}
+
+def _object_schema(properties):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+def _json_schema_format(name, schema):
+    """response_format per gli output strutturati; i vincoli di intervallo restano alla validazione locale"""
+    def api_schema(node):
+        if isinstance(node, dict):
+            return {k: api_schema(v) for k, v in node.items() if k not in ('minimum', 'maximum')}
+        return node
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": api_schema(schema)}}
+
+def validate_json(data, schema, path="risultato"):
+    """Verifica che i dati rispettino lo schema (sottoinsieme JSON Schema usato dagli output strutturati)"""
+    expected = schema["type"]
+    if expected == "object":
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: atteso un oggetto")
+        for name in schema.get("required", []):
+            if name not in data:
+                raise ValueError(f"{path}: campo mancante '{name}'")
+        for name, value in data.items():
+            if name not in schema["properties"]:
+                raise ValueError(f"{path}: campo non previsto '{name}'")
+            validate_json(value, schema["properties"][name], f"{path}.{name}")
+    elif expected == "array":
+        if not isinstance(data, list):
+            raise ValueError(f"{path}: attesa una lista")
+        for i, item in enumerate(data):
+            validate_json(item, schema["items"], f"{path}[{i}]")
+    elif expected == "integer":
+        if isinstance(data, bool) or not isinstance(data, int):
+            raise ValueError(f"{path}: atteso un intero")
+        if not schema.get("minimum", data) <= data <= schema.get("maximum", data):
+            raise ValueError(f"{path}: valore {data} fuori intervallo")
+    elif expected == "string" and not isinstance(data, str):
+        raise ValueError(f"{path}: attesa una stringa")
+    return data
+
+def _criteria_schema(value_schema):
+    return _object_schema({criterion.lower(): value_schema for criterion in EEAT_CRITERIA})
+
+EEAT_ANALYSIS_SCHEMA = _object_schema({
+    "scores": _criteria_schema({"type": "integer", "minimum": 1, "maximum": 10}),
+    "analysis": _criteria_schema({"type": "string"}),
+    "strengths": _string_list_schema(),
+    "weaknesses": _string_list_schema(),
+})
+
+OPTIMIZATION_PLAN_SCHEMA = _object_schema({
+    "improvements": _criteria_schema(_string_list_schema()),
+    "internal_links": _string_list_schema(),
+    "content_structure": _string_list_schema(),
+    "additional_content": _string_list_schema(),
+    "ctas": _string_list_schema(),
+})
+
+OPTIMIZED_CONTENT_SCHEMA = _object_schema({
+    "title": {"type": "string"},
+    "meta_description": {"type": "string"},
+    "content": {"type": "string"},
+    "internal_links_used": _string_list_schema(),
+})
+
+# Analisi di più pagine in una sola richiesta (analyze_eeat_pages)
+EEAT_PAGES_SCHEMA = _object_schema({"pages": {"type": "array", "items": EEAT_ANALYSIS_SCHEMA}})
+
+def _bullets(items):
+    return '\n'.join(f"- {item}" for item in items) or "-"
+
+@dataclass
+class EEATAnalysisResult:
+    """Esito strutturato dell'analisi E-E-A-T"""
+    scores: dict
+    analysis: dict
+    strengths: list
+    weaknesses: list
+    # Punteggi e punti deboli per blocco, solo per l'analisi map-reduce dei documenti lunghi
+    sections: list = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**validate_json(json.loads(text), EEAT_ANALYSIS_SCHEMA))
+
+    @property
+    def total(self):
+        return sum(self.scores.values())
+
+    def score(self, criterion):
+        return self.scores[criterion.lower()]
+
+    def to_prompt(self):
+        """Versione compatta da passare alle fasi successive al posto del markdown completo"""
+        scores = ', '.join(f"{c} {self.score(c)}/10" for c in EEAT_CRITERIA)
+        return f"Punteggi: {scores} (totale {self.total}/40)\nPunti deboli:\n{_bullets(self.weaknesses)}"
+
+    def to_markdown(self):
+        lines = ["## PUNTEGGI E-E-A-T (da 1 a 10)"]
+        lines += [f"- {c}: {self.score(c)}/10" for c in EEAT_CRITERIA]
+        lines += [f"- **PUNTEGGIO TOTALE: {self.total}/40**", "", "## ANALISI DETTAGLIATA"]
+        for c in EEAT_CRITERIA:
+            lines += ["", f"### {c}", self.analysis[c.lower()]]
+        lines += ["", "## PUNTI DI FORZA", _bullets(self.strengths), "", "## AREE DI MIGLIORAMENTO", _bullets(self.weaknesses)]
+        if self.sections:
+            lines += ["", "## PUNTEGGI PER BLOCCO"]
+            lines += [
+                f"- {section['heading']}: " + ', '.join(f"{c} {section['scores'][c.lower()]}/10" for c in EEAT_CRITERIA)
+                for section in self.sections
+            ]
+        return '\n'.join(lines)
+
+@dataclass
+class OptimizationPlan:
+    """Piano di ottimizzazione strutturato"""
+    improvements: dict
+    internal_links: list
+    content_structure: list
+    additional_content: list
+    ctas: list
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**validate_json(json.loads(text), OPTIMIZATION_PLAN_SCHEMA))
+
+    def to_prompt(self):
+        lines = []
+        for c in EEAT_CRITERIA:
+            lines += [f"{c}:", _bullets(self.improvements[c.lower()])]
+        lines += ["Link interni:", _bullets(self.internal_links), "Struttura:", _bullets(self.content_structure),
+                  "Da aggiungere:", _bullets(self.additional_content), "CTA:", _bullets(self.ctas)]
+        return '\n'.join(lines)
+
+    def to_markdown(self):
+        lines = ["## STRATEGIA DI OTTIMIZZAZIONE E-E-A-T"]
+        for i, c in enumerate(EEAT_CRITERIA, 1):
+            lines += ["", f"### {i}. MIGLIORAMENTI {c.upper()}", _bullets(self.improvements[c.lower()])]
+        lines += ["", "## LINK INTERNI CONSIGLIATI", _bullets(self.internal_links),
+                  "", "## STRUTTURA CONTENUTO OTTIMIZZATA", _bullets(self.content_structure),
+                  "", "## CONTENUTI AGGIUNTIVI DA INCLUDERE", _bullets(self.additional_content),
+                  "", "## CALL-TO-ACTION E CONVERSIONI", _bullets(self.ctas)]
+        return '\n'.join(lines)
+
+@dataclass
+class OptimizedContentResult:
+    """Contenuto ottimizzato strutturato"""
+    title: str
+    meta_description: str
+    content: str
+    internal_links_used: list
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**validate_json(json.loads(text), OPTIMIZED_CONTENT_SCHEMA))
+
+    def to_markdown(self):
+        return self.content
+
+def as_prompt_text(value):
+    """Testo da inserire nei prompt: versione compatta se il risultato è strutturato"""
+    return value.to_prompt() if hasattr(value, 'to_prompt') else value
+
+def as_markdown(value):
+    """Markdown da mostrare all'utente, sia per risultati testuali sia strutturati"""
+    return value.to_markdown() if hasattr(value, 'to_markdown') else value
+
+def parse_eeat_scores(analysis):
+    """Estrae i punteggi per criterio da un'analisi E-E-A-T (strutturata o in markdown)"""
+    if isinstance(analysis, EEATAnalysisResult):
+        return {c: analysis.score(c) for c in EEAT_CRITERIA}
+    scores = {}
+    for c in EEAT_CRITERIA:
+        match = re.search(rf"{c}\W*:\W*(\d+(?:[.,]\d+)?)\s*/\s*10", analysis or '', re.IGNORECASE)
+        if match:
+            scores[c] = float(match.group(1).replace(',', '.'))
+    return scores
+
+BRAND_CONTEXT_TOKENS = 600
+
+@dataclass
+class BrandProfile:
+    """Contesto del brand condiviso tra pagine e fasi.
+
+    Istruzioni fisse della fase e informazioni sul brand formano il messaggio
+    di sistema, identico per tutte le pagine dello stesso brand: è il prefisso
+    che OpenAI riusa dalla cache (prompt caching automatico oltre i 1024
+    token), mentre il messaggio utente contiene solo i dati della pagina.
+    """
+    nome: str
+    url: str
+    tone_of_voice: str
+    chi_siamo: str
+
+    @classmethod
+    def from_brand_info(cls, brand_info):
+        if isinstance(brand_info, cls):
+            return brand_info
+        return cls(brand_info['nome'], brand_info['url'], brand_info['tone_of_voice'], brand_info['chi_siamo'])
+
+    def __getitem__(self, key):
+        # Compatibilità con il dizionario brand_info usato nel resto dell'app
+        return getattr(self, key)
+
+    @functools.cached_property
+    def context(self):
+        """Blocco del brand con il "Chi siamo" compattato una sola volta, quindi identico per tutte le pagine"""
+        return (
+            "INFORMAZIONI SUL BRAND:\n"
+            f"- Nome: {self.nome}\n"
+            f"- URL: {self.url}\n"
+            f"- Tone of Voice: {self.tone_of_voice}\n"
+            f"- Chi Siamo: {compact_text(self.chi_siamo, BRAND_CONTEXT_TOKENS)}"
+        )
+
+    def system_prompt(self, stage, structured=False):
+        """Messaggio di sistema della fase: prima le parti comuni a tutti i brand, poi quelle del brand"""
+        instructions, markdown_format, json_format = STAGE_GUIDES[stage]
+        return f"{instructions}\n\n{json_format if structured else markdown_format}\n\n{self.context}"
+
+EEAT_INSTRUCTIONS = """Analizza il contenuto fornito dall'utente secondo i criteri E-E-A-T di Google per il brand descritto sotto.
+
+Valuta il contenuto secondo questi 4 criteri E-E-A-T e assegna un punteggio da 1 a 10 per ciascuno:
+
+1. EXPERIENCE (Esperienza):
+- Presenza di esempi pratici e diversificati
+- Applicabilità nel mondo reale
+- Dettagli specifici e contestualizzati
+- Casi studio o esperienze dirette
+
+2. EXPERTISE (Competenza):
+- Dimostrazione di conoscenza approfondita
+- Accuratezza tecnica delle informazioni
+- Insight originali o ricerche proprietarie
+- Uso di terminologia specialistica appropriata
+
+3. AUTHORITATIVENESS (Autorevolezza):
+- Citazioni di fonti affidabili
+- Riferimenti a studi e ricerche
+- Collegamenti a risorse autorevoli
+- Riconoscimenti nel settore
+
+4. TRUSTWORTHINESS (Affidabilità):
+- Trasparenza delle informazioni
+- Obiettività del punto di vista
+- Menzione di limiti o conflitti di interesse
+- Presenza di dati e prove a supporto"""
+
+EEAT_MARKDOWN_FORMAT = """Fornisci l'analisi in questo formato:
+
+## PUNTEGGI E-E-A-T (da 1 a 10)
+- Experience: [punteggio]/10
+- Expertise: [punteggio]/10
+- Authoritativeness: [punteggio]/10
+- Trustworthiness: [punteggio]/10
+- **PUNTEGGIO TOTALE: [somma]/40**
+
+## ANALISI DETTAGLIATA
+
+### Experience
+[Analisi dettagliata della componente Experience con esempi specifici dal contenuto]
+
+### Expertise
+[Analisi dettagliata della componente Expertise con esempi specifici dal contenuto]
+
+### Authoritativeness
+[Analisi dettagliata della componente Authoritativeness con esempi specifici dal contenuto]
+
+### Trustworthiness
+[Analisi dettagliata della componente Trustworthiness con esempi specifici dal contenuto]
+
+## PUNTI DI FORZA
+[Elenco dei punti di forza identificati]
+
+## AREE DI MIGLIORAMENTO
+[Elenco delle aree che necessitano miglioramento]"""
+
+EEAT_JSON_FORMAT = """Rispondi SOLO con un oggetto JSON conforme allo schema: punteggi interi da 1 a 10 per criterio,
+un'analisi sintetica (2-3 frasi) per criterio ed elenchi brevi di punti di forza e aree di miglioramento."""
+
+SUGGESTIONS_INSTRUCTIONS = """Basandoti sull'analisi E-E-A-T fornita dall'utente, genera suggerimenti specifici per ottimizzare il contenuto.
+Mantieni il tone of voice del brand descritto sotto in tutti i suggerimenti."""
+
+SUGGESTIONS_MARKDOWN_FORMAT = """Genera suggerimenti di ottimizzazione strutturati in questo formato:
+
+## STRATEGIA DI OTTIMIZZAZIONE E-E-A-T
+
+### 1. MIGLIORAMENTI EXPERIENCE
+- [Suggerimento specifico 1 con esempio pratico]
+- [Suggerimento specifico 2 con esempio pratico]
+- [Suggerimento specifico 3 con esempio pratico]
+
+### 2. MIGLIORAMENTI EXPERTISE
+- [Suggerimento specifico 1 per dimostrare competenza]
+- [Suggerimento specifico 2 per dimostrare competenza]
+- [Suggerimento specifico 3 per dimostrare competenza]
+
+### 3. MIGLIORAMENTI AUTHORITATIVENESS
+- [Suggerimento specifico 1 per aumentare autorevolezza]
+- [Suggerimento specifico 2 per aumentare autorevolezza]
+- [Suggerimento specifico 3 per aumentare autorevolezza]
+
+### 4. MIGLIORAMENTI TRUSTWORTHINESS
+- [Suggerimento specifico 1 per aumentare affidabilità]
+- [Suggerimento specifico 2 per aumentare affidabilità]
+- [Suggerimento specifico 3 per aumentare affidabilità]
+
+## LINK INTERNI CONSIGLIATI
+[Suggerisci 5-8 URL interni dalla sitemap che sarebbero rilevanti per questo contenuto]
+
+## STRUTTURA CONTENUTO OTTIMIZZATA
+[Suggerisci una struttura migliorata per il contenuto con H2, H3, etc.]
+
+## CONTENUTI AGGIUNTIVI DA INCLUDERE
+[Suggerisci paragrafi, sezioni o elementi specifici da aggiungere]
+
+## CALL-TO-ACTION E CONVERSIONI
+[Suggerisci CTA ottimizzate per questo contenuto]"""
+
+SUGGESTIONS_JSON_FORMAT = """Rispondi SOLO con un oggetto JSON conforme allo schema: 2-3 miglioramenti concreti per criterio,
+5-8 URL interni scelti tra quelli disponibili, la struttura proposta (un titolo H2/H3 per voce),
+i contenuti aggiuntivi da includere e le CTA."""
+
+OPTIMIZED_CONTENT_INSTRUCTIONS = """Crea la versione FINALE e OTTIMIZZATA del contenuto fornito dall'utente, pronto per essere pubblicato.
+Applica TUTTI i suggerimenti di ottimizzazione E-E-A-T per creare un contenuto di qualità superiore.
+
+ISTRUZIONI PER IL CONTENUTO OTTIMIZZATO:
+
+1. **EXPERIENCE**: Integra esempi concreti, casi studio, dati specifici, esperienze pratiche
+2. **EXPERTISE**: Dimostra competenza tecnica, usa terminologia appropriata, includi insight originali
+3. **AUTHORITATIVENESS**: Cita fonti autorevoli, riferimenti a studi, link a risorse credibili
+4. **TRUSTWORTHINESS**: Mantieni trasparenza, obiettività, includi disclaimers quando necessario
+
+STRUTTURA IL CONTENUTO CON:
+- Titolo principale ottimizzato SEO
+- Introduzione coinvolgente
+- Sottotitoli H2, H3 ben strutturati
+- Paragrafi con esempi pratici e dati
+- Citazioni e riferimenti autorevoli
+- Link interni rilevanti integrati naturalmente
+- Call-to-action efficaci
+- Conclusione che sintetizza e invita all'azione
+
+MANTIENI:
+- Tone of voice: quello indicato nelle informazioni sul brand
+- Lunghezza minima: 1500-2000 parole
+- Formattazione markdown per web
+- SEO-friendly ma naturale
+- TITOLI: usa solo la prima lettera maiuscola (es: "Contattaci per scoprire le nostre soluzioni" NON "Contattaci per Scoprire le Nostre Soluzioni")
+
+Crea un contenuto che sia:
+✅ Pronto per la pubblicazione
+✅ Ottimizzato per E-E-A-T
+✅ SEO-friendly
+✅ Coinvolgente per l'utente
+✅ Allineato al brand
+✅ Con titoli in formato corretto (solo prima lettera maiuscola)"""
+
+OPTIMIZED_CONTENT_MARKDOWN_FORMAT = "GENERA IL CONTENUTO OTTIMIZZATO COMPLETO."
+
+OPTIMIZED_CONTENT_JSON_FORMAT = """Rispondi SOLO con un oggetto JSON conforme allo schema: title, meta_description (max 155 caratteri),
+content (il contenuto completo in markdown) e internal_links_used (gli URL interni inseriti nel testo)."""
+
+STAGE_GUIDES = {
+    'eeat_analysis': (EEAT_INSTRUCTIONS, EEAT_MARKDOWN_FORMAT, EEAT_JSON_FORMAT),
+    'optimization_suggestions': (SUGGESTIONS_INSTRUCTIONS, SUGGESTIONS_MARKDOWN_FORMAT, SUGGESTIONS_JSON_FORMAT),
+    'optimized_content': (OPTIMIZED_CONTENT_INSTRUCTIONS, OPTIMIZED_CONTENT_MARKDOWN_FORMAT, OPTIMIZED_CONTENT_JSON_FORMAT),
+}
+
+def stage_quality_check(stage, structured=False, original_content=''):
+    """Controllo di qualità della risposta di una fase, usato dalla modalità cascata di call_routed"""
+    if stage == 'optimized_content':
+        # Una riscrittura molto più corta dell'originale o senza titoli è quasi sempre troncata o incompleta
+        min_words = min(1200, int(len(original_content.split()) * 0.7))
+
+        def check(text):
+            if structured:
+                try:
+                    text = OptimizedContentResult.from_json(text).content
+                except ValueError:
+                    return False
+            return len(text.split()) >= min_words and any(SECTION_HEADING.match(line) for line in text.splitlines())
+        return check
+
+    result_type = {'eeat_analysis': EEATAnalysisResult, 'optimization_suggestions': OptimizationPlan}[stage]
+    if structured:
+        def check(text):
+            try:
+                result_type.from_json(text)
+                return True
+            except ValueError:
+                return False
+        return check
+    if stage == 'eeat_analysis':
+        return lambda text: len(parse_eeat_scores(text)) == len(EEAT_CRITERIA)
+    return lambda text: sum(f"MIGLIORAMENTI {c.upper()}" in text.upper() for c in EEAT_CRITERIA) >= 3
+
+def analyze_eeat_content(content, brand_info, openai_client, focus_criteria=None, local_scores=None, structured=False,
+                         **llm_options):
+    """Analizza il contenuto secondo i criteri E-E-A-T.
+
+    Con `focus_criteria` (modalità triage) l'analisi dettagliata è limitata ai
+    criteri deboli, mentre per gli altri il modello riporta i punteggi della
+    pre-valutazione locale (`local_scores`); la risposta attesa è più corta.
+    Con `structured=True` restituisce un EEATAnalysisResult validato.
+    Un documento lungo (is_long_content) viene analizzato per blocchi con
+    analyze_long_content, che restituisce sempre un EEATAnalysisResult.
+    """
+    if is_long_content(content):
+        return analyze_long_content(content, brand_info, openai_client, **llm_options)
+    profile = BrandProfile.from_brand_info(brand_info)
+    max_tokens = model_route('eeat_analysis').max_tokens
+    focus_note = ""
+    if focus_criteria:
+        strong = [c for c in EEAT_CRITERIA if c not in focus_criteria]
+        strong_scores = ', '.join(f"{c}: {(local_scores or {}).get(c, '-')}/10" for c in strong)
+        focus_note = f"""
+    PRE-VALUTAZIONE LOCALE:
+    I criteri {', '.join(strong) or '-'} risultano già adeguati ({strong_scores or '-'}).
+    Concentra l'analisi dettagliata, i punti di forza e le aree di miglioramento SOLO su: {', '.join(focus_criteria)}.
+    Per gli altri criteri riporta il punteggio indicato e al massimo una riga di commento.
+    """
+        max_tokens = int(max_tokens * (len(focus_criteria) + 1) / (len(EEAT_CRITERIA) + 1))
+    if structured:
+        max_tokens = max_tokens // 2
+
+    prompt = f"""
+    CONTENUTO DA ANALIZZARE:
+    {content}
+    {focus_note}
+    """
+
+    try:
+        result = call_routed(
+            openai_client,
+            prompt,
+            'eeat_analysis',
+            max_tokens=max_tokens,
+            quality_check=stage_quality_check('eeat_analysis', structured),
+            response_format=_json_schema_format('eeat_analysis', EEAT_ANALYSIS_SCHEMA) if structured else None,
+            system=profile.system_prompt('eeat_analysis', structured),
+            **llm_options
+        )
+        return EEATAnalysisResult.from_json(result) if structured else result
+    except Exception as e:
+        raise LLMError(f"Errore nell'analisi E-E-A-T: {str(e)}") from e
+
+PAGE_MARKER = re.compile(r'^\s*=== PAGINA (\d+) ===\s*$', re.MULTILINE)
+MULTI_PAGE_MAX_TOKENS = 16000
+
+def analyze_eeat_pages(contents, brand_info, openai_client, structured=False, **llm_options):
+    """Analizza più pagine brevi dello stesso brand con una sola richiesta.
+
+    Il messaggio di sistema è lo stesso di analyze_eeat_content (prefisso in
+    cache condiviso); il modello separa le analisi con un marcatore per
+    pagina, o con un array `pages` negli output strutturati. Restituisce una
+    lista allineata a `contents`: le pagine mancanti nella risposta vengono
+    rianalizzate singolarmente.
+    """
+    if len(contents) == 1:
+        return [analyze_eeat_content(contents[0], brand_info, openai_client, structured=structured, **llm_options)]
+    profile = BrandProfile.from_brand_info(brand_info)
+    pages = '\n\n'.join(f"=== PAGINA {i} ===\n{content}" for i, content in enumerate(contents, 1))
+    if structured:
+        split_note = (f"Restituisci nell'array \"pages\" un'analisi per ciascuna delle {len(contents)} pagine, "
+                      "nello stesso ordine.")
+    else:
+        split_note = (f"Analizza separatamente ciascuna delle {len(contents)} pagine: fai precedere ogni analisi dalla "
+                      "riga \"=== PAGINA N ===\" con il numero della pagina e non aggiungere altro testo.")
+
+    prompt = f"""
+    {split_note}
+
+    CONTENUTI DA ANALIZZARE:
+    {pages}
+    """
+
+    per_page_tokens = model_route('eeat_analysis').max_tokens // (2 if structured else 1)
+
+    def all_pages_present(text):
+        if not structured:
+            return len(set(PAGE_MARKER.findall(text))) == len(contents)
+        try:
+            return len(json.loads(text)['pages']) == len(contents)
+        except (ValueError, KeyError, TypeError):
+            return False
+
+    try:
+        result = call_routed(
+            openai_client,
+            prompt,
+            'eeat_analysis',
+            max_tokens=min(MULTI_PAGE_MAX_TOKENS, per_page_tokens * len(contents)),
+            quality_check=all_pages_present,
+            response_format=_json_schema_format('eeat_pages', EEAT_PAGES_SCHEMA) if structured else None,
+            system=profile.system_prompt('eeat_analysis', structured),
+            **llm_options
+        )
+    except Exception as e:
+        raise LLMError(f"Errore nell'analisi E-E-A-T: {str(e)}") from e
+
+    analyses = [None] * len(contents)
+    if structured:
+        try:
+            for i, page in enumerate(json.loads(result)['pages'][:len(contents)]):
+                analyses[i] = EEATAnalysisResult.from_json(json.dumps(page))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Risposta multi-pagina non valida, analisi pagina per pagina: %s", e)
+    else:
+        parts = PAGE_MARKER.split(result)
+        for number, text in zip(parts[1::2], parts[2::2]):
+            index = int(number) - 1
+            if 0 <= index < len(contents) and text.strip():
+                analyses[index] = text.strip()
+
+    for i, analysis in enumerate(analyses):
+        if analysis is None:
+            logger.info("Pagina %d assente nella risposta multi-pagina: analisi singola", i + 1)
+            analyses[i] = analyze_eeat_content(contents[i], profile, openai_client, structured=structured, **llm_options)
+    return analyses
+
+def generate_optimization_suggestions(content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, openai_client,
+                                      structured=False, **llm_options):
+    """Genera suggerimenti di ottimizzazione basati sull'analisi E-E-A-T (OptimizationPlan con structured=True)"""
+    profile = BrandProfile.from_brand_info(brand_info)
+    internal_links = select_internal_links(sitemap_urls, content, k=20)
+    if is_long_content(content):
+        # Per un documento lungo bastano titoli e passaggi principali: il prompt resta limitato
+        content = compact_text(content, CHUNK_TOKENS)
+    sections = fit_prompt_sections(
+        'optimization_suggestions', model_route('optimization_suggestions').model,
+        {'eeat_analysis': as_prompt_text(eeat_analysis), 'competitor_analysis': competitor_analysis},
+        protected={'content': content, 'brand': profile.context},
+        weights={'competitor_analysis': 2},
+        tracker=llm_options.get('tracker')
+    )
+    
+    prompt = f"""
+    CONTENUTO ATTUALE:
+    {content}
+
+    ANALISI E-E-A-T PRECEDENTE:
+    {sections['eeat_analysis']}
+
+    ANALISI COMPETITOR:
+    {sections['competitor_analysis']}
+
+    URL INTERNI DISPONIBILI (i 20 più pertinenti):
+    {format_internal_links(internal_links)}
+    """
+
+    try:
+        result = call_routed(
+            openai_client,
+            prompt,
+            'optimization_suggestions',
+            quality_check=stage_quality_check('optimization_suggestions', structured),
+            response_format=_json_schema_format('optimization_plan', OPTIMIZATION_PLAN_SCHEMA) if structured else None,
+            system=profile.system_prompt('optimization_suggestions', structured),
+            **llm_options
+        )
+        return OptimizationPlan.from_json(result) if structured else result
+    except Exception as e:
+        raise LLMError(f"Errore nella generazione dei suggerimenti: {str(e)}") from e
+
+def generate_optimized_content(original_content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, optimization_suggestions, openai_client,
+                               structured=False, validate=True, **llm_options):
+    """Genera il contenuto completamente ottimizzato pronto per la pubblicazione (OptimizedContentResult con structured=True).
+
+    Con `validate` il risultato passa da validate_optimized_content: titoli
+    in sentence case e link interni/esterni verificati prima di restituirlo.
+    """
+    if is_long_content(original_content):
+        # Un'unica risposta da 4000 token troncherebbe la riscrittura: si procede per blocchi
+        result = rewrite_long_content(
+            original_content, brand_info, sitemap_urls, eeat_analysis, optimization_suggestions, openai_client,
+            structured=structured, **llm_options
+        )
+    else:
+        result = _generate_optimized_page(
+            original_content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, optimization_suggestions,
+            openai_client, structured, **llm_options
+        )
+    if not validate:
+        return result
+    return validate_optimized_content(result, brand_info, sitemap_urls, openai_client, **llm_options)
+
+def _generate_optimized_page(original_content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis,
+                             optimization_suggestions, openai_client, structured, n=1, **llm_options):
+    """Una chiamata per il contenuto ottimizzato; con `n` > 1 restituisce la lista delle n varianti valide"""
+    profile = BrandProfile.from_brand_info(brand_info)
+    sections = fit_prompt_sections(
+        'optimized_content', model_route('optimized_content').model,
+        {
+            'eeat_analysis': as_prompt_text(eeat_analysis),
+            'optimization_suggestions': as_prompt_text(optimization_suggestions),
+            'competitor_analysis': competitor_analysis,
+        },
+        protected={'content': original_content, 'brand': profile.context},
+        weights={'optimization_suggestions': 2},
+        tracker=llm_options.get('tracker')
+    )
+    
+    prompt = f"""
+    CONTENUTO ORIGINALE:
+    {original_content}
+
+    ANALISI E-E-A-T:
+    {sections['eeat_analysis']}
+
+    SUGGERIMENTI DI OTTIMIZZAZIONE:
+    {sections['optimization_suggestions']}
+
+    COMPETITOR INSIGHTS:
+    {sections['competitor_analysis']}
+
+    URL INTERNI DISPONIBILI:
+    {format_internal_links(select_internal_links(sitemap_urls, original_content, k=15))}
+    """
+
+    check = stage_quality_check('optimized_content', structured, original_content)
+    try:
+        result = call_routed(
+            openai_client,
+            prompt,
+            'optimized_content',
+            # Con più varianti basta che una superi il controllo per evitare la cascata
+            quality_check=check if n == 1 else lambda texts: any(check(text) for text in texts),
+            response_format=_json_schema_format('optimized_content', OPTIMIZED_CONTENT_SCHEMA) if structured else None,
+            system=profile.system_prompt('optimized_content', structured),
+            n=n,
+            **llm_options
+        )
+        if n == 1:
+            return OptimizedContentResult.from_json(result) if structured else result
+        variants = []
+        for text in result:
+            try:
+                variants.append(OptimizedContentResult.from_json(text) if structured else text)
+            except ValueError as e:
+                logger.warning("Variante scartata: %s", e)
+        if not variants:
+            raise ValueError("nessuna variante valida nella risposta")
+        return variants
+    except Exception as e:
+        raise LLMError(f"Errore nella generazione del contenuto ottimizzato: {str(e)}") from e
+
+MAX_VARIANTS = 4
+VARIANT_LENGTH_TARGET = (1500, 2000)  # parole, come richiesto dal prompt del contenuto ottimizzato
+VARIANT_LINK_TARGET = 5
+VARIANT_WEIGHTS = {'eeat': 0.5, 'links': 0.3, 'length': 0.2}
+
+def rank_variants(variants, sitemap_urls, original_content, site_url='', length_target=VARIANT_LENGTH_TARGET,
+                  validations=None):
+    """Ordina le varianti del contenuto ottimizzato con criteri locali, senza chiamate al modello.
+
+    Ogni variante riceve un punteggio da 0 a 1 che combina (VARIANT_WEIGHTS) i
+    segnali E-E-A-T euristici di prescore_eeat, la copertura dei link interni
+    proposti nel prompt e la vicinanza alla lunghezza richiesta. `validations`,
+    nello stesso ordine delle varianti, finisce in `validation` di ogni voce.
+    """
+    texts = [as_markdown(variant) for variant in variants]
+    eeat = prescore_eeat(texts)
+    offered = {normalize_url(url) for url in select_internal_links(sitemap_urls, original_content, k=15)}
+    link_target = min(VARIANT_LINK_TARGET, len(offered))
+    low, high = length_target
+    ranked = []
+    validations = validations or [None] * len(variants)
+    for variant, text, scores, validation in zip(variants, texts, eeat, validations):
+        used = {
+            normalize_url(urljoin(site_url, url) if site_url else url)
+            for _, url, _, _ in extract_markdown_links(text)
+        } & offered
+        words = len(text.split())
+        distance = max(low - words, words - high, 0)
+        components = {
+            'eeat': (float(scores.mean()) - 1) / 9,
+            'links': min(1.0, len(used) / link_target) if link_target else 1.0,
+            'length': max(0.0, 1 - distance / low),
+        }
+        ranked.append({
+            'content': variant,
+            'score': round(sum(VARIANT_WEIGHTS[name] * value for name, value in components.items()), 3),
+            'eeat_scores': dict(zip(EEAT_CRITERIA, scores.tolist())),
+            'internal_links': len(used),
+            'words': words,
+            'validation': validation,
+            **{f"{name}_score": round(value, 3) for name, value in components.items()},
+        })
+    return sorted(ranked, key=lambda entry: entry['score'], reverse=True)
+
+def generate_optimized_variants(original_content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis,
+                                optimization_suggestions, openai_client, n=3, structured=False, **llm_options):
+    """Genera n varianti del contenuto ottimizzato con un'unica richiesta e le restituisce ordinate (rank_variants).
+
+    Riusa analisi e suggerimenti già calcolati, quindi costa una sola fase:
+    il prompt è quello di generate_optimized_content e i token di input sono
+    pagati una volta. Le varianti passano dalla validazione locale senza
+    correzioni del modello (i link non validi vengono rimossi); l'esito è in
+    `validation` di ogni voce. I link esterni di tutte le varianti vengono
+    verificati insieme, con un solo giro di richieste HEAD. I documenti
+    lunghi, riscritti per blocchi, producono una sola variante.
+    """
+    n = max(1, min(n, MAX_VARIANTS))
+    llm_options = dict(llm_options, on_token=None, metrics=None)
+    if is_long_content(original_content):
+        variants = [rewrite_long_content(
+            original_content, brand_info, sitemap_urls, eeat_analysis, optimization_suggestions, openai_client,
+            structured=structured, **llm_options
+        )]
+    else:
+        variants = _generate_optimized_page(
+            original_content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, optimization_suggestions,
+            openai_client, structured, n=n, **llm_options
+        )
+        if n == 1:
+            variants = [variants]
+
+    site_url = brand_info['url'] or ''
+    link_statuses = check_external_links([
+        url for variant in variants for url in external_links(as_markdown(variant), sitemap_urls, site_url)
+    ])
+    validated, validations = [], []
+    for variant in variants:
+        report = {}
+        validated.append(validate_optimized_content(variant, brand_info, sitemap_urls, link_statuses=link_statuses,
+                                                    metrics=report))
+        validations.append(report.get('validation'))
+    return rank_variants(validated, sitemap_urls, original_content, site_url, validations=validations)
+
+SECTION_HEADING = re.compile(r'^\s{0,3}#{1,6}\s+\S')
+
+def split_sections(content):
+    """Divide il contenuto in sezioni delimitate dai titoli markdown (#, ##, ...).
+
+    L'eventuale testo prima del primo titolo forma una sezione introduttiva;
+    un contenuto senza titoli resta un'unica sezione.
+    """
+    sections, current = [], []
+    for line in content.splitlines():
+        if SECTION_HEADING.match(line) and any(l.strip() for l in current):
+            sections.append('\n'.join(current).strip())
+            current = []
+        current.append(line)
+    if any(l.strip() for l in current):
+        sections.append('\n'.join(current).strip())
+    result = []
+    for text in sections:
+        first_line = text.splitlines()[0]
+        heading = first_line.strip().lstrip('#').strip() if SECTION_HEADING.match(first_line) else "Introduzione"
+        result.append({'heading': heading, 'text': text})
+    return result
+
+def section_key(text, brand_info):
+    """Hash della sezione (spazi normalizzati) e delle informazioni sul brand che ne influenzano la riscrittura"""
+    brand = asdict(brand_info) if is_dataclass(brand_info) else brand_info
+    payload = json.dumps([re.sub(r'\s+', ' ', text).strip(), brand], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def analyze_section(section, brand_info, openai_client, **llm_options):
+    """Analisi E-E-A-T sintetica di una singola sezione del contenuto"""
+    prompt = f"""
+    Valuta questa sezione di una pagina del brand "{brand_info['nome']}" ({brand_info['url']}) secondo i criteri E-E-A-T di Google.
+
+    SEZIONE "{section['heading']}":
+    {section['text']}
+
+    Elenca al massimo 5 problemi concreti (Experience, Expertise, Authoritativeness, Trustworthiness),
+    ognuno con la correzione da applicare. Se la sezione è già adeguata scrivi solo "Sezione adeguata".
+    """
+    try:
+        return call_routed(
+            openai_client,
+            prompt,
+            'section_analysis',
+            **llm_options
+        )
+    except Exception as e:
+        raise LLMError(f"Errore nell'analisi della sezione \"{section['heading']}\": {str(e)}") from e
+
+def rewrite_section(section, analysis, brand_info, outline, internal_links, openai_client, **llm_options):
+    """Riscrive una singola sezione applicando le correzioni della sua analisi"""
+    prompt = f"""
+    Riscrivi la sezione seguente di una pagina del brand "{brand_info['nome']}" applicando le correzioni E-E-A-T indicate.
+
+    STRUTTURA DELLA PAGINA (per contesto, non riscriverla):
+    {chr(10).join(f"- {heading}" for heading in outline)}
+
+    SEZIONE DA RISCRIVERE "{section['heading']}":
+    {section['text']}
+
+    CORREZIONI DA APPLICARE:
+    {analysis}
+
+    BRAND:
+    - Tone of Voice: {brand_info['tone_of_voice']}
+    - Chi siamo: {compact_text(brand_info['chi_siamo'], 200)}
+
+    URL INTERNI PERTINENTI (inseriscine al massimo 2 se davvero utili):
+    {format_internal_links(internal_links)}
+
+    ISTRUZIONI:
+    - Restituisci SOLO la sezione riscritta in markdown, mantenendo lo stesso titolo e lo stesso livello
+    - Lunghezza simile all'originale (al massimo +30%)
+    - Non ripetere contenuti che appartengono ad altre sezioni della pagina
+    """
+    max_tokens = min(model_route('section_rewrite').max_tokens, int(count_tokens(section['text']) * 1.6) + 200)
+    try:
+        return call_routed(
+            openai_client,
+            prompt,
+            'section_rewrite',
+            max_tokens=max_tokens,
+            **llm_options
+        ).strip()
+    except Exception as e:
+        raise LLMError(f"Errore nella riscrittura della sezione \"{section['heading']}\": {str(e)}") from e
+
+def optimize_sections(content, brand_info, sitemap_urls, openai_client, previous=None, max_workers=4, **llm_options):
+    """Ottimizzazione incrementale: analizza e riscrive solo le sezioni modificate rispetto a `previous`.
+
+    `previous` mappa l'hash di ogni sezione (section_key) al risultato di
+    un'esecuzione precedente; le sezioni con lo stesso hash vengono riusate
+    senza chiamate al modello. Restituisce il contenuto ricomposto, le
+    sezioni con esito e analisi, la nuova mappa da conservare per il
+    prossimo giro (solo sezioni ancora presenti) e gli eventuali errori:
+    una sezione fallita resta nella versione originale e verrà ritentata.
+    """
+    previous = previous or {}
+    sections = split_sections(content)
+    outline = [section['heading'] for section in sections]
+    for section in sections:
+        section['key'] = section_key(section['text'], brand_info)
+
+    def process(section):
+        analysis = analyze_section(section, brand_info, openai_client, **llm_options)
+        internal_links = select_internal_links(sitemap_urls, section['text'], k=5)
+        optimized = rewrite_section(section, analysis, brand_info, outline, internal_links, openai_client, **llm_options)
+        return {'heading': section['heading'], 'analysis': analysis, 'optimized': optimized}
+
+    todo = {section['key']: section for section in sections if section['key'] not in previous}
+    fresh, errors = {}, {}
+    if todo:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(process, section): key for key, section in todo.items()}
+            for future in futures:
+                key = futures[future]
+                try:
+                    fresh[key] = future.result()
+                except LLMError as e:
+                    errors[todo[key]['heading']] = str(e)
+
+    results, store = [], {}
+    for section in sections:
+        entry = previous.get(section['key']) or fresh.get(section['key'])
+        if entry is not None:
+            store[section['key']] = entry
+        results.append({
+            'heading': section['heading'],
+            'key': section['key'],
+            'reused': section['key'] not in todo,
+            'failed': entry is None,
+            'analysis': entry['analysis'] if entry else '',
+            'optimized': entry['optimized'] if entry else section['text'],
+        })
+    return {
+        'content': '\n\n'.join(result['optimized'] for result in results),
+        'sections': results,
+        'store': store,
+        'reused': sum(result['reused'] for result in results),
+        'regenerated': len(fresh),
+        'errors': errors,
+    }
+
+# Modalità map-reduce per i documenti lunghi: oltre LONG_CONTENT_TOKENS il contenuto
+# viene diviso in blocchi da al massimo CHUNK_TOKENS, analizzati e riscritti in parallelo
+LONG_CONTENT_TOKENS = 6000
+CHUNK_TOKENS = 1500
+LONG_CONTENT_WORKERS = 4
+
+def is_long_content(content):
+    return count_tokens(content) > LONG_CONTENT_TOKENS
+
+def _split_long_text(text, max_tokens):
+    """Divide un testo troppo lungo per paragrafi (e, se serve, per frasi) in parti di al massimo max_tokens"""
+    units = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        if count_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+        else:
+            units.extend(re.split(r'(?<=[.!?])\s+', paragraph))
+    parts, current, used = [], [], 0
+    for unit in units:
+        size = count_tokens(unit)
+        if current and used + size > max_tokens:
+            parts.append('\n\n'.join(current))
+            current, used = [], 0
+        current.append(unit)
+        used += size
+    if current:
+        parts.append('\n\n'.join(current))
+    return parts
+
+def chunk_content(content, max_tokens=CHUNK_TOKENS):
+    """Raggruppa le sezioni del contenuto (split_sections) in blocchi di al massimo max_tokens.
+
+    Le sezioni brevi consecutive vengono unite nello stesso blocco; una
+    sezione più lunga del limite viene divisa per paragrafi.
+    """
+    chunks = []
+    for section in split_sections(content):
+        parts = [section['text']]
+        if count_tokens(section['text']) > max_tokens:
+            parts = _split_long_text(section['text'], max_tokens)
+        for i, part in enumerate(parts):
+            heading = section['heading'] if i == 0 else f"{section['heading']} (parte {i + 1})"
+            tokens = count_tokens(part)
+            if chunks and chunks[-1]['tokens'] + tokens <= max_tokens:
+                chunks[-1]['text'] += '\n\n' + part
+                chunks[-1]['tokens'] += tokens
+                chunks[-1]['headings'].append(heading)
+            else:
+                chunks.append({'text': part, 'tokens': tokens, 'headings': [heading]})
+    for chunk in chunks:
+        headings = chunk.pop('headings')
+        chunk['heading'] = headings[0] if len(headings) == 1 else f"{headings[0]} (+{len(headings) - 1} {'sezione' if len(headings) == 2 else 'sezioni'})"
+    return chunks
+
+def analyze_eeat_chunks(chunks, brand_info, openai_client, max_workers=LONG_CONTENT_WORKERS, **llm_options):
+    """Fase map: analisi E-E-A-T strutturata di ogni blocco, in parallelo.
+
+    Il messaggio di sistema è quello di analyze_eeat_content con output
+    strutturato, così il prefisso in cache è condiviso tra i blocchi.
+    """
+    system = BrandProfile.from_brand_info(brand_info).system_prompt('eeat_analysis', structured=True)
+
+    def analyze(number, chunk):
+        prompt = f"""
+    BLOCCO {number} DI {len(chunks)} DI UNA PAGINA PIÙ LUNGA ("{chunk['heading']}").
+    Valuta solo questo blocco: gli altri vengono analizzati a parte.
+
+    CONTENUTO DA ANALIZZARE:
+    {chunk['text']}
+    """
+        try:
+            result = call_routed(
+                openai_client,
+                prompt,
+                'eeat_analysis',
+                max_tokens=1000,
+                quality_check=stage_quality_check('eeat_analysis', structured=True),
+                response_format=_json_schema_format('eeat_analysis', EEAT_ANALYSIS_SCHEMA),
+                system=system,
+                **llm_options
+            )
+            return EEATAnalysisResult.from_json(result)
+        except Exception as e:
+            raise LLMError(f"Errore nell'analisi E-E-A-T del blocco \"{chunk['heading']}\": {str(e)}") from e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(analyze, range(1, len(chunks) + 1), chunks))
+
+def _merge_findings(lists, limit=8):
+    """Unisce gli elenchi dei blocchi alternandoli ed eliminando i duplicati, fino a `limit` voci"""
+    merged, seen = [], set()
+    for depth in range(max(map(len, lists), default=0)):
+        for items in lists:
+            if depth < len(items) and _normalize_sentence(items[depth]) not in seen:
+                seen.add(_normalize_sentence(items[depth]))
+                merged.append(items[depth])
+    return merged[:limit]
+
+def reduce_eeat_analyses(chunks, analyses):
+    """Fase reduce: un'unica analisi di pagina con i punteggi medi pesati sulla lunghezza dei blocchi"""
+    total_tokens = sum(chunk['tokens'] for chunk in chunks) or 1
+    scores, analysis = {}, {}
+    for c in EEAT_CRITERIA:
+        values = [result.score(c) for result in analyses]
+        weighted = sum(value * chunk['tokens'] for value, chunk in zip(values, chunks)) / total_tokens
+        scores[c.lower()] = min(10, max(1, round(weighted)))
+        weakest = values.index(min(values))
+        analysis[c.lower()] = (
+            f"Media pesata su {len(chunks)} blocchi (da {min(values)} a {max(values)}/10). "
+            f"Blocco più debole, \"{chunks[weakest]['heading']}\": {analyses[weakest].analysis[c.lower()]}"
+        )
+    # Punti deboli dai blocchi peggiori, punti di forza dai migliori
+    by_total = sorted(analyses, key=lambda result: result.total)
+    return EEATAnalysisResult(
+        scores=scores,
+        analysis=analysis,
+        strengths=_merge_findings([result.strengths for result in reversed(by_total)]),
+        weaknesses=_merge_findings([result.weaknesses for result in by_total]),
+        sections=[
+            {'heading': chunk['heading'], 'scores': result.scores, 'weaknesses': result.weaknesses}
+            for chunk, result in zip(chunks, analyses)
+        ],
+    )
+
+def analyze_long_content(content, brand_info, openai_client, max_workers=LONG_CONTENT_WORKERS, **llm_options):
+    """Analisi E-E-A-T map-reduce di un documento lungo (EEATAnalysisResult con i punteggi per blocco)"""
+    # I blocchi sono in parallelo: niente streaming verso un'unica area di testo
+    llm_options = dict(llm_options, on_token=None, metrics=None)
+    chunks = chunk_content(content)
+    analyses = analyze_eeat_chunks(chunks, brand_info, openai_client, max_workers=max_workers, **llm_options)
+    return reduce_eeat_analyses(chunks, analyses)
+
+def rewrite_long_content(content, brand_info, sitemap_urls, eeat_analysis, optimization_suggestions, openai_client,
+                         structured=False, max_workers=LONG_CONTENT_WORKERS, **llm_options):
+    """Riscrive un documento lungo blocco per blocco, in parallelo, e ricompone il risultato.
+
+    Ogni blocco riceve i propri punti deboli (se l'analisi è map-reduce) e i
+    suggerimenti di pagina compattati; `on_token` riceve il testo ricomposto
+    man mano che i blocchi, nell'ordine, sono pronti.
+    """
+    on_token = llm_options.get('on_token')
+    llm_options = dict(llm_options, on_token=None, metrics=None)
+    chunks = chunk_content(content)
+    outline = [chunk['heading'] for chunk in chunks]
+    # Le sezioni dell'analisi map-reduce seguono l'ordine dei blocchi: i titoli possono ripetersi
+    sections = getattr(eeat_analysis, 'sections', None) or []
+    chunk_findings = dict(enumerate(sections)) if len(sections) == len(chunks) else {}
+    page_suggestions = compact_text(as_prompt_text(optimization_suggestions), 500)
+
+    def rewrite(index, chunk):
+        findings = chunk_findings.get(index)
+        if findings:
+            scores = ', '.join(f"{c} {findings['scores'][c.lower()]}/10" for c in EEAT_CRITERIA)
+            analysis = f"Punteggi del blocco: {scores}\nPunti deboli:\n{_bullets(findings['weaknesses'])}"
+        else:
+            analysis = compact_text(as_prompt_text(eeat_analysis), 300)
+        analysis += f"\n\nSUGGERIMENTI PER L'INTERA PAGINA (applica solo quelli pertinenti al blocco):\n{page_suggestions}"
+        internal_links = select_internal_links(sitemap_urls, chunk['text'], k=5)
+        return rewrite_section(chunk, analysis, brand_info, outline, internal_links, openai_client, **llm_options)
+
+    rewritten = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for text in executor.map(rewrite, range(len(chunks)), chunks):
+            rewritten.append(text)
+            if on_token:
+                on_token('\n\n'.join(rewritten))
+    optimized = '\n\n'.join(rewritten)
+    if not structured:
+        return optimized
+
+    title = next((line.lstrip('#').strip() for line in optimized.splitlines() if SECTION_HEADING.match(line)), '')
+    first_paragraph = next(
+        (p.strip() for p in re.split(r'\n\s*\n', optimized) if p.strip() and not SECTION_HEADING.match(p)), ''
+    )
+    site_url = brand_info['url'] or ''
+    linked = {
+        normalize_url(urljoin(site_url, url) if site_url else url) for _, url, _, _ in extract_markdown_links(optimized)
+    }
+    return OptimizedContentResult(
+        title=title,
+        meta_description=first_paragraph[:152].rsplit(' ', 1)[0] + '...' if len(first_paragraph) > 155 else first_paragraph,
+        content=optimized,
+        internal_links_used=[url for url in sitemap_urls if normalize_url(url) in linked],
+    )
+
+URL_INDEX_BLOOM_THRESHOLD = 200_000
+BLOOM_ERROR_RATE = 0.001
+EXTERNAL_LINK_TIMEOUT = 5
+DNS_FAILURE = re.compile(r'NameResolutionError|Failed to resolve|Name or service not known|getaddrinfo failed|nodename nor servname')
+LINK_REPAIR_WORKERS = 4
+
+MARKDOWN_LINK = re.compile(r'(?<!!)\[([^\]\n]+)\]\(\s*<?([^)\s>]+)>?(?:\s+"[^"\n]*")?\s*\)')
+AUTOLINK = re.compile(r'<(https?://[^>\s]+)>')
+MARKDOWN_HEADING = re.compile(r'^(\s{0,3}#{1,6}\s+)(.+?)(\s+#+)?\s*$')
+
+def normalize_url(url):
+    """Forma canonica di un URL per il confronto: senza schema, www, frammento e slash finale"""
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parsed.port and parsed.port not in (80, 443):
+        host = f"{host}:{parsed.port}"
+    path = parsed.path.rstrip('/') or '/'
+    return f"{host}{path}?{parsed.query}" if parsed.query else f"{host}{path}"
+
+def _url_hashes(urls):
+    """Due hash a 64 bit per URL normalizzato (blake2b), come array NumPy"""
+    digests = b''.join(hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=16).digest() for url in urls)
+    pairs = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+class HashedUrlSet:
+    """Insieme esatto di URL conservato come array ordinato di hash a 64 bit (8 byte per URL)"""
+
+    def __init__(self, urls):
+        self.hashes = np.unique(_url_hashes(urls)[0])
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, url):
+        value = _url_hashes([url])[0][0]
+        i = np.searchsorted(self.hashes, value)
+        return bool(i < len(self.hashes) and self.hashes[i] == value)
+
+class BloomFilter:
+    """Filtro di Bloom su array di bit NumPy per sitemap molto grandi.
+
+    Nessun falso negativo e falsi positivi intorno a `error_rate`, con circa
+    1,8 byte per URL allo 0,1%; le k posizioni derivano da due hash (double hashing).
+    """
+
+    def __init__(self, urls, error_rate=BLOOM_ERROR_RATE):
+        urls = list(urls)
+        capacity = max(1, len(urls))
+        self.size = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = len(urls)
+        bits = np.zeros(self.size, dtype=bool)
+        for start in range(0, len(urls), 100_000):
+            bits[self._positions(urls[start:start + 100_000]).ravel()] = True
+        self.bits = np.packbits(bits)
+
+    def _positions(self, urls):
+        h1, h2 = _url_hashes(urls)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (h1[:, None] + steps * (h2[:, None] | np.uint64(1))) % np.uint64(self.size)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, url):
+        positions = self._positions([url])[0]
+        return bool(np.all(self.bits[positions >> np.uint64(3)] & (np.uint8(128) >> (positions & np.uint64(7)).astype(np.uint8))))
+
+def build_url_index(urls, bloom_threshold=URL_INDEX_BLOOM_THRESHOLD):
+    """Indice di appartenenza degli URL della sitemap: esatto, o filtro di Bloom oltre `bloom_threshold` URL"""
+    return BloomFilter(urls) if len(urls) > bloom_threshold else HashedUrlSet(urls)
+
+@st.cache_resource(max_entries=8)
+def get_url_index(urls_digest, _urls):
+    return build_url_index(_urls)
+
+def extract_markdown_links(markdown):
+    """Link di un testo markdown come (testo, url, inizio, fine), inclusi gli autolink <https://...>"""
+    links = [(m.group(1), m.group(2), m.start(), m.end()) for m in MARKDOWN_LINK.finditer(markdown)]
+    spans = [(start, end) for _, _, start, end in links]
+    links += [
+        (m.group(1), m.group(1), m.start(), m.end()) for m in AUTOLINK.finditer(markdown)
+        if not any(start <= m.start() < end for start, end in spans)
+    ]
+    return sorted(links, key=lambda link: link[2])
+
+def _proper_nouns(markdown):
+    """Parole che nel corpo del testo compaiono solo con l'iniziale maiuscola a metà frase (nomi propri)"""
+    capitalized, lowercase = set(), set()
+    for line in markdown.splitlines():
+        if MARKDOWN_HEADING.match(line):
+            continue
+        for sentence in re.split(r'[.!?:]\s+|\n', MARKDOWN_LINK.sub(r'\1', line)):
+            for word in re.findall(r"[^\W\d_][\w'’-]*", sentence)[1:]:
+                (capitalized if word[0].isupper() else lowercase).add(word.lower())
+    return capitalized - lowercase
+
+WORD_PUNCTUATION = "*_`\"'«»“”‘’()[]{}:;,.!?¿¡"
+
+def _keeps_case(core, keep):
+    return (
+        not core
+        or not core[0].isupper()
+        or core.lower() in keep
+        or any(ch.isdigit() for ch in core)
+        or any(ch.isupper() for ch in core[1:])  # sigle (SEO, E-E-A-T) e nomi come WordPress
+    )
+
+def sentence_case(text, keep=frozenset()):
+    """Porta un titolo in sentence case: maiuscola solo la prima parola, salvo sigle e nomi propri in `keep`"""
+    words = text.split(' ')
+    seen_first = False
+    for i, word in enumerate(words):
+        if not re.search(r'\w', word) or '://' in word or '](' in word:
+            continue
+        # Con l'elisione (Dell'Azienda) conta la parola dopo l'apostrofo
+        stripped = word.strip(WORD_PUNCTUATION)
+        parts = re.split(r"(['’])", stripped)
+        if not _keeps_case(parts[-1], keep):
+            first_part = 2 if not seen_first else 0
+            fixed = ''.join(
+                part[:1].lower() + part[1:] if n >= first_part and n % 2 == 0 else part for n, part in enumerate(parts)
+            )
+            words[i] = word.replace(stripped, fixed, 1)
+        seen_first = True
+    return ' '.join(words)
+
+def is_title_case(text):
+    """Titolo in Title Case: oltre metà delle parole di 4+ lettere dopo la prima ha l'iniziale maiuscola.
 
-# Inizializzazione dello stato della sessione
-if 'analysis_complete' not in st.session_state:
-    st.session_state.analysis_complete = False
-if 'optimization_complete' not in st.session_state:
-    st.session_state.optimization_complete = False
+    Sigle e parole con maiuscole interne non contano; un titolo già in
+    sentence case con qualche nome proprio ("Perché Google premia l'esperienza a Milano") non è Title Case.
+    """
+    words = [re.split(r"['’]", word.strip(WORD_PUNCTUATION))[-1] for word in text.split()[1:]]
+    words = [
+        word for word in words
+        if len(word) >= 4 and word.isalpha() and not any(ch.isupper() for ch in word[1:])
+    ]
+    return bool(words) and sum(word[0].isupper() for word in words) > len(words) / 2
 
-def init_openai_client(api_key):
-    """Inizializza il client OpenAI"""
-    try:
-        openai.api_key = api_key
-        # Test della connessione
-        openai.models.list()
-        return True
-    except Exception as e:
-        st.error(f"Errore nella configurazione OpenAI: {str(e)}")
-        return False
+def fix_title_case(text, keep=frozenset()):
+    """sentence_case applicato solo ai titoli in Title Case, gli altri restano invariati"""
+    return sentence_case(text, keep) if is_title_case(text) else text
 
-def extract_sitemap_urls(sitemap_content):
-    """Estrae gli URL dalla sitemap XML"""
-    urls = []
-    try:
-        if sitemap_content.startswith('http'):
-            # È un URL, scarica il contenuto
-            response = requests.get(sitemap_content, timeout=10)
-            content = response.text
-        else:
-            # È il contenuto XML diretto
-            content = sitemap_content
-        
-        root = ET.fromstring(content)
-        
-        # Namespace comuni per sitemap
-        namespaces = {
-            'sitemap': 'http://www.sitemaps.org/schemas/sitemap/0.9'
-        }
-        
-        # Cerca URL nelle sitemap
-        for url_elem in root.findall('.//sitemap:url/sitemap:loc', namespaces):
-            urls.append(url_elem.text)
-        
-        # Se non trova nulla, prova senza namespace
-        if not urls:
-            for url_elem in root.findall('.//loc'):
-                urls.append(url_elem.text)
-                
-    except Exception as e:
-        st.error(f"Errore nell'estrazione della sitemap: {str(e)}")
-    
-    return urls
+def case_exceptions(markdown, brand_name=''):
+    """Parole che restano maiuscole nei titoli: nomi propri del testo e parole del nome del brand"""
+    return _proper_nouns(markdown) | {word.lower() for word in re.findall(r'\w+', brand_name or '')}
 
-def scrape_website_content(url):
-    """Scrappa il contenuto di una pagina web"""
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Rimuovi script, style e altri elementi non necessari
-        for element in soup(['script', 'style', 'nav', 'header', 'footer']):
-            element.decompose()
-        
-        # Estrai il testo principale
-        text = soup.get_text()
-        
-        # Pulisci il testo
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        return text[:5000]  # Limita a 5000 caratteri
-        
-    except Exception as e:
-        return f"Errore nel caricamento del contenuto: {str(e)}"
+def fix_heading_case(markdown, brand_name=''):
+    """Corregge in modo deterministico i titoli in Title Case; restituisce (markdown, [(prima, dopo)])"""
+    keep = case_exceptions(markdown, brand_name)
+    lines, changes = markdown.split('\n'), []
+    in_code = False
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith('```'):
+            in_code = not in_code
+        match = not in_code and MARKDOWN_HEADING.match(line)
+        if not match:
+            continue
+        fixed = fix_title_case(match.group(2), keep)
+        if fixed != match.group(2):
+            changes.append((match.group(2), fixed))
+            lines[i] = match.group(1) + fixed + (match.group(3) or '')
+    return '\n'.join(lines), changes
 
-def analyze_eeat_content(content, brand_info, openai_client):
-    """Analizza il contenuto secondo i criteri E-E-A-T"""
-    
-    prompt = f"""
-    Analizza il seguente contenuto secondo i criteri E-E-A-T di Google per il brand "{brand_info['nome']}":
+def check_external_links(urls, max_workers=8, timeout=EXTERNAL_LINK_TIMEOUT, total_timeout=30):
+    """Verifica i link esterni con richieste HEAD parallele sul pool HTTP condiviso.
 
-    CONTENUTO DA ANALIZZARE:
-    {content}
+    Restituisce {url: stato}: il codice HTTP o il messaggio d'errore. I server che
+    non accettano HEAD (405, 501) ricevono una GET in streaming, senza scaricare il corpo.
+    """
+    session = get_http_session()
+    throttle = HostThrottle(max_concurrent=2, min_interval=0.1)
+    deadline = time.monotonic() + total_timeout
 
-    INFORMAZIONI SUL BRAND:
-    - Nome: {brand_info['nome']}
-    - URL: {brand_info['url']}
-    - Tone of Voice: {brand_info['tone_of_voice']}
-    - Chi Siamo: {brand_info['chi_siamo']}
-
-    Valuta il contenuto secondo questi 4 criteri E-E-A-T e assegna un punteggio da 1 a 10 per ciascuno:
-
-    1. EXPERIENCE (Esperienza):
-    - Presenza di esempi pratici e diversificati
-    - Applicabilità nel mondo reale
-    - Dettagli specifici e contestualizzati
-    - Casi studio o esperienze dirette
-
-    2. EXPERTISE (Competenza):
-    - Dimostrazione di conoscenza approfondita
-    - Accuratezza tecnica delle informazioni
-    - Insight originali o ricerche proprietarie
-    - Uso di terminologia specialistica appropriata
-
-    3. AUTHORITATIVENESS (Autorevolezza):
-    - Citazioni di fonti affidabili
-    - Riferimenti a studi e ricerche
-    - Collegamenti a risorse autorevoli
-    - Riconoscimenti nel settore
-
-    4. TRUSTWORTHINESS (Affidabilità):
-    - Trasparenza delle informazioni
-    - Obiettività del punto di vista
-    - Menzione di limiti o conflitti di interesse
-    - Presenza di dati e prove a supporto
-
-    Fornisci l'analisi in questo formato:
-    
-    ## PUNTEGGI E-E-A-T (da 1 a 10)
-    - Experience: [punteggio]/10
-    - Expertise: [punteggio]/10
-    - Authoritativeness: [punteggio]/10
-    - Trustworthiness: [punteggio]/10
-    - **PUNTEGGIO TOTALE: [somma]/40**
-
-    ## ANALISI DETTAGLIATA
-    
-    ### Experience
-    [Analisi dettagliata della componente Experience con esempi specifici dal contenuto]
-    
-    ### Expertise
-    [Analisi dettagliata della componente Expertise con esempi specifici dal contenuto]
-    
-    ### Authoritativeness
-    [Analisi dettagliata della componente Authoritativeness con esempi specifici dal contenuto]
-    
-    ### Trustworthiness
-    [Analisi dettagliata della componente Trustworthiness con esempi specifici dal contenuto]
-    
-    ## PUNTI DI FORZA
-    [Elenco dei punti di forza identificati]
-    
-    ## AREE DI MIGLIORAMENTO
-    [Elenco delle aree che necessitano miglioramento]
+    def check(url):
+        try:
+            with throttle.slot(url, deadline=deadline):
+                response = session.head(url, timeout=timeout, allow_redirects=True)
+                if response.status_code in (405, 501):
+                    with session.get(url, timeout=timeout, stream=True) as response:
+                        pass
+                return response.status_code
+        except (requests.RequestException, TimeoutError) as e:
+            return 'DNSError' if DNS_FAILURE.search(str(e)) else type(e).__name__
+
+    unique = list(dict.fromkeys(urls))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as executor:
+        return dict(zip(unique, executor.map(check, unique)))
+
+def is_broken_link(status):
+    """Solo esiti definitivi: 404, 410 e dominio inesistente (DNS)"""
+    return status in (404, 410, 'DNSError')
+
+def is_unverified_link(status):
+    """Esiti non conclusivi: timeout, errori di rete e risposte come 403/429/503 delle protezioni anti-bot"""
+    return not is_broken_link(status) and (not isinstance(status, int) or status >= 400)
+
+def _classify_links(markdown, sitemap_urls, site_url):
+    """Divide i link del contenuto in interni (verificati contro la sitemap) ed esterni: (resoconto, esterni)"""
+    site_host = normalize_url(site_url).split('/', 1)[0] if site_url else ''
+    hosts = {normalize_url(url).split('/', 1)[0] for url in sitemap_urls[:100]} | ({site_host} if site_host else set())
+    index = None
+    if sitemap_urls:
+        digest = hashlib.sha1('\n'.join(sitemap_urls).encode('utf-8')).hexdigest()
+        index = get_url_index(digest, sitemap_urls)
+
+    report = {
+        'internal_links': 0, 'external_links': 0, 'invalid_internal': [], 'broken_external': [], 'unverified_external': [],
+    }
+    external = []
+    for _, url, _, _ in extract_markdown_links(markdown):
+        if url.startswith(('#', 'mailto:', 'tel:')):
+            continue
+        absolute = urljoin(site_url, url) if site_url and not urlparse(url).netloc else url
+        if normalize_url(absolute).split('/', 1)[0] in hosts:
+            report['internal_links'] += 1
+            if index is not None and absolute not in index:
+                report['invalid_internal'].append(url)
+        elif urlparse(absolute).scheme in ('http', 'https'):
+            report['external_links'] += 1
+            external.append(url)
+    return report, external
+
+def external_links(markdown, sitemap_urls, site_url):
+    """Link esterni del contenuto, da verificare con check_external_links"""
+    return _classify_links(markdown, sitemap_urls, site_url)[1]
+
+def validate_links(markdown, sitemap_urls, site_url, check_external=True, link_statuses=None):
+    """Controlla i link del contenuto generato: gli interni contro l'indice della sitemap, gli esterni via HEAD.
+
+    Senza sitemap i link interni non sono verificabili e vengono accettati.
+    `link_statuses` ({url: stato} di check_external_links) evita di ripetere
+    le richieste HEAD per link già verificati.
     """
+    report, external = _classify_links(markdown, sitemap_urls, site_url)
+    if external and (check_external or link_statuses is not None):
+        statuses = link_statuses if link_statuses is not None else check_external_links(external)
+        report['broken_external'] = [url for url in external if is_broken_link(statuses.get(url))]
+        # Link non verificabili ora: restano nel testo e vengono solo segnalati
+        report['unverified_external'] = [url for url in external if is_unverified_link(statuses.get(url))]
+    for key in ('invalid_internal', 'broken_external', 'unverified_external'):
+        report[key] = list(dict.fromkeys(report[key]))
+    return report
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=2000,
-            temperature=0.3
+def unlink(markdown, urls):
+    """Rimuove i link verso `urls` mantenendo il testo dell'ancora"""
+    urls = set(urls)
+    for text, url, start, end in reversed(extract_markdown_links(markdown)):
+        if url in urls:
+            markdown = markdown[:start] + text + markdown[end:]
+    return markdown
+
+def repair_links(markdown, invalid_internal, broken_external, brand_info, sitemap_urls, openai_client, **llm_options):
+    """Rimanda al modello solo i paragrafi con link non validi e li sostituisce nel testo.
+
+    Ogni paragrafo riceve i link interni validi più pertinenti; i link ancora
+    non validi dopo la correzione (o senza client) vengono rimossi lasciando il
+    testo. Restituisce (markdown, paragrafi corretti dal modello).
+    """
+    bad = set(invalid_internal) | set(broken_external)
+    paragraphs = [
+        p for p in dict.fromkeys(re.split(r'\n\s*\n', markdown))
+        if any(url in bad for _, url, _, _ in extract_markdown_links(p))
+    ]
+    llm_options = dict(llm_options, on_token=None, metrics=None)
+
+    def repair(paragraph):
+        problems = '\n'.join(
+            f"- {url}: " + ("URL interno inesistente nella sitemap" if url in invalid_internal else "link esterno non raggiungibile")
+            for url in dict.fromkeys(url for _, url, _, _ in extract_markdown_links(paragraph)) if url in bad
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Errore nell'analisi E-E-A-T: {str(e)}"
+        prompt = f"""
+        Correggi i link nel seguente estratto di un contenuto del brand "{brand_info['nome']}".
 
-def generate_optimization_suggestions(content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, openai_client):
-    """Genera suggerimenti di ottimizzazione basati sull'analisi E-E-A-T"""
-    
-    prompt = f"""
-    Basandoti sull'analisi E-E-A-T precedente, genera suggerimenti specifici per ottimizzare il contenuto:
+        ESTRATTO:
+        {paragraph}
 
-    CONTENUTO ATTUALE:
-    {content}
+        LINK DA CORREGGERE:
+        {problems}
 
-    BRAND INFO:
-    - Nome: {brand_info['nome']}
-    - URL: {brand_info['url']}
-    - Tone of Voice: {brand_info['tone_of_voice']}
+        URL INTERNI VALIDI (usa solo questi):
+        {format_internal_links(select_internal_links(sitemap_urls, paragraph, k=5))}
 
-    ANALISI E-E-A-T PRECEDENTE:
-    {eeat_analysis}
+        ISTRUZIONI:
+        - Sostituisci ogni link da correggere con l'URL interno valido più pertinente, oppure rimuovi il link mantenendo il testo
+        - Non modificare nient'altro dell'estratto
+        - Restituisci SOLO l'estratto corretto, senza commenti
+        """
+        try:
+            fixed = call_routed(openai_client, prompt, 'link_repair', **llm_options).strip()
+        except Exception as e:
+            logger.warning("Correzione dei link non riuscita: %s", e)
+            return None
+        # Una risposta che aggiunge titoli o stravolge la lunghezza non è una correzione del solo estratto
+        if not fixed or len(fixed) > 2 * len(paragraph) + 200 or \
+                (any(SECTION_HEADING.match(line) for line in fixed.splitlines()) and not SECTION_HEADING.match(paragraph)):
+            return None
+        return fixed
 
-    ANALISI COMPETITOR:
-    {competitor_analysis}
+    repaired = {}
+    if openai_client is not None and paragraphs:
+        with ThreadPoolExecutor(max_workers=LINK_REPAIR_WORKERS) as executor:
+            repaired = {p: fixed for p, fixed in zip(paragraphs, executor.map(repair, paragraphs)) if fixed}
+    for paragraph, fixed in repaired.items():
+        markdown = markdown.replace(paragraph, fixed, 1)
+    # Quello che il modello non ha sistemato (o ha introdotto) si risolve togliendo il link
+    remaining = validate_links('\n\n'.join(repaired.values()), sitemap_urls, brand_info['url'], check_external=False)
+    return unlink(markdown, bad | set(remaining['invalid_internal'])), len(repaired)
+
+def validate_optimized_content(result, brand_info, sitemap_urls, openai_client=None, check_external=True,
+                               link_statuses=None, **llm_options):
+    """Validazione locale del contenuto ottimizzato: titoli in sentence case e link verificati.
+
+    I titoli si correggono senza chiamate al modello; per i link non validi
+    tornano al modello solo i paragrafi coinvolti (repair_links). Il resoconto
+    finisce in `metrics['validation']` quando è passato `metrics`;
+    `link_statuses` sono gli esiti già noti dei link esterni (validate_links).
+    """
+    started = time.perf_counter()
+    structured = isinstance(result, OptimizedContentResult)
+    markdown, headings = fix_heading_case(as_markdown(result), brand_info['nome'])
+    report = validate_links(markdown, sitemap_urls, brand_info['url'], check_external, link_statuses)
+    repaired = 0
+    if report['invalid_internal'] or report['broken_external']:
+        markdown, repaired = repair_links(
+            markdown, report['invalid_internal'], report['broken_external'], brand_info, sitemap_urls, openai_client,
+            **llm_options
+        )
+    report.update(headings_fixed=headings, repaired_paragraphs=repaired, elapsed_ms=(time.perf_counter() - started) * 1000)
+    if llm_options.get('metrics') is not None:
+        llm_options['metrics']['validation'] = report
+    if not structured:
+        return markdown
+    return replace(
+        result,
+        title=fix_title_case(result.title, case_exceptions(markdown, brand_info['nome'])),
+        content=markdown,
+        internal_links_used=[url for url in result.internal_links_used if url in markdown],
+    )
+
+def run_stage_graph(stages, max_workers=4, on_stage_done=None, cancel_event=None, on_poll=None, poll_interval=0.25):
+    """Esegue le fasi della pipeline appena i loro input sono pronti.
+
+    `stages` mappa il nome della fase a una tupla (funzione, dipendenze): la
+    funzione riceve come argomenti keyword i risultati delle dipendenze.
+    Restituisce (risultati, tempi, errori); per ogni fase i tempi riportano
+    l'attesa tra la disponibilità degli input e l'avvio, e la durata
+    dell'esecuzione. Le fasi che dipendono da una fase fallita vengono saltate.
+
+    `on_poll` viene invocato dal thread chiamante ogni `poll_interval` secondi:
+    in Streamlit è lì che arriva l'interruzione dello script (es. click su
+    "Interrompi"), che imposta `cancel_event` per fermare le fasi in corso.
+    """
+    script_ctx = get_script_run_ctx() if get_script_run_ctx else None
+    results, timings, errors = {}, {}, {}
+    finished_at = {}
+    pending = dict(stages)
+    running = {}
+    t0 = time.monotonic()
+
+    def run(name, func, kwargs):
+        started = time.monotonic()
+        try:
+            return started, func(**kwargs), None
+        except Exception as e:
+            return started, None, e
+        finally:
+            timings[name]['run'] = time.monotonic() - started
 
-    URL INTERNI DISPONIBILI (primi 20):
-    {sitemap_urls[:20]}
+    executor = ThreadPoolExecutor(max_workers=max_workers, initializer=(
+        (lambda: add_script_run_ctx(threading.current_thread(), script_ctx)) if script_ctx else None
+    ))
+    completed = False
+    try:
+        while pending or running:
+            for name in list(pending):
+                func, deps = pending[name]
+                if any(dep in errors for dep in deps):
+                    errors[name] = RuntimeError(f"fase saltata: dipendenza fallita ({', '.join(d for d in deps if d in errors)})")
+                    timings[name] = {'wait': 0.0, 'run': 0.0, 'status': 'saltata'}
+                    del pending[name]
+                elif all(dep in results for dep in deps):
+                    ready = max([finished_at[dep] for dep in deps], default=t0)
+                    timings[name] = {'ready': ready}
+                    future = executor.submit(run, name, func, {dep: results[dep] for dep in deps})
+                    running[future] = name
+                    del pending[name]
+            if not running:
+                if pending:
+                    raise ValueError(f"dipendenze non risolvibili: {', '.join(pending)}")
+                break
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            if on_poll:
+                on_poll()
+            for future in done:
+                name = running.pop(future)
+                started, result, error = future.result()
+                finished_at[name] = time.monotonic()
+                timing = timings[name]
+                timing['wait'] = started - timing.pop('ready')
+                if error is None:
+                    results[name] = result
+                    timing['status'] = 'ok'
+                else:
+                    errors[name] = error
+                    timing['status'] = 'errore'
+                if on_stage_done:
+                    on_stage_done(name, len(results) + len(errors), len(stages))
+        completed = True
+    finally:
+        if not completed and cancel_event is not None:
+            cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results, timings, errors
 
-    Genera suggerimenti di ottimizzazione strutturati in questo formato:
+PIPELINE_STAGE_LABELS = {
+    'page_content': "📄 Contenuto della pagina",
+    'sitemap_urls': "🗺️ Estrazione URL dalla sitemap",
+    'competitor_analysis': "🏆 Analisi dei competitor",
+    'eeat_analysis': "🔍 Analisi E-E-A-T del contenuto",
+    'optimization_suggestions': "💡 Generazione suggerimenti di ottimizzazione",
+    'optimized_content': "✨ Creazione contenuto ottimizzato finale",
+}
+LLM_STAGES = ('eeat_analysis', 'optimization_suggestions', 'optimized_content')
 
-    ## STRATEGIA DI OTTIMIZZAZIONE E-E-A-T
+def build_pipeline_stages(brand_info, sitemap_input, competitor_urls, competitor_content_manual, openai_client,
+                          stage_llm_options, content=None, page_url=None, eeat_kwargs=None, digest_metrics=None):
+    """Grafo delle fasi della pipeline per run_stage_graph.
+
+    Il contenuto da ottimizzare è `content` oppure, per i job accodati per
+    URL, la pagina scaricata da `page_url`. L'analisi E-E-A-T parte appena il
+    contenuto è pronto, in parallelo con sitemap e competitor; i testi dei
+    competitor arrivano ai prompt come digest deduplicato (statistiche in
+    `digest_metrics`).
+    """
+    def page_content():
+        if content:
+            return content
+        text = scrape_website_content(page_url)
+        if text.startswith("Errore nel caricamento del contenuto"):
+            raise RuntimeError(text)
+        return text
 
-    ### 1. MIGLIORAMENTI EXPERIENCE
-    - [Suggerimento specifico 1 con esempio pratico]
-    - [Suggerimento specifico 2 con esempio pratico]
-    - [Suggerimento specifico 3 con esempio pratico]
+    def competitor_analysis():
+        # Download concorrente con limiti per host al posto di una pausa globale
+        competitor_contents = scrape_competitors(competitor_urls)
+        sources = [
+            (f"COMPETITOR {i+1} ({url})", competitor_content)
+            for i, (url, competitor_content) in enumerate(zip(competitor_urls, competitor_contents))
+        ]
+        if competitor_content_manual:
+            sources.insert(0, ("Contenuto competitor fornito manualmente", competitor_content_manual))
+        return build_competitor_digest(sources, metrics=digest_metrics)
 
-    ### 2. MIGLIORAMENTI EXPERTISE
-    - [Suggerimento specifico 1 per dimostrare competenza]
-    - [Suggerimento specifico 2 per dimostrare competenza]
-    - [Suggerimento specifico 3 per dimostrare competenza]
+    return {
+        'page_content': (page_content, []),
+        'sitemap_urls': (lambda: extract_sitemap_urls(sitemap_input) if sitemap_input else [], []),
+        'competitor_analysis': (competitor_analysis, []),
+        'eeat_analysis': (
+            lambda page_content: analyze_eeat_content(
+                page_content, brand_info, openai_client, **(eeat_kwargs or {}), **stage_llm_options['eeat_analysis']
+            ),
+            ['page_content']
+        ),
+        'optimization_suggestions': (
+            lambda page_content, sitemap_urls, competitor_analysis, eeat_analysis: generate_optimization_suggestions(
+                page_content,
+                brand_info,
+                competitor_analysis,
+                sitemap_urls,
+                eeat_analysis,
+                openai_client,
+                **stage_llm_options['optimization_suggestions']
+            ),
+            ['page_content', 'sitemap_urls', 'competitor_analysis', 'eeat_analysis']
+        ),
+        'optimized_content': (
+            lambda page_content, sitemap_urls, competitor_analysis, eeat_analysis, optimization_suggestions: (
+                generate_optimized_content(
+                    page_content,
+                    brand_info,
+                    competitor_analysis,
+                    sitemap_urls,
+                    eeat_analysis,
+                    optimization_suggestions,
+                    openai_client,
+                    **stage_llm_options['optimized_content']
+                )
+            ),
+            ['page_content', 'sitemap_urls', 'competitor_analysis', 'eeat_analysis', 'optimization_suggestions']
+        ),
+    }
 
-    ### 3. MIGLIORAMENTI AUTHORITATIVENESS
-    - [Suggerimento specifico 1 per aumentare autorevolezza]
-    - [Suggerimento specifico 2 per aumentare autorevolezza]
-    - [Suggerimento specifico 3 per aumentare autorevolezza]
+STRUCTURED_RESULT_TYPES = {cls.__name__: cls for cls in (EEATAnalysisResult, OptimizationPlan, OptimizedContentResult)}
 
-    ### 4. MIGLIORAMENTI TRUSTWORTHINESS
-    - [Suggerimento specifico 1 per aumentare affidabilità]
-    - [Suggerimento specifico 2 per aumentare affidabilità]
-    - [Suggerimento specifico 3 per aumentare affidabilità]
+def encode_stage_output(value):
+    """Serializza in JSON il risultato di una fase (testo, lista di URL o risultato strutturato)"""
+    if is_dataclass(value):
+        return json.dumps({'type': type(value).__name__, 'value': asdict(value)}, ensure_ascii=False)
+    return json.dumps({'type': None, 'value': value}, ensure_ascii=False)
 
-    ## LINK INTERNI CONSIGLIATI
-    [Suggerisci 5-8 URL interni dalla sitemap che sarebbero rilevanti per questo contenuto]
+def decode_stage_output(text):
+    data = json.loads(text)
+    cls = STRUCTURED_RESULT_TYPES.get(data['type'])
+    return cls(**data['value']) if cls else data['value']
 
-    ## STRUTTURA CONTENUTO OTTIMIZZATA
-    [Suggerisci una struttura migliorata per il contenuto con H2, H3, etc.]
+JOB_STATUS_LABELS = {
+    'in_coda': "⏳ In coda",
+    'in_esecuzione': "⚙️ In esecuzione",
+    'completato': "✅ Completato",
+    'errore': "❌ Errore",
+    'annullato': "⏹️ Annullato",
+}
 
-    ## CONTENUTI AGGIUNTIVI DA INCLUDERE
-    [Suggerisci paragrafi, sezioni o elementi specifici da aggiungere]
+# Ogni worker aggiorna heartbeat_at dei suoi job: oltre il timeout il processo è considerato fermo
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_HEARTBEAT_TIMEOUT = 60
 
-    ## CALL-TO-ACTION E CONVERSIONI
-    [Suggerisci CTA ottimizzate per questo contenuto]
+class JobQueue:
+    """Coda persistente su SQLite delle esecuzioni della pipeline e dei risultati di ogni fase.
 
-    Mantieni il tone of voice "{brand_info['tone_of_voice']}" in tutti i suggerimenti.
+    I job sopravvivono ai rerun dello script e ai riavvii: ogni fase viene
+    salvata appena termina e, se un job riparte dopo un'interruzione, le
+    fasi già completate non vengono ripetute. `owner` è l'impronta della API
+    key con cui il job è stato accodato; `worker` (host:pid) e `heartbeat_at`
+    indicano chi lo sta eseguendo, così più processi possono condividere la coda.
     """
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=2500,
-            temperature=0.4
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Errore nella generazione dei suggerimenti: {str(e)}"
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT NOT NULL, label TEXT NOT NULL, '
+                'payload TEXT NOT NULL, status TEXT NOT NULL, error TEXT, metrics TEXT, '
+                'created_at REAL NOT NULL, started_at REAL, finished_at REAL, worker TEXT, heartbeat_at REAL)'
+            )
+            # Archivi creati prima dell'heartbeat
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in (('worker', 'TEXT'), ('heartbeat_at', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_owner_status ON jobs (owner, status, id)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS job_stages ('
+                'job_id INTEGER NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL, output TEXT, '
+                'duration REAL NOT NULL, PRIMARY KEY (job_id, stage))'
+            )
 
-def generate_optimized_content(original_content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, optimization_suggestions, openai_client):
-    """Genera il contenuto completamente ottimizzato pronto per la pubblicazione"""
-    
-    prompt = f"""
-    Ora devi creare la versione FINALE e OTTIMIZZATA del contenuto, pronto per essere pubblicato.
-    Applica TUTTI i suggerimenti di ottimizzazione E-E-A-T per creare un contenuto di qualità superiore.
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
 
-    CONTENUTO ORIGINALE:
-    {original_content}
+    def submit(self, owner, label, payload):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (owner, label, payload, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                (owner, label, json.dumps(payload, ensure_ascii=False), 'in_coda', time.time())
+            )
+            return cursor.lastrowid
 
-    BRAND INFO:
-    - Nome: {brand_info['nome']}
-    - URL: {brand_info['url']}
-    - Tone of Voice: {brand_info['tone_of_voice']}
-    - Chi Siamo: {brand_info['chi_siamo']}
+    def claim(self, owners, worker=None):
+        """Prende in carico il job in coda più vecchio tra quelli dei proprietari indicati"""
+        if not owners:
+            return None
+        placeholders = ', '.join('?' for _ in owners)
+        with self._lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                f"SELECT id FROM jobs WHERE status = 'in_coda' AND owner IN ({placeholders}) ORDER BY id LIMIT 1",
+                list(owners)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'in_esecuzione', started_at = ?, worker = ?, heartbeat_at = ? WHERE id = ?",
+                (now, worker, now, row[0])
+            )
+        return self.get(row[0])
 
-    ANALISI E-E-A-T:
-    {eeat_analysis}
+    def heartbeat(self, job_ids):
+        """Segnala che i job indicati sono ancora in esecuzione"""
+        if not job_ids:
+            return
+        job_ids = list(job_ids)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE status = 'in_esecuzione' AND id IN ({', '.join('?' for _ in job_ids)})",
+                [time.time()] + job_ids
+            )
 
-    SUGGERIMENTI DI OTTIMIZZAZIONE:
-    {optimization_suggestions}
+    def requeue_interrupted(self, timeout=JOB_HEARTBEAT_TIMEOUT):
+        """Rimette in coda i job in esecuzione il cui worker non dà segni di vita da più di `timeout` secondi.
 
-    COMPETITOR INSIGHTS:
-    {competitor_analysis}
+        I job di altri processi ancora attivi hanno un heartbeat recente e non vengono toccati.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'in_coda', worker = NULL WHERE status = 'in_esecuzione' "
+                "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (time.time() - timeout,)
+            )
+            return cursor.rowcount
 
-    URL INTERNI DISPONIBILI:
-    {sitemap_urls[:15]}
-
-    ISTRUZIONI PER IL CONTENUTO OTTIMIZZATO:
-
-    1. **EXPERIENCE**: Integra esempi concreti, casi studio, dati specifici, esperienze pratiche
-    2. **EXPERTISE**: Dimostra competenza tecnica, usa terminologia appropriata, includi insight originali
-    3. **AUTHORITATIVENESS**: Cita fonti autorevoli, riferimenti a studi, link a risorse credibili
-    4. **TRUSTWORTHINESS**: Mantieni trasparenza, obiettività, includi disclaimers quando necessario
-
-    STRUTTURA IL CONTENUTO CON:
-    - Titolo principale ottimizzato SEO
-    - Introduzione coinvolgente
-    - Sottotitoli H2, H3 ben strutturati
-    - Paragrafi con esempi pratici e dati
-    - Citazioni e riferimenti autorevoli
-    - Link interni rilevanti integrati naturalmente
-    - Call-to-action efficaci
-    - Conclusione che sintetizza e invita all'azione
-
-    MANTIENI:
-    - Tone of voice: {brand_info['tone_of_voice']}
-    - Lunghezza minima: 1500-2000 parole
-    - Formattazione markdown per web
-    - SEO-friendly ma naturale
-    - TITOLI: usa solo la prima lettera maiuscola (es: "Contattaci per scoprire le nostre soluzioni" NON "Contattaci per Scoprire le Nostre Soluzioni")
-
-    Crea un contenuto che sia:
-    ✅ Pronto per la pubblicazione
-    ✅ Ottimizzato per E-E-A-T
-    ✅ SEO-friendly
-    ✅ Coinvolgente per l'utente
-    ✅ Allineato al brand
-    ✅ Con titoli in formato corretto (solo prima lettera maiuscola)
-
-    GENERA IL CONTENUTO OTTIMIZZATO COMPLETO:
+    def save_stage(self, job_id, stage, status, output=None, duration=0.0):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO job_stages (job_id, stage, status, output, duration) VALUES (?, ?, ?, ?, ?)',
+                (job_id, stage, status, encode_stage_output(output) if status == 'ok' else output, duration)
+            )
+
+    def finish(self, job_id, status, error=None, metrics=None):
+        with self._connect() as conn:
+            # Un job annullato resta annullato anche se le fasi in corso terminano dopo
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, metrics = ?, finished_at = ? WHERE id = ? AND status != 'annullato'",
+                (status, error, json.dumps(metrics) if metrics else None, time.time(), job_id)
+            )
+
+    def cancel(self, job_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'annullato', finished_at = ? WHERE id = ? AND status IN ('in_coda', 'in_esecuzione')",
+                (time.time(), job_id)
+            )
+
+    def delete_finished(self, owner):
+        with self._connect() as conn:
+            finished = "SELECT id FROM jobs WHERE owner = ? AND status IN ('completato', 'errore', 'annullato')"
+            conn.execute(f'DELETE FROM job_stages WHERE job_id IN ({finished})', (owner,))
+            conn.execute(f'DELETE FROM jobs WHERE id IN ({finished})', (owner,))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id, owner, label, payload, status, error, metrics, created_at, started_at, finished_at '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            stages = conn.execute(
+                'SELECT stage, status, output, duration FROM job_stages WHERE job_id = ?', (job_id,)
+            ).fetchall()
+        job = self._row_to_job(row)
+        job['stages'] = {
+            stage: {
+                'status': status,
+                'output': decode_stage_output(output) if status == 'ok' else output,
+                'duration': duration,
+            }
+            for stage, status, output, duration in stages
+        }
+        return job
+
+    def list(self, owner, limit=50):
+        """Job più recenti del proprietario, con il numero di fasi completate"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT id, owner, label, payload, status, error, metrics, created_at, started_at, finished_at '
+                'FROM jobs WHERE owner = ? ORDER BY id DESC LIMIT ?', (owner, limit)
+            ).fetchall()
+            done = dict(conn.execute(
+                "SELECT job_id, COUNT(*) FROM job_stages WHERE status = 'ok' AND job_id IN "
+                "(SELECT id FROM jobs WHERE owner = ? ORDER BY id DESC LIMIT ?) GROUP BY job_id", (owner, limit)
+            ).fetchall())
+        jobs = []
+        for row in rows:
+            job = self._row_to_job(row)
+            job['completed_stages'] = done.get(job['id'], 0)
+            jobs.append(job)
+        return jobs
+
+    @staticmethod
+    def _row_to_job(row):
+        keys = ('id', 'owner', 'label', 'payload', 'status', 'error', 'metrics', 'created_at', 'started_at', 'finished_at')
+        job = dict(zip(keys, row))
+        job['payload'] = json.loads(job['payload'])
+        job['metrics'] = json.loads(job['metrics']) if job['metrics'] else None
+        return job
+
+def run_pipeline_job(job, openai_client, queue, tracer, cancel_event=None):
+    """Esegue un job della coda salvando ogni fase appena termina e riusando quelle già salvate"""
+    payload = job['payload']
+    llm_options = {
+        'use_cache': payload.get('use_cache', True),
+        'structured': payload.get('structured', False),
+        'tracker': tracer,
+        'cancel_event': cancel_event,
+    }
+    stages = build_pipeline_stages(
+        payload['brand_info'], payload.get('sitemap_input'), payload.get('competitor_urls', []),
+        payload.get('competitor_content_manual'), openai_client, {name: llm_options for name in LLM_STAGES},
+        content=payload.get('content'), page_url=payload.get('page_url')
+    )
+
+    def persisted(name, func):
+        def run(**inputs):
+            if cancel_event is not None and cancel_event.is_set():
+                raise LLMError("job annullato")
+            started = time.monotonic()
+            output = func(**inputs)
+            queue.save_stage(job['id'], name, 'ok', output, time.monotonic() - started)
+            return output
+        return run
+
+    saved = job.get('stages', {})
+    for name, (func, deps) in list(stages.items()):
+        if saved.get(name, {}).get('status') == 'ok':
+            stages[name] = ((lambda value=saved[name]['output'], **_: value), deps)
+        else:
+            stages[name] = (persisted(name, func), deps)
+
+    results, timings, errors = run_stage_graph(stages, cancel_event=cancel_event)
+    for name, timing in timings.items():
+        tracer.record_stage(name, run=timing['run'], wait=timing['wait'], status=timing['status'])
+        if name in errors:
+            queue.save_stage(job['id'], name, timing['status'], str(errors[name]), timing['run'])
+    return results, errors
+
+class JobRunner:
+    """Pool di worker in background che esegue i job della coda fuori dal thread dello script Streamlit.
+
+    I worker prendono solo job di cui conoscono il client OpenAI (registrato
+    dalla sessione con `register_client`): la API key non viene mai salvata
+    nella coda. Un thread aggiorna l'heartbeat dei job in corso e rimette in
+    coda quelli di processi fermati: ripartono appena l'utente reinserisce la chiave.
     """
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=4000,
-            temperature=0.5
+    def __init__(self, queue, workers=2, poll_interval=1.0, heartbeat_interval=JOB_HEARTBEAT_INTERVAL):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._cancel_events = {}
+        self._wakeup = threading.Event()
+        queue.requeue_interrupted()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+
+    def register_client(self, owner, openai_client):
+        with self._lock:
+            self._clients[owner] = openai_client
+        self._wakeup.set()
+
+    def submit(self, owner, label, payload):
+        job_id = self.queue.submit(owner, label, payload)
+        self._wakeup.set()
+        return job_id
+
+    def cancel(self, job_id):
+        self.queue.cancel(job_id)
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                with self._lock:
+                    running = list(self._cancel_events)
+                self.queue.heartbeat(running)
+                if self.queue.requeue_interrupted():
+                    self._wakeup.set()
+            except Exception:
+                logger.exception("heartbeat dei job non riuscito")
+
+    def _work(self):
+        while True:
+            with self._lock:
+                owners = list(self._clients)
+            job = self.queue.claim(owners, self.worker_id)
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        cancel_event = threading.Event()
+        with self._lock:
+            self._cancel_events[job['id']] = cancel_event
+            openai_client = self._clients[job['owner']]
+        tracer = PipelineTracer()
+        try:
+            _, errors = run_pipeline_job(job, openai_client, self.queue, tracer, cancel_event)
+            if errors:
+                # Il primo errore è quello della fase fallita, gli altri sono le fasi saltate
+                self.queue.finish(job['id'], 'errore', str(next(iter(errors.values()))), tracer.to_dict())
+            else:
+                self.queue.finish(job['id'], 'completato', metrics=tracer.to_dict())
+        except Exception as e:
+            logger.exception("job %s non riuscito", job['id'])
+            self.queue.finish(job['id'], 'errore', str(e), tracer.to_dict())
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job['id'], None)
+
+@st.cache_resource
+def get_job_runner():
+    """Coda e worker condivisi da tutte le sessioni del processo Streamlit"""
+    queue = JobQueue(os.path.join(CACHE_DIR, 'jobs.sqlite'))
+    return JobRunner(queue, workers=int(os.environ.get('SEO_OPTIMIZER_JOB_WORKERS', 2)))
+
+def render_pipeline_metrics(tracer, stage_labels, stream_metrics):
+    """Mostra in un pannello a scomparsa tempi, token e costi della pipeline, con export JSON e Prometheus"""
+    totals = tracer.to_dict()['totals']
+    with st.expander(f"📊 Metriche della pipeline · {totals['prompt_tokens'] + totals['completion_tokens']} token · ${totals['cost_usd']:.4f}"):
+        stage_rows = []
+        for name, timing in tracer.stages.items():
+            row = {
+                'Fase': stage_labels.get(name, name),
+                'Attesa (s)': round(timing['wait'], 2),
+                'Esecuzione (s)': round(timing['run'], 2),
+                'Stato': timing['status'],
+                'Note': '',
+            }
+            metrics = stream_metrics.get(name, {})
+            if metrics.get('cached'):
+                row['Note'] = "da cache"
+            elif metrics.get('ttft') is not None:
+                row['Note'] = f"primo token dopo {metrics['ttft']:.2f}s"
+                if metrics.get('tokens_per_sec'):
+                    row['Note'] += f", {metrics['tokens_per_sec']:.1f} token/s"
+            stage_rows.append(row)
+        st.dataframe(stage_rows, use_container_width=True)
+
+        st.dataframe([
+            {
+                'Fase': stage_labels.get(call['stage'], call['stage']),
+                'Modello': call['model'],
+                'Token input': call['prompt_tokens'],
+                'Token output': call['completion_tokens'],
+                'Token input in cache': call['cached_prompt_tokens'],
+                'Tentativi ripetuti': call['retries'],
+                'Durata (s)': round(call['duration'], 2),
+                'Costo ($)': round(call['cost'], 5),
+                'Cache': '✅' if call['cached'] else '',
+                'Errore': call['error'] or '',
+            }
+            for call in tracer.llm_calls
+        ], use_container_width=True)
+        if totals['saved_prompt_tokens']:
+            st.caption(f"✂️ Token di input risparmiati dalla compattazione dei prompt: {totals['saved_prompt_tokens']}")
+        routes = tracer.route_stats()
+        if len(routes) > 1 or tracer.route_events:
+            st.markdown("**🧭 Latenza e costo per rotta**")
+            st.dataframe([
+                {
+                    'Fase': stage_labels.get(route['stage'], route['stage']),
+                    'Modello': route['model'],
+                    'Chiamate': route['calls'],
+                    'Latenza p50 (s)': route['p50_s'],
+                    'Latenza max (s)': route['max_s'],
+                    'Costo ($)': route['cost_usd'],
+                    'Costo per chiamata ($)': route['cost_per_call_usd'],
+                    'Cascate': route['escalations'],
+                    'Fallback': route['fallbacks'],
+                }
+                for route in routes
+            ], use_container_width=True)
+        if totals['cached_prompt_tokens']:
+            st.caption(f"🧠 Cache del prefisso di OpenAI: {totals['prefix_cache_hit_ratio']:.0%} dei token di input")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("⬇️ Esporta JSON", tracer.to_json(), file_name="metriche_pipeline.json", mime="application/json")
+        with col2:
+            st.download_button("⬇️ Esporta Prometheus", tracer.to_prometheus(), file_name="metriche_pipeline.prom", mime="text/plain")
+
+def render_validation_report(report):
+    """Esito della validazione locale del contenuto ottimizzato (titoli e link)"""
+    if not report:
+        return
+    st.caption(
+        f"🔎 Validazione: {report['internal_links']} link interni, {report['external_links']} esterni, "
+        f"{len(report['headings_fixed'])} titoli corretti in {report['elapsed_ms']:.0f} ms"
+    )
+    problems = report['invalid_internal'] + report['broken_external']
+    if problems:
+        st.warning(
+            f"🔗 {len(report['invalid_internal'])} link interni inesistenti e {len(report['broken_external'])} link esterni "
+            f"non raggiungibili: {report['repaired_paragraphs']} paragrafi corretti dal modello, gli altri link rimossi"
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Errore nella generazione del contenuto ottimizzato: {str(e)}"
+    if report.get('unverified_external'):
+        st.caption(
+            f"⏳ {len(report['unverified_external'])} link esterni non verificabili (timeout, blocchi anti-bot, "
+            "errori di rete): lasciati nel testo, da controllare a mano"
+        )
+    if report['headings_fixed'] or problems:
+        with st.expander("🛠️ Correzioni applicate"):
+            for before, after in report['headings_fixed']:
+                st.write(f"• {before} → {after}")
+            for url in problems:
+                st.write(f"• 🔗 {url}")
+
+def render_variant_generation(inputs, openai_client, use_cache):
+    """Varianti del contenuto finale affiancate, generate riusando analisi e suggerimenti dell'ultima esecuzione"""
+    st.markdown('<h2 class="section-header">🎲 Varianti del Contenuto Ottimizzato</h2>', unsafe_allow_html=True)
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        n = st.number_input("Numero di varianti", min_value=2, max_value=MAX_VARIANTS, value=3, step=1)
+    with col2:
+        st.caption(
+            "Una sola richiesta al modello con analisi e suggerimenti già calcolati: niente scraping né nuove analisi. "
+            "Le varianti sono ordinate localmente per segnali E-E-A-T, link interni e lunghezza."
+        )
+        clicked = st.button("🎲 Genera varianti", use_container_width=True)
+    if not clicked:
+        return
+
+    tracer = PipelineTracer()
+    with st.spinner(f"Generazione di {n} varianti in corso..."):
+        try:
+            ranked = generate_optimized_variants(
+                openai_client=openai_client, n=int(n), use_cache=use_cache, tracker=tracer, **inputs
+            )
+        except Exception as e:
+            st.error(f"❌ Errore nella generazione delle varianti: {str(e)}")
+            return
+    if len(ranked) < n:
+        st.info(f"ℹ️ {len(ranked)} varianti disponibili su {n} richieste (i documenti lunghi ne producono una sola)")
+    render_pipeline_metrics(tracer, PIPELINE_STAGE_LABELS, {})
+
+    for rank, (col, entry) in enumerate(zip(st.columns(len(ranked)), ranked), start=1):
+        with col:
+            st.markdown(f"**{'🏆 ' if rank == 1 else ''}Variante {rank}** · punteggio {entry['score']:.2f}")
+            st.caption(
+                f"E-E-A-T {entry['eeat_score']:.2f} · link interni {entry['internal_links']} · {entry['words']} parole"
+            )
+            if isinstance(entry['content'], OptimizedContentResult):
+                st.markdown(f"**🏷️ Title:** {entry['content'].title}")
+            with st.container(height=600):
+                st.markdown(as_markdown(entry['content']))
+            with st.expander("📋 Markdown"):
+                st.code(as_markdown(entry['content']), language="markdown")
+
+def render_incremental_optimization(content, brand_info, sitemap_input, openai_client, use_cache):
+    """Ottimizzazione per sezioni: riusa i risultati della sessione per le sezioni non modificate"""
+    tracer = PipelineTracer()
+    with st.spinner("♻️ Ottimizzazione delle sezioni modificate..."):
+        with tracer.stage('sitemap_urls'):
+            sitemap_urls = extract_sitemap_urls(sitemap_input) if sitemap_input else []
+        with tracer.stage('sections'):
+            outcome = optimize_sections(
+                content, brand_info, sitemap_urls, openai_client,
+                previous=st.session_state.section_results, use_cache=use_cache, tracker=tracer
+            )
+    st.session_state.section_results = outcome['store']
+
+    total = len(outcome['sections'])
+    st.success(f"♻️ {outcome['reused']} sezioni su {total} riutilizzate, {outcome['regenerated']} rigenerate")
+    for heading, error in outcome['errors'].items():
+        st.error(f"❌ {heading}: {error} (sezione lasciata invariata, verrà ritentata al prossimo avvio)")
+    render_pipeline_metrics(tracer, {
+        'sitemap_urls': "🗺️ Estrazione URL dalla sitemap",
+        'sections': "♻️ Ottimizzazione per sezioni",
+        'section_analysis': "🔍 Analisi E-E-A-T della sezione",
+        'section_rewrite': "✨ Riscrittura della sezione",
+    }, {})
+
+    st.markdown('<h2 class="section-header">🔍 Analisi per Sezione</h2>', unsafe_allow_html=True)
+    for section in outcome['sections']:
+        badge = "♻️ riutilizzata" if section['reused'] else ("❌ non riuscita" if section['failed'] else "✨ rigenerata")
+        with st.expander(f"{section['heading']} · {badge}"):
+            st.markdown(section['analysis'] or "_Nessuna analisi disponibile_")
+
+    st.markdown('<h2 class="section-header">✨ Contenuto Ottimizzato - Pronto per Pubblicazione</h2>', unsafe_allow_html=True)
+    with st.expander("📝 CONTENUTO FINALE OTTIMIZZATO", expanded=True):
+        st.markdown(outcome['content'])
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("📋 Copia Contenuto Ottimizzato", use_container_width=True):
+            st.code(outcome['content'], language="markdown")
+            st.info("💡 Seleziona tutto il testo sopra e copialo (Ctrl+A, Ctrl+C)")
+    with col2:
+        st.metric("📊 Parole Totali", len(outcome['content'].split()))
+
+@st.fragment(run_every=2)
+def render_job_queue(job_runner, owner, limit=10):
+    """Stato dei job in background della API key corrente, aggiornato ogni 2 secondi senza rieseguire la pagina"""
+    jobs = job_runner.queue.list(owner, limit=limit)
+    if not jobs:
+        st.caption("Nessun job in coda")
+        return
+    total_stages = len(PIPELINE_STAGE_LABELS)
+    st.dataframe([
+        {
+            'Job': f"#{job['id']}",
+            'Pagina': job['label'],
+            'Stato': JOB_STATUS_LABELS[job['status']],
+            'Fasi': f"{job['completed_stages']}/{total_stages}",
+        }
+        for job in jobs
+    ], use_container_width=True, hide_index=True)
+
+    for job in jobs:
+        with st.expander(f"#{job['id']} · {job['label']}"):
+            st.progress(job['completed_stages'] / total_stages, text=JOB_STATUS_LABELS[job['status']])
+            if job['error']:
+                st.error(f"❌ {job['error']}")
+            if job['status'] in ('in_coda', 'in_esecuzione'):
+                if st.button("⏹️ Annulla", key=f"cancel_job_{job['id']}"):
+                    job_runner.cancel(job['id'])
+            if job['metrics']:
+                totals = job['metrics']['totals']
+                st.caption(
+                    f"📊 {totals['prompt_tokens'] + totals['completion_tokens']} token · ${totals['cost_usd']:.4f}"
+                )
+            # Risultati parziali: ogni fase è visibile appena salvata
+            stages = job_runner.queue.get(job['id'])['stages']
+            for name in LLM_STAGES:
+                stage = stages.get(name)
+                if stage and stage['status'] == 'ok':
+                    st.markdown(f"**{PIPELINE_STAGE_LABELS[name]}**")
+                    st.markdown(as_markdown(stage['output']))
+            if stages.get('optimized_content', {}).get('status') == 'ok':
+                st.download_button(
+                    "⬇️ Scarica contenuto ottimizzato",
+                    as_markdown(stages['optimized_content']['output']),
+                    file_name=f"contenuto_ottimizzato_{job['id']}.md",
+                    mime="text/markdown",
+                    key=f"download_job_{job['id']}"
+                )
+
+    if st.button("🧹 Rimuovi job conclusi"):
+        job_runner.queue.delete_finished(owner)
+        st.rerun(scope="fragment")
+
+def setup_page():
+    """Configura pagina, CSS e stato della sessione (solo quando eseguito con Streamlit)"""
+    # Configurazione della pagina
+    st.set_page_config(
+        page_title="SEO E-E-A-T Content Optimizer",
+        page_icon="🚀",
+        layout="wide"
+    )
+
+    # CSS personalizzato
+    st.markdown("""
+    <style>
+        .main-header {
+            text-align: center;
+            color: #1f77b4;
+            margin-bottom: 2rem;
+        }
+        .section-header {
+            color: #2e8b57;
+            border-bottom: 2px solid #2e8b57;
+            padding-bottom: 0.5rem;
+            margin: 1.5rem 0 1rem 0;
+        }
+        .info-box {
+            background-color: #262730;
+            padding: 1rem;
+            border-radius: 0.5rem;
+            border-left: 4px solid #1f77b4;
+            margin: 1rem 0;
+        }
+        .warning-box {
+            background-color: #262730;
+            padding: 1rem;
+            border-radius: 0.5rem;
+            border-left: 4px solid #ffc107;
+            margin: 1rem 0;
+        }
+        .success-box {
+            background-color: #262730;
+            padding: 1rem;
+            border-radius: 0.5rem;
+            border-left: 4px solid #28a745;
+            margin: 1rem 0;
+        }
+    </style>
+    """, unsafe_allow_html=True)
+
+    # Inizializzazione dello stato della sessione
+    if 'section_results' not in st.session_state:
+        # Risultati per sezione (hash -> analisi e riscrittura) dell'ultima ottimizzazione incrementale
+        st.session_state.section_results = {}
+    if 'variant_inputs' not in st.session_state:
+        # Ingressi della fase finale dell'ultima analisi completa, per generare varianti senza rifare la pipeline
+        st.session_state.variant_inputs = None
 
 def main():
+    setup_page()
+
     st.markdown('<h1 class="main-header">🚀 SEO E-E-A-T Content Optimizer</h1>', unsafe_allow_html=True)
     
     st.markdown("""
@@ -382,12 +4184,52 @@ def main():
         )
         
         if openai_api_key:
-            if init_openai_client(openai_api_key):
+            openai_client = init_openai_client(openai_api_key)
+            if openai_client is not None:
                 st.success("✅ OpenAI configurato correttamente")
+                # I worker in background eseguono i job di questa chiave con lo stesso client
+                key_digest = api_key_digest(openai_api_key)
+                job_runner = get_job_runner()
+                job_runner.register_client(key_digest, openai_client)
             else:
                 st.error("❌ Errore nella configurazione OpenAI")
                 return
 
+        st.subheader("🗄️ Cache risposte AI")
+        use_cache = st.checkbox(
+            "Usa cache risposte AI",
+            value=True,
+            help="Riutilizza le risposte già ottenute per prompt identici, anche dopo un riavvio dell'app"
+        )
+        llm_cache_stats = get_llm_cache().stats()
+        st.caption(
+            f"Hit: {llm_cache_stats['hits']} · Miss: {llm_cache_stats['misses']} · "
+            f"Voci: {llm_cache_stats['entries']} ({llm_cache_stats['bytes'] / 1024:.0f} KB)"
+        )
+        http_cache_stats = get_http_cache().stats()
+        st.caption(
+            f"Cache HTTP: hit rate {http_cache_stats['hit_rate']:.0%} · "
+            f"{http_cache_stats['bytes_saved'] / 1024:.0f} KB non riscaricati"
+        )
+        limiter_stats = get_rate_limiter().stats()
+        st.caption(
+            f"Limiti API: {limiter_stats['rpm']} richieste/min · {limiter_stats['tpm']} token/min · "
+            f"{limiter_stats['throttled']} chiamate rallentate ({limiter_stats['wait_seconds']:.0f}s)"
+        )
+        if st.button("🧹 Svuota cache"):
+            get_llm_cache().clear()
+            get_http_cache().clear()
+            st.success("✅ Cache svuotata")
+
+        with st.expander("🧭 Modelli per fase"):
+            # Configurabili con un file JSON indicato in SEO_OPTIMIZER_MODEL_ROUTES
+            for stage, route in get_model_routes().items():
+                extra = ''.join([
+                    f" → {route.cascade} se la qualità non basta" if route.cascade else '',
+                    f" · fallback {route.fallback}" if route.fallback else '',
+                ])
+                st.caption(f"**{stage}**: {route.model} (t={route.temperature}, max {route.max_tokens} token){extra}")
+
     if not openai_api_key:
         st.warning("⚠️ Inserisci la tua OpenAI API Key nella sidebar per continuare")
         return
@@ -442,13 +4284,40 @@ def main():
             placeholder="Incolla qui il contenuto del tuo file sitemap.xml..."
         )
 
+    # I titoli delle pagine scansionate rendono più pertinenti i link interni suggeriti
+    page_store_stats = get_page_store().stats()
+    st.caption(
+        f"🕷️ Pagine del sito in archivio: {page_store_stats['pages']} "
+        f"({page_store_stats['errors']} non scaricabili, {page_store_stats['bytes'] / 1024:.0f} KB)"
+    )
+    if st.button("🕷️ Scansiona le pagine della sitemap", disabled=not sitemap_input,
+                 help="Scarica titolo, H1 e meta description delle pagine nuove o modificate (lastmod) rispettando robots.txt"):
+        crawl_status = st.empty()
+        crawl_stats = crawl_site(
+            sitemap_input,
+            on_progress=lambda stats: crawl_status.text(
+                f"🕷️ {stats['seen']} URL letti · {stats['fetched']} pagine scaricate · "
+                f"{stats['unchanged']} invariate · {stats['elapsed']:.0f}s"
+            )
+        )
+        crawl_status.empty()
+        for error in crawl_stats['sitemap_errors']:
+            st.error(f"Errore nell'estrazione della sitemap: {error}")
+        st.success(
+            f"✅ Scansione completata in {crawl_stats['elapsed']:.1f}s: {crawl_stats['fetched']} pagine aggiornate, "
+            f"{crawl_stats['unchanged']} invariate, {crawl_stats['blocked']} bloccate da robots.txt, "
+            f"{crawl_stats['errors']} errori"
+        )
+
     # Sezione 4: Competitor
     st.markdown('<h2 class="section-header">🏆 Analisi Competitor</h2>', unsafe_allow_html=True)
     
-    st.info("Inserisci 3 URL di competitor ben posizionati per analizzare i loro contenuti")
+    st.info("Inserisci gli URL dei competitor ben posizionati (fino all'intera top-10 della SERP) per analizzare i loro contenuti")
+    
+    num_competitors = st.number_input("Numero di competitor", min_value=1, max_value=10, value=3, step=1)
     
     competitor_urls = []
-    for i in range(3):
+    for i in range(int(num_competitors)):
         url = st.text_input(f"URL Competitor {i+1}", key=f"competitor_{i}", placeholder=f"https://competitor{i+1}.com/pagina-rilevante")
         if url:
             competitor_urls.append(url)
@@ -464,98 +4333,213 @@ def main():
     # Pulsante di Analisi
     st.markdown('<h2 class="section-header">🔍 Avvia Analisi E-E-A-T</h2>', unsafe_allow_html=True)
     
-    if st.button("🚀 Avvia Analisi Completa", type="primary", use_container_width=True):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        triage_mode = st.checkbox(
+            "⚡ Modalità triage",
+            help="Pre-valuta il contenuto localmente: se supera la soglia su tutti i criteri la pipeline AI viene saltata, "
+                 "altrimenti il modello analizza solo i criteri deboli"
+        )
+    with col2:
+        triage_threshold = st.slider("Soglia triage", min_value=1.0, max_value=10.0, value=7.0, step=0.5, disabled=not triage_mode)
+    with col3:
+        structured_mode = st.checkbox(
+            "🧩 Output strutturati",
+            help="Il modello risponde in JSON validato (punteggi, piano, contenuto): prompt e risposte più corti "
+                 "e punteggi reali nel riepilogo, senza anteprima in streaming"
+        )
+        incremental_mode = st.checkbox(
+            "♻️ Ottimizzazione per sezioni",
+            help="Divide il contenuto in sezioni in base ai titoli markdown e, dopo una modifica, "
+                 "rianalizza e riscrive solo le sezioni cambiate riusando le altre"
+        )
+
+    brand_info = {
+        'nome': nome_brand,
+        'url': url_sito,
+        'tone_of_voice': tone_of_voice,
+        'chi_siamo': chi_siamo
+    }
+    job_payload = {
+        'brand_info': brand_info,
+        'sitemap_input': sitemap_input,
+        'competitor_urls': competitor_urls,
+        'competitor_content_manual': competitor_content_manual,
+        'use_cache': use_cache,
+        'structured': structured_mode,
+    }
+
+    col_run, col_queue = st.columns([3, 1])
+    with col_run:
+        run_clicked = st.button("🚀 Avvia Analisi Completa", type="primary", use_container_width=True)
+    with col_queue:
+        queue_clicked = st.button(
+            "➕ Aggiungi alla coda",
+            use_container_width=True,
+            help="Esegue l'analisi in background: continua anche se interagisci con la pagina o la ricarichi"
+        )
+
+    if queue_clicked:
+        if not all([nome_brand, url_sito, contenuto_da_analizzare, chi_siamo]):
+            st.error("❌ Compila tutti i campi obbligatori del brand e il contenuto da analizzare")
+        else:
+            label = contenuto_da_analizzare.strip().splitlines()[0].lstrip('#').strip()[:80]
+            job_id = job_runner.submit(key_digest, label, dict(job_payload, content=contenuto_da_analizzare))
+            st.success(f"✅ Job #{job_id} aggiunto alla coda")
+
+    # Coda di lavoro: job in background che sopravvivono ai rerun
+    with st.expander("📋 Coda di Lavoro", expanded=bool(queue_clicked)):
+        page_urls_text = st.text_area(
+            "Accoda più pagine: URL delle pagine da ottimizzare (uno per riga)",
+            height=100,
+            placeholder="https://www.esempio.com/pagina-1\nhttps://www.esempio.com/pagina-2"
+        )
+        if st.button("📥 Accoda pagine"):
+            page_urls = [line.strip() for line in page_urls_text.splitlines() if line.strip().startswith('http')]
+            if not all([nome_brand, url_sito, chi_siamo]):
+                st.error("❌ Compila tutti i campi obbligatori del brand")
+            elif not page_urls:
+                st.warning("⚠️ Inserisci almeno un URL valido")
+            else:
+                for page_url in page_urls:
+                    job_runner.submit(key_digest, page_url, dict(job_payload, page_url=page_url))
+                st.success(f"✅ {len(page_urls)} pagine aggiunte alla coda")
+        render_job_queue(job_runner, key_digest)
+
+    if run_clicked:
         
         # Validazione input
         if not all([nome_brand, url_sito, contenuto_da_analizzare, chi_siamo]):
             st.error("❌ Compila tutti i campi obbligatori del brand e il contenuto da analizzare")
             return
         
-        # Prepare brand info
-        brand_info = {
-            'nome': nome_brand,
-            'url': url_sito,
-            'tone_of_voice': tone_of_voice,
-            'chi_siamo': chi_siamo
-        }
-        
+        eeat_kwargs = {}
+        if triage_mode:
+            triage = triage_eeat(contenuto_da_analizzare, triage_threshold)
+            st.markdown('<h2 class="section-header">⚡ Pre-valutazione Locale E-E-A-T</h2>', unsafe_allow_html=True)
+            for col, (criterion, score) in zip(st.columns(4), triage['scores'].items()):
+                with col:
+                    st.metric(criterion, f"{score}/10")
+            if triage['skip']:
+                st.success(f"✅ Il contenuto supera la soglia di {triage_threshold}/10 su tutti i criteri: ottimizzazione AI non necessaria")
+                return
+            st.info(f"🎯 Analisi AI concentrata sui criteri deboli: {', '.join(triage['weak_criteria'])}")
+            eeat_kwargs = {'focus_criteria': triage['weak_criteria'], 'local_scores': triage['scores']}
+
+        if incremental_mode:
+            render_incremental_optimization(contenuto_da_analizzare, brand_info, sitemap_input, openai_client, use_cache)
+            return
+
+        if is_long_content(contenuto_da_analizzare):
+            st.info(
+                f"📚 Documento lungo ({count_tokens(contenuto_da_analizzare)} token): analisi e riscrittura "
+                f"in parallelo per blocchi di circa {CHUNK_TOKENS} token"
+            )
+
         progress_bar = st.progress(0)
         status_text = st.empty()
         
         try:
-            # Step 1: Estrazione Sitemap
-            status_text.text("🗺️ Estrazione URL dalla sitemap...")
-            progress_bar.progress(20)
-            
-            sitemap_urls = []
+            # Area di generazione in tempo reale: i token arrivano in streaming
+            cancel_event = threading.Event()
+            tracer = PipelineTracer()
+            stream_metrics = {'eeat_analysis': {}, 'optimization_suggestions': {}, 'optimized_content': {}}
+            live_area = st.empty()
+            with live_area.container():
+                st.button("⏹️ Interrompi generazione", help="Ferma subito la generazione in corso (e la relativa fatturazione)")
+                with st.expander("✍️ Generazione in tempo reale", expanded=True):
+                    stream_renderers = {name: make_stream_renderer(st.empty()) for name in stream_metrics}
+            stage_llm_options = {
+                name: {
+                    'use_cache': use_cache,
+                    'tracker': tracer,
+                    'on_token': None if structured_mode else stream_renderers[name],
+                    'structured': structured_mode,
+                    'cancel_event': cancel_event,
+                    'metrics': stream_metrics[name],
+                }
+                for name in stream_metrics
+            }
+
+            digest_metrics = {}
+            stages = build_pipeline_stages(
+                brand_info, sitemap_input, competitor_urls, competitor_content_manual, openai_client,
+                stage_llm_options, content=contenuto_da_analizzare, eeat_kwargs=eeat_kwargs,
+                digest_metrics=digest_metrics
+            )
+            stage_labels = PIPELINE_STAGE_LABELS
+
+            pipeline_start = time.monotonic()
+
+            def on_stage_done(name, completed, total):
+                status_text.text(f"{stage_labels[name]}: completata ({completed}/{total})")
+                progress_bar.progress(int(completed / total * 100))
+
+            def on_poll():
+                # Ogni chiamata a Streamlit dal thread dello script permette di intercettare l'interruzione
+                elapsed_text.caption(f"⏱️ {time.monotonic() - pipeline_start:.0f}s trascorsi")
+
+            elapsed_text = st.empty()
+            status_text.text("🚀 Avvio delle fasi di analisi in parallelo...")
+            results, stage_timings, stage_errors = run_stage_graph(
+                stages, on_stage_done=on_stage_done, cancel_event=cancel_event, on_poll=on_poll
+            )
+            live_area.empty()
+            for name, timing in stage_timings.items():
+                tracer.record_stage(name, run=timing['run'], wait=timing['wait'], status=timing['status'])
+            if stage_errors:
+                # Fail fast: le fasi a valle della fase fallita non sono state eseguite
+                failed_stage, error = next(iter(stage_errors.items()))
+                skipped = [stage_labels[name] for name, timing in stage_timings.items() if timing['status'] == 'saltata']
+                status_text.text(f"❌ {stage_labels[failed_stage]}: non completata")
+                st.error(f"❌ {stage_labels[failed_stage]} non completata: {error}")
+                if skipped:
+                    st.warning(f"⏭️ Fasi successive saltate per non sprecare token: {', '.join(skipped)}")
+                render_pipeline_metrics(tracer, stage_labels, stream_metrics)
+                return
+
+            sitemap_urls = results['sitemap_urls']
+            eeat_analysis = results['eeat_analysis']
+            optimization_suggestions = results['optimization_suggestions']
+            optimized_markdown = as_markdown(results['optimized_content'])
+            st.session_state.variant_inputs = {
+                'original_content': results['page_content'],
+                'brand_info': brand_info,
+                'competitor_analysis': results['competitor_analysis'],
+                'sitemap_urls': sitemap_urls,
+                'eeat_analysis': eeat_analysis,
+                'optimization_suggestions': optimization_suggestions,
+                'structured': structured_mode,
+            }
+
             if sitemap_input:
-                sitemap_urls = extract_sitemap_urls(sitemap_input)
                 if sitemap_urls:
                     st.success(f"✅ Estratti {len(sitemap_urls)} URL dalla sitemap")
                 else:
                     st.warning("⚠️ Nessun URL estratto dalla sitemap")
-            
-            # Step 2: Analisi Competitor
-            status_text.text("🏆 Analisi dei competitor...")
-            progress_bar.progress(40)
-            
-            competitor_analysis = "ANALISI COMPETITOR:\n"
-            
-            if competitor_content_manual:
-                competitor_analysis += f"Contenuto competitor fornito manualmente:\n{competitor_content_manual}\n\n"
-            
-            for i, url in enumerate(competitor_urls):
-                if url:
-                    content = scrape_website_content(url)
-                    competitor_analysis += f"COMPETITOR {i+1} ({url}):\n{content}\n\n"
-                    time.sleep(1)  # Rate limiting
-            
-            # Step 3: Analisi E-E-A-T
-            status_text.text("🔍 Analisi E-E-A-T del contenuto...")
-            progress_bar.progress(60)
-            
-            eeat_analysis = analyze_eeat_content(contenuto_da_analizzare, brand_info, openai)
-            
-            # Step 4: Generazione Suggerimenti
-            status_text.text("💡 Generazione suggerimenti di ottimizzazione...")
-            progress_bar.progress(80)
-            
-            optimization_suggestions = generate_optimization_suggestions(
-                contenuto_da_analizzare, 
-                brand_info, 
-                competitor_analysis, 
-                sitemap_urls, 
-                eeat_analysis, 
-                openai
-            )
-            
-            # Step 5: Generazione Contenuto Ottimizzato
-            status_text.text("✨ Creazione contenuto ottimizzato finale...")
-            progress_bar.progress(90)
-            
-            optimized_content = generate_optimized_content(
-                contenuto_da_analizzare,
-                brand_info,
-                competitor_analysis,
-                sitemap_urls,
-                eeat_analysis,
-                optimization_suggestions,
-                openai
-            )
+            if digest_metrics.get('paragraphs'):
+                st.caption(
+                    f"🧬 Digest competitor: {digest_metrics['input_chars']} → {digest_metrics['output_chars']} caratteri "
+                    f"(compressione {digest_metrics['compression_ratio']:.1f}x, "
+                    f"{digest_metrics['duplicates_removed']} paragrafi duplicati, "
+                    f"{digest_metrics['shared_themes']} temi comuni, {digest_metrics['elapsed_ms']:.0f} ms)"
+                )
             
             progress_bar.progress(100)
             status_text.text("✅ Analisi e ottimizzazione completate!")
+
+            render_pipeline_metrics(tracer, stage_labels, stream_metrics)
             
             # Risultati
             st.markdown('<h2 class="section-header">📊 Risultati Analisi E-E-A-T</h2>', unsafe_allow_html=True)
             
             with st.expander("📈 Analisi E-E-A-T Dettagliata", expanded=True):
-                st.markdown(eeat_analysis)
+                st.markdown(as_markdown(eeat_analysis))
             
             st.markdown('<h2 class="section-header">🎯 Suggerimenti di Ottimizzazione</h2>', unsafe_allow_html=True)
             
             with st.expander("💡 Piano di Ottimizzazione Completo", expanded=True):
-                st.markdown(optimization_suggestions)
+                st.markdown(as_markdown(optimization_suggestions))
             
             # NUOVA SEZIONE: Contenuto Ottimizzato
             st.markdown('<h2 class="section-header">✨ Contenuto Ottimizzato - Pronto per Pubblicazione</h2>', unsafe_allow_html=True)
@@ -570,18 +4554,22 @@ def main():
             
             # Contenuto ottimizzato in un expander
             with st.expander("📝 CONTENUTO FINALE OTTIMIZZATO", expanded=True):
-                st.markdown(optimized_content)
+                st.markdown(optimized_markdown)
+            if isinstance(results['optimized_content'], OptimizedContentResult):
+                st.markdown(f"**🏷️ Title:** {results['optimized_content'].title}")
+                st.markdown(f"**📝 Meta description:** {results['optimized_content'].meta_description}")
+            render_validation_report(stream_metrics['optimized_content'].get('validation'))
             
             # Pulsanti per copiare il contenuto
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("📋 Copia Contenuto Ottimizzato", use_container_width=True):
-                    st.code(optimized_content, language="markdown")
+                    st.code(optimized_markdown, language="markdown")
                     st.info("💡 Seleziona tutto il testo sopra e copialo (Ctrl+A, Ctrl+C)")
                     
             with col2:
                 # Conteggio parole
-                word_count = len(optimized_content.split())
+                word_count = len(optimized_markdown.split())
                 st.metric("📊 Parole Totali", word_count)
             
             # Informazioni aggiuntive
@@ -593,15 +4581,20 @@ def main():
             # Riepilogo finale
             st.markdown('<h2 class="section-header">📋 Riepilogo Ottimizzazione</h2>', unsafe_allow_html=True)
             
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("🎯 Experience", "Migliorata", delta="↗️")
-            with col2:
-                st.metric("🧠 Expertise", "Potenziata", delta="↗️")
-            with col3:
-                st.metric("👑 Authority", "Rafforzata", delta="↗️")
-            with col4:
-                st.metric("🔒 Trust", "Incrementata", delta="↗️")
+            # Punteggi reali dall'analisi quando disponibili, altrimenti il riepilogo qualitativo
+            eeat_scores = parse_eeat_scores(eeat_analysis)
+            summary = [
+                ("🎯 Experience", 'Experience', "Migliorata"),
+                ("🧠 Expertise", 'Expertise', "Potenziata"),
+                ("👑 Authority", 'Authoritativeness', "Rafforzata"),
+                ("🔒 Trust", 'Trustworthiness', "Incrementata"),
+            ]
+            for col, (label, criterion, fallback) in zip(st.columns(4), summary):
+                with col:
+                    if criterion in eeat_scores:
+                        st.metric(label, f"{eeat_scores[criterion]:g}/10")
+                    else:
+                        st.metric(label, fallback, delta="↗️")
                         
             st.markdown("""
             <div class="success-box">
@@ -618,6 +4611,9 @@ def main():
             
         except Exception as e:
             st.error(f"❌ Errore durante l'analisi: {str(e)}")
+
+    if st.session_state.variant_inputs:
+        render_variant_generation(st.session_state.variant_inputs, openai_client, use_cache)
             
     # Footer
     st.markdown("---")
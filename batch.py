@@ -0,0 +1,347 @@
+"""Esecuzione batch da riga di comando della pipeline E-E-A-T sulle pagine di una sitemap.
+
+Esempio:
+
+    python batch.py --sitemap https://www.esempio.com/sitemap.xml \
+        --brand-name "Azienda XYZ" --brand-url https://www.esempio.com \
+        --about chi_siamo.txt --output risultati.jsonl --concurrency 4
+
+I risultati vengono scritti pagina per pagina nel file JSONL di checkpoint:
+rilanciando lo stesso comando le pagine già completate vengono saltate.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict
+
+import openai
+
+from app import (
+    EEAT_CRITERIA,
+    BrandProfile,
+    LLMError,
+    PipelineTracer,
+    analyze_eeat_content,
+    analyze_eeat_pages,
+    as_markdown,
+    build_competitor_digest,
+    crawl_site,
+    parse_eeat_scores,
+    triage_eeat,
+    extract_sitemap_urls,
+    generate_optimization_suggestions,
+    generate_optimized_content,
+    get_rate_limiter,
+    scrape_website_content,
+)
+
+CSV_FIELDS = [
+    'url', 'status', 'error', 'duration', 'prompt_tokens', 'completion_tokens', 'saved_prompt_tokens', 'cached_prompt_tokens',
+    'cost', 'route_changes', 'link_issues', 'headings_fixed',
+    *EEAT_CRITERIA,
+    'eeat_analysis', 'optimization_suggestions', 'optimized_content',
+]
+
+def read_text_arg(value):
+    """Restituisce il contenuto del file se il valore è un percorso esistente, altrimenti il valore stesso"""
+    if value and os.path.isfile(value):
+        with open(value, encoding='utf-8') as f:
+            return f.read()
+    return value or ''
+
+def load_checkpoint(path):
+    """Legge i risultati già scritti e restituisce l'insieme degli URL completati con successo"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # riga troncata da un'interruzione
+            if record.get('status') in ('ok', 'skipped'):
+                done.add(record['url'])
+    return done
+
+def process_page(url, brand_info, sitemap_urls, competitor_analysis, openai_client, llm_options, triage_threshold=None,
+                 content=None, eeat_analysis=None):
+    """Esegue scraping e le tre fasi di analisi/ottimizzazione per una singola pagina.
+
+    `content` ed `eeat_analysis` evitano di ripetere scraping e analisi già
+    eseguiti per un gruppo di pagine (process_group).
+    """
+    started = time.monotonic()
+    tracker = PipelineTracer()
+    options = dict(llm_options, tracker=tracker)
+    record = {'url': url, 'status': 'ok', 'error': ''}
+
+    if content is None:
+        with tracker.stage('scraping'):
+            content = scrape_website_content(url)
+    failed_scrape = content.startswith("Errore nel caricamento del contenuto")
+    triage = triage_eeat(content, triage_threshold) if triage_threshold is not None and not failed_scrape else None
+    if triage is not None:
+        record['local_scores'] = triage['scores']
+
+    if failed_scrape:
+        record.update(status='error', error=content)
+    elif triage is not None and triage['skip']:
+        # La pagina supera già la soglia su tutti i criteri: nessuna chiamata al modello
+        record['status'] = 'skipped'
+    else:
+        eeat_kwargs = {'focus_criteria': triage['weak_criteria'], 'local_scores': triage['scores']} if triage else {}
+        try:
+            if eeat_analysis is None:
+                with tracker.stage('eeat_analysis'):
+                    eeat_analysis = analyze_eeat_content(content, brand_info, openai_client, **eeat_kwargs, **options)
+            with tracker.stage('optimization_suggestions'):
+                optimization_suggestions = generate_optimization_suggestions(
+                    content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, openai_client, **options
+                )
+            stage_metrics = {}
+            with tracker.stage('optimized_content'):
+                optimized_content = generate_optimized_content(
+                    content, brand_info, competitor_analysis, sitemap_urls, eeat_analysis, optimization_suggestions,
+                    openai_client, **dict(options, metrics=stage_metrics)
+                )
+        except Exception as e:
+            # Fail fast: le fasi successive non partono, la pagina verrà ritentata al prossimo avvio.
+            # Anche gli errori non del modello (es. nella validazione) tengono token e costi già spesi
+            record.update(status='error', error=str(e) if isinstance(e, LLMError) else f"{type(e).__name__}: {e}")
+        else:
+            record.update(parse_eeat_scores(eeat_analysis))
+            record.update(
+                eeat_analysis=as_markdown(eeat_analysis),
+                optimization_suggestions=as_markdown(optimization_suggestions),
+                optimized_content=as_markdown(optimized_content),
+            )
+            validation = stage_metrics.get('validation')
+            if validation:
+                record['link_issues'] = len(validation['invalid_internal']) + len(validation['broken_external'])
+                record['headings_fixed'] = len(validation['headings_fixed'])
+            if not isinstance(optimized_content, str):
+                record['structured'] = {
+                    'eeat_analysis': asdict(eeat_analysis),
+                    'optimization_suggestions': asdict(optimization_suggestions),
+                    'optimized_content': asdict(optimized_content),
+                }
+
+    record.update(
+        duration=round(time.monotonic() - started, 2),
+        prompt_tokens=tracker.prompt_tokens,
+        completion_tokens=tracker.completion_tokens,
+        saved_prompt_tokens=tracker.saved_prompt_tokens,
+        cached_prompt_tokens=tracker.cached_prompt_tokens,
+        cost=round(tracker.total_cost, 6),
+        stages={name: round(timing['run'], 2) for name, timing in tracker.stages.items()},
+        routes=tracker.route_stats(),
+        route_changes=tracker.route_changes,
+    )
+    return record
+
+def process_group(urls, brand_info, sitemap_urls, competitor_analysis, openai_client, llm_options, max_words):
+    """Elabora un gruppo di pagine: quelle brevi condividono una sola richiesta di analisi E-E-A-T.
+
+    Token e costo della richiesta condivisa sono ripartiti in parti uguali tra
+    le pagine del gruppo; suggerimenti e contenuto restano chiamate per pagina.
+    """
+    contents = {url: scrape_website_content(url) for url in urls}
+    short = [
+        url for url in urls
+        if not contents[url].startswith("Errore nel caricamento del contenuto") and len(contents[url].split()) <= max_words
+    ]
+    analyses = {}
+    shared = PipelineTracer()
+    if len(short) > 1:
+        try:
+            results = analyze_eeat_pages(
+                [contents[url] for url in short], brand_info, openai_client, **dict(llm_options, tracker=shared)
+            )
+            analyses = dict(zip(short, results))
+        except LLMError as e:
+            # Ogni pagina ripete l'analisi da sola in process_page
+            print(f"⚠️ Analisi di gruppo non riuscita, si procede pagina per pagina: {e}", file=sys.stderr)
+
+    records = []
+    for url in urls:
+        record = process_page(
+            url, brand_info, sitemap_urls, competitor_analysis, openai_client, llm_options,
+            content=contents[url], eeat_analysis=analyses.get(url)
+        )
+        if url in analyses:
+            share = len(analyses)
+            record['group_size'] = share
+            record['prompt_tokens'] += shared.prompt_tokens // share
+            record['completion_tokens'] += shared.completion_tokens // share
+            record['cached_prompt_tokens'] += shared.cached_prompt_tokens // share
+            record['cost'] = round(record['cost'] + shared.total_cost / share, 6)
+        records.append(record)
+    return records
+
+def write_csv(jsonl_path, csv_path):
+    """Converte il checkpoint JSONL in CSV mantenendo l'ultimo risultato per ogni URL"""
+    records = {}
+    with open(jsonl_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['url']] = record
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records.values())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ottimizzazione E-E-A-T in batch delle pagine di una sitemap")
+    parser.add_argument('--sitemap', required=True, help="URL della sitemap o percorso di un file XML")
+    parser.add_argument('--brand-name', required=True, help="Nome del brand")
+    parser.add_argument('--brand-url', required=True, help="URL del sito del brand")
+    parser.add_argument('--tone', default="Professionale", help="Tone of voice (default: Professionale)")
+    parser.add_argument('--about', required=True, help="Estratto 'Chi Siamo' (testo o percorso di un file)")
+    parser.add_argument('--competitors', default='', help="Contenuto competitor (testo o percorso di un file)")
+    parser.add_argument('--output', required=True, help="File di output .jsonl o .csv")
+    parser.add_argument('--checkpoint', help="File JSONL di checkpoint (default: output con estensione .jsonl)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Pagine elaborate in parallelo (default: 4)")
+    parser.add_argument('--max-retries', type=int, default=5, help="Tentativi sugli errori di rate limit (default: 5)")
+    parser.add_argument('--rpm', type=int, help="Richieste al minuto consentite dall'API key (default: $SEO_OPTIMIZER_RPM o 500)")
+    parser.add_argument('--tpm', type=int, help="Token al minuto consentiti dall'API key (default: $SEO_OPTIMIZER_TPM o 200000)")
+    parser.add_argument('--limit', type=int, help="Numero massimo di pagine da elaborare")
+    parser.add_argument('--triage-threshold', type=float,
+                        help="Salta le pagine con punteggio locale E-E-A-T sopra la soglia su tutti i criteri (1-10)")
+    parser.add_argument('--group-size', type=int, default=1,
+                        help="Pagine brevi analizzate insieme in una sola richiesta E-E-A-T (default: 1, nessun raggruppamento)")
+    parser.add_argument('--group-max-words', type=int, default=600,
+                        help="Lunghezza massima in parole di una pagina raggruppabile (default: 600)")
+    parser.add_argument('--routes', help="File JSON con modello, temperatura e token per fase "
+                                         "(default: $SEO_OPTIMIZER_MODEL_ROUTES)")
+    parser.add_argument('--crawl', action='store_true',
+                        help="Scansiona prima le pagine della sitemap (titoli e meta description per i link interni)")
+    parser.add_argument('--structured', action='store_true',
+                        help="Output JSON validati: punteggi E-E-A-T numerici per pagina e prompt più compatti")
+    parser.add_argument('--no-cache', action='store_true', help="Non usare la cache delle risposte AI")
+    parser.add_argument('--api-key', default=os.environ.get('OPENAI_API_KEY'), help="API key (default: $OPENAI_API_KEY)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.api_key:
+        print("❌ Specifica --api-key o la variabile d'ambiente OPENAI_API_KEY", file=sys.stderr)
+        return 1
+    if args.routes:
+        # Letto da get_model_routes() alla prima chiamata al modello
+        os.environ['SEO_OPTIMIZER_MODEL_ROUTES'] = args.routes
+    # Un solo client per tutti i thread: condivide il pool di connessioni, i tentativi li gestisce call_llm
+    openai_client = openai.OpenAI(api_key=args.api_key, max_retries=0, timeout=120)
+
+    output_is_csv = args.output.lower().endswith('.csv')
+    checkpoint = args.checkpoint or (os.path.splitext(args.output)[0] + '.jsonl' if output_is_csv else args.output)
+
+    sitemap = args.sitemap if args.sitemap.startswith('http') else read_text_arg(args.sitemap)
+    sitemap_urls = extract_sitemap_urls(sitemap)
+    if not sitemap_urls:
+        print("❌ Nessun URL estratto dalla sitemap", file=sys.stderr)
+        return 1
+
+    if args.crawl:
+        stats = crawl_site(sitemap)
+        print(
+            f"🕷️ Scansione del sito: {stats['fetched']} pagine aggiornate, {stats['unchanged']} invariate, "
+            f"{stats['blocked']} bloccate da robots.txt, {stats['errors']} errori in {stats['elapsed']:.1f}s"
+        )
+
+    done = load_checkpoint(checkpoint)
+    todo = [url for url in sitemap_urls if url not in done]
+    if args.limit is not None:
+        todo = todo[:args.limit]
+    print(f"🗺️ {len(sitemap_urls)} URL nella sitemap, {len(done)} già completati, {len(todo)} da elaborare")
+
+    # Un solo profilo per tutto il batch: il contesto del brand resta identico tra le pagine (prefisso in cache)
+    brand_info = BrandProfile(args.brand_name, args.brand_url, args.tone, read_text_arg(args.about))
+    competitor_analysis = build_competitor_digest([("Contenuto competitor", read_text_arg(args.competitors))])
+    llm_options = {
+        'use_cache': not args.no_cache,
+        'max_retries': args.max_retries,
+        'structured': args.structured,
+        'rate_limiter': get_rate_limiter(args.rpm, args.tpm),
+    }
+
+    group_size = max(1, args.group_size)
+    if group_size > 1 and args.triage_threshold is not None:
+        print("⚠️ --group-size è ignorato con --triage-threshold: l'analisi mirata resta per singola pagina")
+        group_size = 1
+    groups = [todo[i:i + group_size] for i in range(0, len(todo), group_size)]
+
+    started = time.monotonic()
+    write_lock = threading.Lock()
+    succeeded = failed = skipped = total_tokens = prompt_tokens = cached_prompt_tokens = route_changes = link_issues = 0
+    total_cost = 0.0
+    with open(checkpoint, 'a', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = {}
+        for group in groups:
+            if group_size > 1:
+                future = executor.submit(
+                    process_group, group, brand_info, sitemap_urls, competitor_analysis, openai_client, llm_options,
+                    args.group_max_words
+                )
+            else:
+                future = executor.submit(
+                    process_page, group[0], brand_info, sitemap_urls, competitor_analysis, openai_client, llm_options,
+                    args.triage_threshold
+                )
+            futures[future] = group
+        for future in as_completed(futures):
+            try:
+                records = future.result()
+            except Exception as e:
+                records = [{'url': url, 'status': 'error', 'error': str(e)} for url in futures[future]]
+            if isinstance(records, dict):
+                records = [records]
+            for record in records:
+                with write_lock:
+                    # Una riga per pagina, scritta subito: è il checkpoint per la ripresa
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    out.flush()
+                if record['status'] == 'ok':
+                    succeeded += 1
+                    total_tokens += record.get('prompt_tokens', 0) + record.get('completion_tokens', 0)
+                    prompt_tokens += record.get('prompt_tokens', 0)
+                    cached_prompt_tokens += record.get('cached_prompt_tokens', 0)
+                    route_changes += record.get('route_changes', 0)
+                    link_issues += record.get('link_issues', 0)
+                    total_cost += record.get('cost', 0.0)
+                elif record['status'] == 'skipped':
+                    skipped += 1
+                else:
+                    failed += 1
+                icon = {'ok': '✅', 'skipped': '⏭️'}.get(record['status'], '❌')
+                print(f"{icon} [{succeeded + skipped + failed}/{len(todo)}] {record['url']}")
+
+    if output_is_csv:
+        write_csv(checkpoint, args.output)
+
+    elapsed = time.monotonic() - started
+    pages_per_min = (succeeded + skipped + failed) / elapsed * 60 if elapsed > 0 else 0.0
+    tokens_per_page = total_tokens / succeeded if succeeded else 0.0
+    print(
+        f"\n📊 {succeeded} pagine completate, {skipped} saltate dal triage, {failed} fallite in {elapsed:.1f}s — "
+        f"{pages_per_min:.1f} pagine/min, {tokens_per_page:.0f} token/pagina, costo stimato ${total_cost:.4f}"
+    )
+    if prompt_tokens:
+        print(f"🧠 Cache del prefisso di OpenAI: {cached_prompt_tokens / prompt_tokens:.0%} dei token di input")
+    if route_changes:
+        print(f"🧭 {route_changes} richieste passate a un altro modello (cascata o fallback)")
+    if link_issues:
+        print(f"🔗 {link_issues} link non validi corretti o rimossi dalla validazione dei contenuti")
+    return 0 if not failed else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
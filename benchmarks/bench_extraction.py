@@ -0,0 +1,60 @@
+"""Benchmark dell'estrazione del contenuto HTML sulle pagine salvate in benchmarks/fixtures.
+
+Confronta l'estrazione originale (html.parser + get_text sull'intera pagina)
+con extract_page_content (albero lxml, rimozione del boilerplate in C e
+rilevamento del contenuto principale per densità di testo).
+
+    python benchmarks/bench_extraction.py [--repeat 20]
+"""
+import argparse
+import glob
+import os
+import re
+import statistics
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import extract_page_content  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def legacy_extract(html):
+    """Estrazione originale di scrape_website_content, usata come riferimento"""
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(['script', 'style', 'nav', 'header', 'footer']):
+        element.decompose()
+    text = re.sub(r'\s+', ' ', soup.get_text()).strip()
+    return text[:5000]
+
+def measure(func, html, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(html)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help="Ripetizioni per fixture (default: 20)")
+    args = parser.parse_args(argv)
+
+    print(f"{'fixture':<22}{'KB':>8}{'legacy ms':>12}{'nuovo ms':>12}{'speedup':>10}{'parole':>9}")
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, 'rb') as f:
+            html = f.read()
+        legacy_ms = measure(legacy_extract, html, args.repeat)
+        new_ms = measure(extract_page_content, html, args.repeat)
+        page = extract_page_content(html)
+        name = os.path.splitext(os.path.basename(path))[0]
+        print(
+            f"{name:<22}{len(html) / 1024:>8.0f}{legacy_ms:>12.1f}{new_ms:>12.1f}"
+            f"{legacy_ms / new_ms:>9.1f}x{page['word_count']:>9}"
+        )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""Benchmark delle fasi della pipeline contro un server locale finto (benchmarks/fake_server.py).
+
+Misura estrazione della sitemap, scraping delle pagine in benchmarks/fixtures
+e le tre chiamate al modello (analisi E-E-A-T, suggerimenti, contenuto
+ottimizzato) senza rete né API key: per ogni fase riporta percentili di
+latenza, throughput, picco di memoria e tentativi dovuti ai 429.
+
+    python benchmarks/bench_pipeline.py --iterations 20 --concurrency 4 --stream --error-rate 0.1
+    python benchmarks/bench_pipeline.py --save baseline.json
+    python benchmarks/bench_pipeline.py --compare baseline.json --tolerance 0.2
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# Cache su una directory temporanea: il benchmark non tocca .cache/ e misura sempre il percorso completo
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-bench-'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import openai  # noqa: E402
+
+from app import (  # noqa: E402
+    PipelineTracer,
+    RateLimiter,
+    analyze_eeat_content,
+    extract_sitemap_urls,
+    generate_optimization_suggestions,
+    generate_optimized_content,
+    scrape_website_content,
+)
+from fake_server import FIXTURES_DIR, FakeServerConfig, start_server  # noqa: E402
+
+BRAND_INFO = {
+    'nome': "Azienda Benchmark",
+    'url': "https://www.esempio.com",
+    'tone_of_voice': "Professionale",
+    'chi_siamo': "Da vent'anni aiutiamo le aziende a farsi trovare online con contenuti affidabili e verificati.",
+}
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * q
+    low, high = int(index), min(int(index) + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+def run_stage(func, iterations, concurrency):
+    """Esegue func(i) per ogni iterazione con la concorrenza indicata; restituisce latenze (ms) e durata totale"""
+    latencies = []
+
+    def timed(i):
+        started = time.perf_counter()
+        func(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(iterations)))
+    return latencies, time.perf_counter() - started
+
+def peak_memory(func):
+    """Picco di memoria allocata (MB) durante una singola esecuzione, misurato a parte per non falsare le latenze"""
+    tracemalloc.start()
+    try:
+        func(0)
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+def build_stages(server, client, args, tracer):
+    base_url = server.base_url
+    pages = [f"{base_url}/pages/{os.path.basename(path)}" for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html')))]
+    content = scrape_website_content(pages[0])
+    sitemap_urls = extract_sitemap_urls(f"{base_url}/sitemap.xml")
+    competitor_analysis = "ANALISI COMPETITOR:\n" + '\n'.join(scrape_website_content(page) for page in pages[1:])
+    # Limiti ampi: si misura il client, non lo scheduler
+    llm_options = {
+        'use_cache': False,
+        'tracker': tracer,
+        'max_retries': 8,
+        'structured': args.structured,
+        'rate_limiter': RateLimiter(rpm=10 ** 6, tpm=10 ** 9, max_concurrent=args.concurrency),
+    }
+    if args.stream and not args.structured:
+        llm_options['on_token'] = lambda text: None
+    eeat_analysis = analyze_eeat_content(content, BRAND_INFO, client, **llm_options)
+    suggestions = generate_optimization_suggestions(
+        content, BRAND_INFO, competitor_analysis, sitemap_urls, eeat_analysis, client, **llm_options
+    )
+    return {
+        'sitemap': lambda i: extract_sitemap_urls(f"{base_url}/sitemap.xml"),
+        'scraping': lambda i: scrape_website_content(pages[i % len(pages)]),
+        'eeat_analysis': lambda i: analyze_eeat_content(content, BRAND_INFO, client, **llm_options),
+        'optimization_suggestions': lambda i: generate_optimization_suggestions(
+            content, BRAND_INFO, competitor_analysis, sitemap_urls, eeat_analysis, client, **llm_options
+        ),
+        'optimized_content': lambda i: generate_optimized_content(
+            content, BRAND_INFO, competitor_analysis, sitemap_urls, eeat_analysis, suggestions, client, **llm_options
+        ),
+    }
+
+def compare(results, baseline_path, tolerance):
+    """Confronta il p50 di ogni fase con una baseline salvata; restituisce le fasi peggiorate oltre la tolleranza"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)['stages']
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference and result['p50_ms'] > reference['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {result['p50_ms']:.1f} ms contro {reference['p50_ms']:.1f} ms della baseline")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20, help="Esecuzioni per fase (default: 20)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Esecuzioni parallele (default: 4)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Latenza del modello finto in secondi (default: 0.05)")
+    parser.add_argument('--token-delay', type=float, default=0.002, help="Pausa tra i frammenti in streaming (default: 0.002)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probabilità di risposte 429 (default: 0)")
+    parser.add_argument('--stream', action='store_true', help="Usa lo streaming per le chiamate al modello")
+    parser.add_argument('--structured', action='store_true', help="Usa gli output strutturati (JSON Schema)")
+    parser.add_argument('--stages', help="Fasi da eseguire separate da virgola (default: tutte)")
+    parser.add_argument('--save', help="Salva i risultati in JSON (baseline per --compare)")
+    parser.add_argument('--compare', help="Baseline JSON con cui confrontare il p50 di ogni fase")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Peggioramento ammesso rispetto alla baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    config = FakeServerConfig(latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate)
+    server = start_server(config)
+    client = openai.OpenAI(api_key="bench", base_url=f"{server.base_url}/v1", max_retries=0)
+    tracer = PipelineTracer()
+    stages = build_stages(server, client, args, tracer)
+    if args.stages:
+        stages = {name: stages[name] for name in args.stages.split(',')}
+
+    results = {}
+    print(f"{'fase':<26}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'op/s':>9}{'picco MB':>10}{'retry':>7}")
+    for name, func in stages.items():
+        retries_before = sum(call['retries'] for call in tracer.llm_calls)
+        latencies, elapsed = run_stage(func, args.iterations, args.concurrency)
+        retries = sum(call['retries'] for call in tracer.llm_calls) - retries_before
+        results[name] = {
+            'p50_ms': percentile(latencies, 0.5),
+            'p90_ms': percentile(latencies, 0.9),
+            'p99_ms': percentile(latencies, 0.99),
+            'mean_ms': statistics.mean(latencies),
+            'throughput_per_s': len(latencies) / elapsed,
+            'peak_mb': peak_memory(func),
+            'retries': retries,
+        }
+        r = results[name]
+        print(
+            f"{name:<26}{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+            f"{r['throughput_per_s']:>9.1f}{r['peak_mb']:>10.1f}{retries:>7}"
+        )
+    server.shutdown()
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'stages': results}, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regressione: {regression}")
+        if regressions:
+            return 1
+        print(f"✅ Nessuna regressione oltre il {args.tolerance:.0%} rispetto a {args.compare}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
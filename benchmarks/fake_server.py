@@ -0,0 +1,230 @@
+"""Server HTTP locale che simula i servizi esterni usati dall'app, per benchmark riproducibili offline.
+
+Serve:
+- /pages/<nome>.html       le pagine salvate in benchmarks/fixtures
+- /sitemap.xml             un indice di sitemap generato (con figlie /sitemap-<n>.xml.gz compresse)
+- /v1/models[/<id>]        la validazione della API key (elenco o singolo modello)
+- /v1/chat/completions     chat completion finte, anche in streaming (SSE) e con `n` risposte,
+                           con latenza configurabile e iniezione di errori 429 con Retry-After
+
+    python benchmarks/fake_server.py --port 8765 --latency 0.2 --error-rate 0.1
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+@dataclass
+class FakeServerConfig:
+    latency: float = 0.05          # secondi prima della risposta (o del primo token in streaming)
+    token_delay: float = 0.002     # secondi tra un frammento e l'altro in streaming
+    completion_words: int = 300    # lunghezza delle risposte generate
+    error_rate: float = 0.0        # probabilità di rispondere 429
+    retry_after: float = 0.05      # valore dell'header Retry-After sui 429
+    child_sitemaps: int = 5
+    urls_per_sitemap: int = 2000
+    seed: int = 42
+
+def fake_completion_text(words):
+    """Risposta markdown plausibile: punteggi E-E-A-T leggibili dall'app più testo di riempimento"""
+    lines = [
+        "## PUNTEGGI E-E-A-T (da 1 a 10)",
+        "- Experience: 6/10",
+        "- Expertise: 7/10",
+        "- Authoritativeness: 5/10",
+        "- Trustworthiness: 8/10",
+        "",
+        "## Contenuto",
+    ]
+    filler = "il contenuto presenta esempi pratici fonti autorevoli e dati verificabili per il lettore".split()
+    body = [filler[i % len(filler)] for i in range(words)]
+    for start in range(0, len(body), 40):
+        lines.append(' '.join(body[start:start + 40]) + '.')
+    return '\n'.join(lines)
+
+def fake_json(schema):
+    """Istanza minima valida di uno schema JSON (per le richieste con response_format)"""
+    kind = schema.get('type')
+    if kind == 'object':
+        return {name: fake_json(prop) for name, prop in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [fake_json(schema['items']) for _ in range(max(1, schema.get('minItems', 2)))]
+    if kind == 'integer':
+        return schema.get('minimum', 1) + 6 if schema.get('maximum', 10) >= 7 else schema.get('minimum', 1)
+    if kind == 'number':
+        return 7.0
+    if kind == 'boolean':
+        return True
+    return "testo di esempio"
+
+def build_sitemaps(config, base_url):
+    """Indice e sitemap figlie deterministiche per la configurazione data"""
+    children = {}
+    for n in range(config.child_sitemaps):
+        urls = ''.join(
+            f"<url><loc>{base_url}/blog/categoria-{n}/articolo-seo-{i}-ottimizzazione-contenuti</loc>"
+            f"<lastmod>2024-01-{1 + i % 28:02d}</lastmod></url>"
+            for i in range(config.urls_per_sitemap)
+        )
+        xml = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+        children[f"/sitemap-{n}.xml.gz"] = gzip.compress(xml.encode('utf-8'))
+    index = ''.join(f"<sitemap><loc>{base_url}{path}</loc></sitemap>" for path in children)
+    children['/sitemap.xml'] = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{index}</sitemapindex>'
+    ).encode('utf-8')
+    return children
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeService/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        # Nessuna cache lato client: ogni iterazione misura il percorso completo
+        self.send_header('Cache-Control', 'no-store')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data, headers=None):
+        self._send(status, json.dumps(data).encode('utf-8'), 'application/json', headers)
+
+    def do_GET(self):
+        server = self.server
+        server.count('GET ' + self.path.split('?')[0].rsplit('/', 1)[0])
+        if self.path in server.sitemaps:
+            self._send(200, server.sitemaps[self.path], 'application/xml')
+        elif self.path.startswith('/pages/'):
+            path = os.path.join(FIXTURES_DIR, os.path.basename(self.path))
+            if not os.path.isfile(path):
+                self._send(404, b'not found', 'text/plain')
+                return
+            with open(path, 'rb') as f:
+                self._send(200, f.read(), 'text/html; charset=utf-8')
+        elif self.path.split('?')[0] == '/v1/models':
+            self._send_json(200, {'object': 'list', 'data': [
+                {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'fake'} for model in ('gpt-4o-mini', 'gpt-4o')
+            ]})
+        elif self.path.startswith('/v1/models/'):
+            model = self.path.rsplit('/', 1)[-1]
+            self._send_json(200, {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'fake'})
+        else:
+            self._send(404, b'not found', 'text/plain')
+
+    def do_POST(self):
+        server = self.server
+        config = server.config
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.startswith('/v1/chat/completions'):
+            self._send(404, b'not found', 'text/plain')
+            return
+        if server.random() < config.error_rate:
+            server.count('429')
+            self._send_json(
+                429,
+                {'error': {'message': 'Rate limit reached (fake)', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                {'Retry-After': str(config.retry_after)}
+            )
+            return
+        server.count('POST /v1/chat/completions')
+
+        response_format = request.get('response_format') or {}
+        choices = max(1, request.get('n') or 1)
+        if response_format.get('type') == 'json_schema':
+            texts = [json.dumps(fake_json(response_format['json_schema']['schema']), ensure_ascii=False)] * choices
+        else:
+            # Varianti di lunghezza diversa, così chi le confronta non riceve testi identici
+            texts = [fake_completion_text(config.completion_words + 40 * i) for i in range(choices)]
+        text = texts[0]
+        prompt_tokens = sum(len(m.get('content', '')) for m in request.get('messages', [])) // 4
+        completion_tokens = sum(len(t) for t in texts) // 4
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                 'total_tokens': prompt_tokens + completion_tokens}
+        base = {'id': 'chatcmpl-fake', 'created': int(time.time()), 'model': request.get('model', 'gpt-4o-mini')}
+        time.sleep(config.latency)
+
+        if not request.get('stream'):
+            self._send_json(200, dict(base, object='chat.completion', usage=usage, choices=[
+                {'index': i, 'message': {'role': 'assistant', 'content': t}, 'finish_reason': 'stop'}
+                for i, t in enumerate(texts)
+            ]))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        chunk = dict(base, object='chat.completion.chunk')
+        try:
+            words = text.split(' ')
+            for i in range(0, len(words), 4):
+                piece = ' '.join(words[i:i + 4]) + ' '
+                event = dict(chunk, choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}])
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(config.token_delay)
+            if (request.get('stream_options') or {}).get('include_usage'):
+                self.wfile.write(f"data: {json.dumps(dict(chunk, choices=[], usage=usage))}\n\n".encode('utf-8'))
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # il client ha interrotto lo streaming
+
+class FakeServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeServiceHandler)
+        self.config = config
+        self.base_url = f"http://{self.server_address[0]}:{self.server_address[1]}"
+        self.sitemaps = build_sitemaps(config, self.base_url)
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def count(self, key):
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+def start_server(config=None, host='127.0.0.1', port=0):
+    """Avvia il server in un thread in background e lo restituisce (base_url in server.base_url)"""
+    server = FakeServiceServer((host, port), config or FakeServerConfig())
+    threading.Thread(target=server.serve_forever, name='fake-service', daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=FakeServerConfig.latency)
+    parser.add_argument('--token-delay', type=float, default=FakeServerConfig.token_delay)
+    parser.add_argument('--error-rate', type=float, default=FakeServerConfig.error_rate)
+    args = parser.parse_args(argv)
+    config = FakeServerConfig(latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate)
+    server = FakeServiceServer(('127.0.0.1', args.port), config)
+    print(f"🧪 Server finto su {server.base_url} (OPENAI_BASE_URL={server.base_url}/v1)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
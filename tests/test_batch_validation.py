@@ -0,0 +1,121 @@
+"""Validazione del contenuto ottimizzato lungo il percorso del batch (brand come BrandProfile)."""
+import os
+import sys
+import tempfile
+import types
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+import batch  # noqa: E402
+
+BRAND = app.BrandProfile(
+    nome="Esempio Srl",
+    url="https://www.esempio.com",
+    tone_of_voice="Professionale",
+    chi_siamo="Da vent'anni aiutiamo le aziende a farsi trovare online.",
+)
+SITEMAP = ["https://www.esempio.com/servizi/consulenza-seo", "https://www.esempio.com/blog/guida-seo"]
+OPTIMIZED = (
+    "# Guida Completa Alla Consulenza SEO\n\n"
+    "Scopri la [consulenza](https://www.esempio.com/servizi/consulenza-seo) e la [pagina](/servizi/inventata).\n\n"
+    + "parola " * 300
+)
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        prompt = kwargs['messages'][-1]['content']
+        if 'ESTRATTO' in prompt:
+            text = "Scopri la [consulenza](https://www.esempio.com/servizi/consulenza-seo) e la pagina."
+        elif 'CONTENUTO ORIGINALE' in prompt:
+            text = OPTIMIZED
+        else:
+            text = "- Experience: 6/10\n- Expertise: 7/10\n- Authoritativeness: 5/10\n- Trustworthiness: 8/10"
+        usage = types.SimpleNamespace(prompt_tokens=100, completion_tokens=50, total_tokens=150, prompt_tokens_details=None)
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+def fake_client():
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions()))
+
+def test_process_page_validates_with_brand_profile():
+    client = fake_client()
+    llm_options = {'use_cache': False, 'rate_limiter': app.RateLimiter(rpm=10 ** 6, tpm=10 ** 9, max_concurrent=4)}
+    record = batch.process_page(
+        "https://www.esempio.com/pagina", BRAND, SITEMAP, "", client, llm_options,
+        content="## Pagina\n\n" + "testo sulla consulenza seo " * 50,
+    )
+    assert record['status'] == 'ok', record['error']
+    assert record['link_issues'] == 1
+    assert record['headings_fixed'] == 1
+    assert "# Guida completa alla consulenza SEO" in record['optimized_content']
+    assert "/servizi/inventata" not in record['optimized_content']
+    assert record['prompt_tokens'] > 0
+
+def test_failed_validation_keeps_spent_tokens(monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("validazione non riuscita")
+
+    monkeypatch.setattr(app, 'validate_optimized_content', broken)
+    record = batch.process_page(
+        "https://www.esempio.com/pagina", BRAND, SITEMAP, "", fake_client(),
+        {'use_cache': False, 'rate_limiter': app.RateLimiter(rpm=10 ** 6, tpm=10 ** 9, max_concurrent=4)},
+        content="## Pagina\n\n" + "testo " * 50,
+    )
+    assert record['status'] == 'error'
+    assert "validazione non riuscita" in record['error']
+    assert record['prompt_tokens'] > 0 and record['cost'] > 0
+
+def test_only_definitive_link_failures_are_broken():
+    assert all(app.is_broken_link(status) for status in (404, 410, 'DNSError'))
+    for status in (403, 429, 503, 'ReadTimeout', 'ConnectTimeout', 'SSLError', 'ConnectionError', 'TimeoutError'):
+        assert not app.is_broken_link(status)
+        assert app.is_unverified_link(status)
+    assert not app.is_unverified_link(200)
+
+def test_variants_accept_brand_profile():
+    client = fake_client()
+    ranked = app.generate_optimized_variants(
+        "## Pagina\n\n" + "testo sulla consulenza seo " * 50, BRAND, "", SITEMAP, "analisi", "suggerimenti", client,
+        n=2, use_cache=False, rate_limiter=app.RateLimiter(rpm=10 ** 6, tpm=10 ** 9, max_concurrent=4),
+    )
+    assert ranked and ranked[0]['validation']['invalid_internal'] == ["/servizi/inventata"]
+    assert client.chat.completions.calls[0]['n'] == 2
+
+def test_variants_check_external_links_once(monkeypatch):
+    texts = [
+        "# Variante uno\n\nFonte [ufficiale](https://fonte.example/dati) e [studio](https://morto.example/studio).\n\n" + "parola " * 300,
+        "# Variante due\n\nFonte [ufficiale](https://fonte.example/dati) e [guida](https://www.esempio.com/blog/guida-seo).\n\n"
+        + "parola " * 300,
+    ]
+
+    def create(**kwargs):
+        usage = types.SimpleNamespace(prompt_tokens=100, completion_tokens=50, total_tokens=150, prompt_tokens_details=None)
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text)) for text in texts[:kwargs['n']]],
+            usage=usage,
+        )
+
+    checked = []
+
+    def check_external_links(urls, **kwargs):
+        checked.append(list(urls))
+        return {url: 404 if 'morto' in url else 200 for url in urls}
+
+    monkeypatch.setattr(app, 'check_external_links', check_external_links)
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    ranked = app.generate_optimized_variants(
+        "## Pagina\n\n" + "testo sulla consulenza seo " * 50, BRAND, "", SITEMAP, "analisi", "suggerimenti", client,
+        n=2, use_cache=False, rate_limiter=app.RateLimiter(rpm=10 ** 6, tpm=10 ** 9, max_concurrent=4),
+    )
+    assert len(checked) == 1
+    assert sorted(set(checked[0])) == ["https://fonte.example/dati", "https://morto.example/studio"]
+    by_title = {app.as_markdown(entry['content']).splitlines()[0]: entry['validation'] for entry in ranked}
+    assert by_title["# Variante uno"]['broken_external'] == ["https://morto.example/studio"]
+    assert by_title["# Variante due"]['broken_external'] == []
+    assert by_title["# Variante due"]['external_links'] == 1
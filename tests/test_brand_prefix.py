@@ -0,0 +1,31 @@
+"""Messaggio di sistema per fase (cache dei prefissi di OpenAI) e prezzo dei token in cache."""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+BRAND = app.BrandProfile("Esempio Srl", "https://www.esempio.com", "Professionale", "Agenzia SEO dal 2004.")
+
+def test_system_prompt_contains_only_its_stage():
+    prompt = BRAND.system_prompt('eeat_analysis', structured=True)
+    assert prompt.startswith(app.EEAT_INSTRUCTIONS)
+    assert app.EEAT_JSON_FORMAT in prompt
+    assert app.OPTIMIZED_CONTENT_INSTRUCTIONS not in prompt
+    assert app.SUGGESTIONS_INSTRUCTIONS not in prompt
+    assert prompt.endswith(BRAND.context)
+
+def test_system_prompt_is_stable_across_pages():
+    again = app.BrandProfile("Esempio Srl", "https://www.esempio.com", "Professionale", "Agenzia SEO dal 2004.")
+    assert BRAND.system_prompt('optimized_content') == again.system_prompt('optimized_content')
+
+def test_cached_tokens_use_the_model_cached_price():
+    # gpt-4.1: input 2.00, in cache 0.50 (non metà prezzo), output 8.00 USD per milione di token
+    cost = app.estimate_cost('gpt-4.1', 1_000_000, 0, cached_prompt_tokens=1_000_000)
+    assert abs(cost - 0.50) < 1e-9
+    cost = app.estimate_cost('gpt-4o-mini', 2_000_000, 1_000_000, cached_prompt_tokens=1_000_000)
+    assert abs(cost - (0.15 + 0.075 + 0.60)) < 1e-9
+    assert app.estimate_cost('modello-sconosciuto', 1000, 1000, cached_prompt_tokens=500) == 0
@@ -0,0 +1,100 @@
+"""Crawler del sito: robots.txt (RFC 9309), User-Agent del crawler e pagine da riscaricare."""
+import io
+import os
+import sys
+import tempfile
+import time
+import types
+
+import requests
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+class FakeSession:
+    """Sessione HTTP che risponde con (status, corpo) per URL e registra gli header inviati"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        self.requests.append((url, dict(headers or {})))
+        status, body = self.responses[url]
+        if isinstance(status, Exception):
+            raise status
+
+        def raise_for_status():
+            if status >= 400:
+                raise requests.HTTPError(f"{status} per {url}")
+
+        return types.SimpleNamespace(
+            status_code=status, text=body, headers={}, raw=io.BytesIO(body.encode('utf-8')),
+            close=lambda: None, raise_for_status=raise_for_status,
+        )
+
+def robots_for(status, body=''):
+    session = FakeSession({'https://ex.com/robots.txt': (status, body)})
+    return app.RobotsPolicy(session), session
+
+def test_missing_robots_allows_everything():
+    robots, _ = robots_for(404)
+    assert robots.allowed('https://ex.com/pagina')
+
+def test_server_error_blocks_the_host():
+    robots, _ = robots_for(503)
+    assert not robots.allowed('https://ex.com/pagina')
+    robots, _ = robots_for(requests.ConnectionError('rete non disponibile'))
+    assert not robots.allowed('https://ex.com/pagina')
+
+def test_rules_and_crawl_delay_for_the_crawler_user_agent():
+    robots, session = robots_for(200, (
+        "User-agent: SEOContentOptimizer\nDisallow: /privato/\nCrawl-delay: 3\n\n"
+        "User-agent: *\nDisallow: /\n"
+    ))
+    assert robots.allowed('https://ex.com/blog/articolo')
+    assert not robots.allowed('https://ex.com/privato/pagina')
+    assert robots.crawl_delay('https://ex.com/blog/articolo') == 3
+    # robots.txt scaricato una sola volta, con lo User-Agent del crawler
+    assert session.requests == [('https://ex.com/robots.txt', {'User-Agent': app.CRAWLER_USER_AGENT})]
+
+def test_page_fetch_sends_the_crawler_user_agent():
+    html = "<html><head><title>Titolo</title></head><body><main><h1>H1</h1><p>uno due tre</p></main></body></html>"
+    session = FakeSession({'https://ex.com/pagina': (200, html)})
+    page = app.fetch_page_metadata('https://ex.com/pagina', session)
+    assert page['title'] == 'Titolo'
+    assert session.requests[0][1]['User-Agent'] == app.CRAWLER_USER_AGENT
+
+def test_needs_refresh_selects_new_changed_and_expired_pages(tmp_path):
+    store = app.PageStore(str(tmp_path / 'pages.sqlite'), max_age=3600, error_retry=600)
+    now = time.time()
+
+    def record(url, lastmod, fetched_at, error=None):
+        return {'url': url, 'lastmod': lastmod, 'title': 't', 'h1': 'h', 'meta_description': 'm',
+                'word_count': 10, 'error': error, 'fetched_at': fetched_at}
+
+    store.save_many([
+        record('https://ex.com/invariata', '2024-01-01', now - 7200),
+        record('https://ex.com/modificata', '2024-01-01', now),
+        record('https://ex.com/recente', None, now),
+        record('https://ex.com/scaduta', None, now - 7200),
+        record('https://ex.com/errore-recente', None, now, error='timeout'),
+        record('https://ex.com/errore-vecchio', None, now - 1200, error='timeout'),
+    ])
+    entries = [
+        {'loc': 'https://ex.com/nuova', 'lastmod': None},
+        {'loc': 'https://ex.com/invariata', 'lastmod': '2024-01-01'},
+        {'loc': 'https://ex.com/modificata', 'lastmod': '2024-02-01'},
+        {'loc': 'https://ex.com/recente', 'lastmod': None},
+        {'loc': 'https://ex.com/scaduta', 'lastmod': None},
+        {'loc': 'https://ex.com/errore-recente', 'lastmod': None},
+        {'loc': 'https://ex.com/errore-vecchio', 'lastmod': None},
+    ]
+    assert [entry['loc'] for entry in store.needs_refresh(entries)] == [
+        'https://ex.com/nuova',
+        'https://ex.com/modificata',
+        'https://ex.com/scaduta',
+        'https://ex.com/errore-vecchio',
+    ]
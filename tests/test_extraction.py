@@ -0,0 +1,43 @@
+"""Estrazione del contenuto HTML: blocchi strutturati e ripiego sul testo del contenitore."""
+import glob
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+BENCH_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'fixtures')
+
+def test_div_only_page_keeps_its_text():
+    html = (
+        "<html><head><title>Servizi</title></head><body><nav>Home Chi siamo Contatti</nav>"
+        "<div class='content'><div>La nostra agenzia offre consulenza SEO alle aziende del territorio.</div>"
+        "<div>Lavoriamo con <span>analisi tecniche</span> e contenuti verificati da esperti.</div>"
+        "Testo libero senza contenitore.</div></body></html>"
+    )
+    page = app.extract_page_content(html)
+    assert "consulenza SEO alle aziende" in page['text']
+    assert "analisi tecniche" in page['text'] and "Testo libero senza contenitore." in page['text']
+    assert "Home Chi siamo" not in page['text']
+    assert page['word_count'] >= 20
+
+def test_table_only_page_keeps_its_text():
+    html = (
+        "<html><body><table><tr><th>Servizio</th><th>Prezzo</th></tr>"
+        "<tr><td>Audit SEO completo del sito</td><td>500 euro</td></tr>"
+        "<tr><td>Ottimizzazione dei contenuti esistenti</td><td>300 euro</td></tr></table></body></html>"
+    )
+    page = app.extract_page_content(html)
+    assert "Audit SEO completo del sito" in page['text'] and "300 euro" in page['text']
+    assert page['word_count'] > 0
+
+def test_structured_pages_still_use_blocks():
+    for path in glob.glob(os.path.join(BENCH_FIXTURES, '*.html')):
+        with open(path, 'rb') as f:
+            page = app.extract_page_content(f.read())
+        # Ogni paragrafo è una riga del testo: nessun ripiego sul testo piatto del contenitore
+        assert len(page['paragraphs']) > 1
+        assert all(paragraph in page['text'].split('\n') for paragraph in page['paragraphs'])
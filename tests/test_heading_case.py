@@ -0,0 +1,36 @@
+"""Correzione deterministica dei titoli: solo quelli in Title Case passano in sentence case."""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+def test_sentence_case_headings_are_left_alone():
+    markdown = "# Perché Google premia l'esperienza a Milano\n\n## Come scegliere un consulente SEO\n\nTesto."
+    fixed, changes = app.fix_heading_case(markdown)
+    assert fixed == markdown and changes == []
+
+def test_title_case_headings_are_fixed():
+    markdown = "# Guida Completa Alla Consulenza SEO Per Esempio Srl\n\n### Il Nostro Metodo Dell'Azienda\n\nTesto."
+    fixed, changes = app.fix_heading_case(markdown, brand_name="Esempio Srl")
+    assert fixed.splitlines()[0] == "# Guida completa alla consulenza SEO per Esempio Srl"
+    assert "### Il nostro metodo dell'azienda" in fixed
+    assert len(changes) == 2
+
+def test_proper_nouns_from_body_keep_their_capitals():
+    markdown = "## Perché Scegliere Milano Come Sede\n\nLa sede di Milano è in centro."
+    fixed, _ = app.fix_heading_case(markdown)
+    assert fixed.splitlines()[0] == "## Perché scegliere Milano come sede"
+
+def test_headings_in_code_blocks_are_ignored():
+    markdown = "```\n# Non Toccare Questo Titolo\n```"
+    assert app.fix_heading_case(markdown) == (markdown, [])
+
+def test_is_title_case():
+    assert app.is_title_case("Contattaci Per Scoprire Le Nostre Soluzioni")
+    assert not app.is_title_case("Contattaci per scoprire le nostre soluzioni")
+    assert not app.is_title_case("Contatti")
+    assert not app.is_title_case("Guida SEO e E-E-A-T per WordPress")
@@ -0,0 +1,60 @@
+"""Coda dei job condivisa tra processi: heartbeat dei worker e ripresa dei job interrotti."""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+def set_heartbeat(queue, job_id, value):
+    with sqlite3.connect(queue.path) as conn:
+        conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE id = ?', (value, job_id))
+
+def test_claim_records_worker_and_heartbeat(tmp_path):
+    queue = app.JobQueue(str(tmp_path / 'jobs.sqlite'))
+    job_id = queue.submit('chiave', 'pagina', {})
+    before = time.time()
+    assert queue.claim(['chiave'], worker='host:123')['id'] == job_id
+    with sqlite3.connect(queue.path) as conn:
+        worker, heartbeat_at = conn.execute('SELECT worker, heartbeat_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    assert worker == 'host:123' and heartbeat_at >= before
+
+def test_new_runner_leaves_jobs_of_live_processes_running(tmp_path):
+    queue = app.JobQueue(str(tmp_path / 'jobs.sqlite'))
+    job_id = queue.submit('chiave', 'pagina', {})
+    queue.claim(['chiave'], worker='altro-host:1')
+    # Un secondo processo si avvia sulla stessa coda
+    app.JobRunner(app.JobQueue(queue.path), workers=0)
+    assert queue.get(job_id)['status'] == 'in_esecuzione'
+
+def test_expired_heartbeat_is_requeued(tmp_path):
+    queue = app.JobQueue(str(tmp_path / 'jobs.sqlite'))
+    alive = queue.submit('chiave', 'viva', {})
+    stopped = queue.submit('chiave', 'ferma', {})
+    queue.claim(['chiave'], worker='host:1')
+    queue.claim(['chiave'], worker='host:2')
+    set_heartbeat(queue, stopped, time.time() - app.JOB_HEARTBEAT_TIMEOUT - 1)
+    set_heartbeat(queue, alive, time.time() - app.JOB_HEARTBEAT_TIMEOUT + 5)
+    queue.heartbeat([alive])
+    assert queue.requeue_interrupted() == 1
+    assert queue.get(alive)['status'] == 'in_esecuzione'
+    assert queue.get(stopped)['status'] == 'in_coda'
+    assert queue.claim(['chiave'], worker='host:3')['id'] == stopped
+
+def test_existing_database_gains_heartbeat_columns(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite')
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            'CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT NOT NULL, label TEXT NOT NULL, '
+            'payload TEXT NOT NULL, status TEXT NOT NULL, error TEXT, metrics TEXT, '
+            'created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+        )
+        conn.execute("INSERT INTO jobs (owner, label, payload, status, created_at) VALUES ('k', 'v', '{}', 'in_esecuzione', 0)")
+    queue = app.JobQueue(path)
+    # Senza heartbeat registrato il job era di un processo precedente: torna in coda
+    assert queue.requeue_interrupted() == 1
+    assert queue.claim(['k'], worker='host:1')['label'] == 'v'
@@ -0,0 +1,78 @@
+"""Documenti lunghi: divisione in blocchi, reduce delle analisi e riscrittura blocco per blocco."""
+import functools
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+def paragraph(n, words=40):
+    return f"Paragrafo {n}: " + ' '.join(f"parola{i}" for i in range(words)) + '.'
+
+def analysis(score, weaknesses=()):
+    return app.EEATAnalysisResult(
+        scores={c.lower(): score for c in app.EEAT_CRITERIA},
+        analysis={c.lower(): f"analisi {score}" for c in app.EEAT_CRITERIA},
+        strengths=[f"forza {score}"],
+        weaknesses=list(weaknesses) or [f"debolezza {score}"],
+    )
+
+def test_short_sections_are_merged_into_one_chunk():
+    chunks = app.chunk_content("# Guida\n\nIntroduzione breve.\n\n## Dettagli\n\nAltro testo breve.")
+    assert len(chunks) == 1
+    assert chunks[0]['heading'] == "Guida (+1 sezione)"
+    assert "Introduzione breve." in chunks[0]['text'] and "Altro testo breve." in chunks[0]['text']
+
+def test_long_section_is_split_by_paragraph_within_the_limit():
+    paragraphs = [paragraph(n) for n in range(20)]
+    content = "## Lunga\n\n" + '\n\n'.join(paragraphs)
+    chunks = app.chunk_content(content, max_tokens=200)
+    assert len(chunks) > 1
+    assert all(chunk['tokens'] <= 200 for chunk in chunks)
+    assert chunks[0]['heading'] == "Lunga"
+    assert chunks[1]['heading'] == "Lunga (parte 2)"
+    # Nessun paragrafo perso o riordinato
+    text = '\n\n'.join(chunk['text'] for chunk in chunks)
+    positions = [text.index(p) for p in paragraphs]
+    assert positions == sorted(positions)
+
+def test_reduce_weights_scores_by_chunk_length_and_keeps_chunk_order():
+    chunks = [{'heading': 'Uno', 'tokens': 300, 'text': ''}, {'heading': 'Due', 'tokens': 100, 'text': ''}]
+    result = app.reduce_eeat_analyses(chunks, [analysis(8), analysis(4, ["manca l'autore"])])
+    assert result.scores == {c.lower(): 7 for c in app.EEAT_CRITERIA}
+    assert '"Due"' in result.analysis['experience']
+    assert result.weaknesses[0] == "manca l'autore"
+    assert [section['heading'] for section in result.sections] == ['Uno', 'Due']
+    assert result.sections[1]['weaknesses'] == ["manca l'autore"]
+
+def test_rewrite_uses_findings_by_chunk_index_and_real_links(monkeypatch):
+    content = "## FAQ\n\n" + paragraph(1) + "\n\n## FAQ\n\n" + paragraph(2)
+    # Un blocco per sezione: due sezioni con lo stesso titolo
+    max_tokens = max(app.count_tokens(section['text']) for section in app.split_sections(content))
+    monkeypatch.setattr(app, 'chunk_content', functools.partial(app.chunk_content, max_tokens=max_tokens))
+    chunks = app.chunk_content(content)
+    assert [chunk['heading'] for chunk in chunks] == ['FAQ', 'FAQ']
+    eeat = app.reduce_eeat_analyses(chunks, [analysis(8, ["difetto del primo"]), analysis(3, ["difetto del secondo"])])
+
+    prompts = {}
+
+    def fake_rewrite_section(chunk, analysis_text, brand_info, outline, internal_links, openai_client, **llm_options):
+        prompts[chunk['text']] = analysis_text
+        if 'Paragrafo 1' in chunk['text']:
+            return "## FAQ\n\nVedi [il servizio](/servizi/seo/) e la pagina https://ex.com/contatti citata senza link."
+        return "## FAQ\n\nLeggi [il blog](https://www.ex.com/blog)."
+
+    monkeypatch.setattr(app, 'rewrite_section', fake_rewrite_section)
+    monkeypatch.setattr(app, 'select_internal_links', lambda sitemap_urls, text, k=5: [])
+    sitemap_urls = ['https://ex.com/servizi/seo', 'https://ex.com/blog', 'https://ex.com/contatti', 'https://ex.com/servizi']
+    result = app.rewrite_long_content(
+        content, {'nome': 'Esempio', 'url': 'https://ex.com'}, sitemap_urls, eeat, "suggerimenti", None, structured=True
+    )
+
+    first, second = (prompts[chunk['text']] for chunk in chunks)
+    assert "difetto del primo" in first and "difetto del secondo" not in first
+    assert "difetto del secondo" in second and "difetto del primo" not in second
+    assert result.internal_links_used == ['https://ex.com/servizi/seo', 'https://ex.com/blog']
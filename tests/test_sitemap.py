@@ -0,0 +1,39 @@
+"""Parsing delle sitemap: solo loc/lastmod del namespace delle sitemap, ignorando le estensioni."""
+import io
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+def test_extension_locs_do_not_replace_page_urls():
+    urls = []
+    app._parse_sitemap_document(
+        io.BytesIO(read_fixture('sitemap_extensions.xml').encode('utf-8')),
+        on_url=lambda loc, lastmod: urls.append((loc, lastmod)),
+        on_child_sitemap=lambda loc: None,
+    )
+    assert urls == [
+        ('https://ex.com/page-a', '2024-03-01'),
+        ('https://ex.com/page-b', None),
+        ('https://ex.com/page-c', '2024-03-03'),
+    ]
+
+def test_sitemap_entries_from_direct_xml():
+    entries = list(app.iter_sitemap_entries(read_fixture('sitemap_extensions.xml')))
+    assert [entry['loc'] for entry in entries] == ['https://ex.com/page-a', 'https://ex.com/page-b', 'https://ex.com/page-c']
+
+def test_sitemap_without_namespace_and_index():
+    urls, children = [], []
+    xml = "<sitemapindex><sitemap><loc>https://ex.com/sitemap-1.xml</loc></sitemap></sitemapindex>"
+    app._parse_sitemap_document(io.BytesIO(xml.encode('utf-8')), lambda loc, lastmod: urls.append(loc), children.append)
+    assert children == ['https://ex.com/sitemap-1.xml'] and urls == []
@@ -0,0 +1,36 @@
+"""Streaming delle risposte: callback limitato nel tempo e testo finale completo."""
+import os
+import sys
+import tempfile
+import types
+
+os.environ.setdefault('SEO_OPTIMIZER_CACHE_DIR', tempfile.mkdtemp(prefix='seo-test-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+class FakeStream:
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def __iter__(self):
+        for piece in self.pieces:
+            delta = types.SimpleNamespace(content=piece)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+        usage = types.SimpleNamespace(prompt_tokens=10, completion_tokens=len(self.pieces), total_tokens=10 + len(self.pieces))
+        yield types.SimpleNamespace(choices=[], usage=usage)
+
+    def close(self):
+        pass
+
+def test_on_token_is_throttled_and_receives_full_text():
+    pieces = [f"parola{i} " for i in range(20000)]
+    completions = types.SimpleNamespace(create=lambda **kwargs: FakeStream(pieces))
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    received = []
+    text, usage, cancelled = app._stream_completion(
+        client, "gpt-4o-mini", [{"role": "user", "content": "ciao"}], 100, 0.3, received.append, None, None
+    )
+    assert text == ''.join(pieces) and not cancelled
+    assert received[-1] == text
+    assert len(received) < len(pieces) / 10